@@ -0,0 +1,126 @@
+"""
+    Static analysis of an instance, run before any search. It looks only at the quantities, the capacities
+    and the combination rules, and either proves that the final state can't be reached or finds a lower
+    bound of the number of moves of every solution, used to skip the first IDA* iterations.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+from functools import reduce
+from math import ceil, gcd
+from time import perf_counter
+from typing import Callable, List, Optional
+
+import color
+from graph import Graph
+
+
+def plural(count: int, noun: str) -> str:
+    return f"{count} {noun}" if count == 1 else f"{count} {noun}s"
+
+
+@dataclass
+class Analysis:
+    # why the final state can't be reached, None if it may be
+    infeasible_reason: Optional[str]
+    # no solution has fewer moves
+    lower_bound: int
+    seconds: float
+
+    @property
+    def feasible(self) -> bool:
+        return self.infeasible_reason is None
+
+    def report(self) -> str:
+        if self.feasible:
+            verdict = f"every solution needs at least {plural(self.lower_bound, 'move')}"
+        else:
+            verdict = f"no solution, {self.infeasible_reason}; the searches are skipped"
+        return f"Pre-analysis: {verdict}. Finished in {self.seconds * 1000:.2f} ms.\n"
+
+
+def quantity_reason(gr: Graph) -> Optional[str]:
+    """
+        Pouring keeps the water, but the water of an undefined color can't be used anymore
+    """
+    if gr.root.usable_qty < gr.final_state_total_qty:
+        return f"the containers hold {gr.root.usable_qty} usable liters and the final state needs " \
+               f"{gr.final_state_total_qty}"
+    return None
+
+
+def capacity_reason(gr: Graph) -> Optional[str]:
+    """
+        Every container of the final state has to be a different container, large enough for its quantity
+    """
+    if len(gr.final_state) > len(gr.capacities):
+        return f"the final state has {len(gr.final_state)} containers and there are only {len(gr.capacities)}"
+
+    capacities = sorted(gr.capacities, reverse=True)
+    quantities = sorted((cont.occupied for cont in gr.final_state), reverse=True)
+    for capacity, quantity in zip(capacities, quantities):
+        if quantity > capacity:
+            needed = sum(1 for other in quantities if other >= quantity)
+            fitting = sum(1 for other in capacities if other >= quantity)
+            return f"{plural(needed, 'container')} of the final state hold at least {quantity} liters, " \
+                   f"only {plural(fitting, 'container')} can"
+    return None
+
+
+def divisibility_reason(gr: Graph) -> Optional[str]:
+    """
+        A move pours either the whole source or the free space of the target, so every quantity
+        stays a multiple of the greatest common divisor of the capacities and of the initial quantities
+    """
+    divisor = reduce(gcd, gr.capacities + tuple(occupied for occupied, _ in gr.root.state), 0)
+    if divisor > 1:
+        for cont in gr.final_state:
+            if cont.occupied % divisor != 0:
+                return f"every quantity stays a multiple of {divisor}, the final state needs {cont.occupied} liters"
+    return None
+
+
+def color_reason(gr: Graph) -> Optional[str]:
+    """
+        A missing color has to be mixed from the colors found in the containers. A color no rule
+        produces (a basic color) can only be poured, never obtained, so it can't grow in quantity either.
+    """
+    tables = gr.color_tables
+    present = gr.root.color_mask
+    for position in color.iter_bits(gr.final_colors_mask & ~present):
+        if tables.expand_missing(1 << position, present) == -1:
+            return f"the color `{tables.names[position]}` can't be obtained"
+
+    initial_qty, final_qty = Counter(), Counter()
+    for occupied, code in gr.root.state:
+        initial_qty[code] += occupied
+    for cont in gr.final_state:
+        final_qty[cont.color] += cont.occupied
+    for code, quantity in final_qty.items():
+        if not tables.bits[code] & tables.decomposable and quantity > initial_qty[code]:
+            return f"the final state needs {quantity} liters of the basic color `{tables.names[code]}` " \
+                   f"and there are only {initial_qty[code]}"
+    return None
+
+
+CHECKS: List[Callable[[Graph], Optional[str]]] = [quantity_reason, capacity_reason, divisibility_reason, color_reason]
+
+
+def lower_bound(gr: Graph) -> int:
+    """
+        Every color mixed by all the ways of obtaining the missing colors takes at least one move, and a move
+        changes two containers, so it matches at most two more containers of the final state
+    """
+    present = gr.root.color_mask
+    mixes = color.popcount(gr.color_tables.expand_missing(gr.final_colors_mask & ~present, present))
+    unmatched = len(gr.final_state) - gr.root.matched
+    return max(mixes, ceil(unmatched / 2))
+
+
+def analyze(gr: Graph) -> Analysis:
+    start_time = perf_counter()
+    for check in CHECKS:
+        reason = check(gr)
+        if reason is not None:
+            return Analysis(reason, 0, perf_counter() - start_time)
+    return Analysis(None, lower_bound(gr), perf_counter() - start_time)
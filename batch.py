@@ -0,0 +1,113 @@
+import multiprocessing
+import traceback
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection, wait
+from time import monotonic
+from typing import Callable, List, Tuple, Optional
+
+TIMEOUT_MESSAGE = "Solution stopped due to timeout\n"
+
+
+class PipeWriter:
+    """
+        File-like object that forwards everything written to the parent process, together with
+        the records sent by the task (anything but text)
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+
+    def write(self, text: str) -> int:
+        self.conn.send(text)
+        return len(text)
+
+    def writelines(self, lines) -> None:
+        for line in lines:
+            self.conn.send(line)
+
+    def send_record(self, record) -> None:
+        self.conn.send(record)
+
+
+@dataclass
+class TaskOutput:
+    text: str
+    # what the task sent with `PipeWriter.send_record`, in order
+    records: list
+
+
+def _run_task(conn: Connection, task: Callable, task_args: Tuple) -> None:
+    try:
+        task(PipeWriter(conn), *task_args)
+    except Exception:
+        conn.send(f"Task failed:\n{traceback.format_exc()}\n")
+    finally:
+        conn.send(None)
+        conn.close()
+
+
+@dataclass
+class _RunningTask:
+    index: int
+    process: multiprocessing.Process
+    conn: Connection
+    deadline: Optional[float]
+    chunks: List[str] = field(default_factory=list)
+    records: list = field(default_factory=list)
+
+
+def run_batch(tasks: List[Tuple[Callable, Tuple]], jobs: int, timeout: float = 0,
+              timeout_message: str = TIMEOUT_MESSAGE) -> List[TaskOutput]:
+    """
+        Runs every `task(output_f, *task_args)` in its own process, at most `jobs` at a time.
+        A task still running `timeout` seconds after it started is terminated by the pool,
+        what it wrote and sent until then is kept and its text is followed by `timeout_message`.
+
+    :return: the output of every task, in the order of `tasks`
+    """
+    outputs: List[Optional[TaskOutput]] = [None] * len(tasks)
+    pending = list(enumerate(tasks))
+    pending.reverse()
+    running: List[_RunningTask] = []
+
+    def finish(running_task: _RunningTask, suffix: str = '') -> None:
+        running_task.conn.close()
+        running_task.process.join()
+        outputs[running_task.index] = TaskOutput(''.join(running_task.chunks) + suffix, running_task.records)
+        running.remove(running_task)
+
+    while pending or running:
+        while pending and len(running) < jobs:
+            index, (task, task_args) = pending.pop()
+            parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_run_task, args=(child_conn, task, task_args), daemon=True)
+            process.start()
+            child_conn.close()
+            deadline = monotonic() + timeout if timeout > 0 else None
+            running.append(_RunningTask(index, process, parent_conn, deadline))
+
+        deadlines = [running_task.deadline for running_task in running if running_task.deadline is not None]
+        wait_time = max(0.0, min(deadlines) - monotonic()) if deadlines else None
+        ready = wait([running_task.conn for running_task in running], wait_time)
+
+        for running_task in list(running):
+            if running_task.conn in ready:
+                try:
+                    while running_task.conn.poll():
+                        chunk = running_task.conn.recv()
+                        if chunk is None:
+                            finish(running_task)
+                            break
+                        if isinstance(chunk, str):
+                            running_task.chunks.append(chunk)
+                        else:
+                            running_task.records.append(chunk)
+                except EOFError:
+                    finish(running_task, "Task exited unexpectedly\n")
+                continue
+
+            if running_task.deadline is not None and monotonic() >= running_task.deadline:
+                running_task.process.terminate()
+                finish(running_task, timeout_message)
+
+    return outputs
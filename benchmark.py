@@ -0,0 +1,282 @@
+"""
+    Benchmark harness: generates instances in the input file format, runs every algorithm/heuristic pair
+    of main.py on them and writes the results as JSON/CSV. With --baseline the results are compared
+    against a previous JSON report and the regressions are listed. HDA* runs once for every number of
+    workers in --hda-workers, its speedup over one worker and the successors it sent are listed.
+"""
+
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass, asdict
+from time import perf_counter_ns
+from typing import List, Optional, Dict, Tuple
+
+import color
+import main
+from container import Container
+from graph import Graph, HEURISTIC_DESCRIPTIONS
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+RESULT_FIELDS = ('instance', 'algorithm', 'heuristic', 'workers', 'wall_time_ns', 'nodes_generated',
+                 'nodes_expanded', 'max_open', 'max_closed', 'peak_rss_kb', 'solutions', 'best_cost', 'stopped',
+                 'nodes_sent', 'batches_sent', 'error')
+
+
+@dataclass
+class InstanceParams:
+    containers: int = 6
+    max_capacity: int = 7
+    base_colors: int = 3
+    rules: int = 3
+    depth: int = 4
+    goal_containers: int = 2
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        return f"gen_c{self.containers}_cap{self.max_capacity}_col{self.base_colors}_r{self.rules}" \
+               f"_d{self.depth}_s{self.seed}.txt"
+
+
+def generate_instance(params: InstanceParams) -> str:
+    """
+        Builds a random instance: `rules` combination rules over `base_colors` colors, `containers` random
+        containers and a final state read from the state reached by a random walk of `depth` moves,
+        so the instance is solvable in at most `depth` steps
+    """
+    rng = random.Random(params.seed)
+    for _ in range(100):
+        color_names = [f"c{k}" for k in range(params.base_colors)]
+        rules = []
+        used_pairs = set()
+        for k in range(params.rules):
+            pair = tuple(sorted(rng.sample(color_names, 2)))
+            if pair in used_pairs:
+                continue
+            used_pairs.add(pair)
+            rules.append((pair[0], pair[1], f"m{k}"))
+            color_names.append(f"m{k}")
+
+        containers = []
+        for _ in range(params.containers):
+            max_cap = rng.randint(1, params.max_capacity)
+            occupied = rng.randint(0, max_cap)
+            containers.append((max_cap, occupied, rng.choice(color_names[:params.base_colors]) if occupied else None))
+
+        color_srv = color.ColorSrv()
+        for color_l, color_r, color_f in rules:
+            color_srv.add_combination(color_srv.add_color(color_l), color_srv.add_color(color_r),
+                                      color_srv.add_color(color_f))
+        init_state = [Container(max_cap, occupied, color_srv.add_color(name) if occupied else 0)
+                      for max_cap, occupied, name in containers]
+        gr = Graph([], init_state, 1, color_srv=color_srv)
+
+        state = gr.root.state
+        for _ in range(params.depth):
+            moves = gr.legal_moves(state)
+            if not moves:
+                break
+            state = gr.apply_move(state, *rng.choice(moves))
+
+        candidates = [(occupied, code) for occupied, code in state if occupied != 0 and code > 0]
+        if len(candidates) < params.goal_containers:
+            continue
+        final_state = rng.sample(candidates, params.goal_containers)
+
+        lines = [f"{color_l} {color_r} {color_f}" for color_l, color_r, color_f in rules]
+        lines.append(main.INIT_STATE_LINE_SEPARATOR)
+        for max_cap, occupied, name in containers:
+            lines.append(f"{max_cap} {occupied} {name}" if occupied else f"{max_cap} 0")
+        lines.append(main.FINAL_STATE_LINE_SEPARATOR)
+        lines.extend(f"{occupied} {color_srv.get_color(code)}" for occupied, code in final_state)
+        return '\n'.join(lines)
+
+    raise ValueError(f"Could not generate an instance for {params}")
+
+
+def _measure(conn, input_path: str, algorithm: str, h_code: Optional[int], n_sol: int, timeout: int,
+             options: dict) -> None:
+    try:
+        gr = main.read_input(input_path, n_sol)
+        if h_code is not None:
+            gr.set_heuristic(h_code)
+        start = perf_counter_ns()
+        stats = main.ALGORITHMS[algorithm](io.StringIO(), gr, n_sol, timeout, **options)
+        wall_time_ns = perf_counter_ns() - start
+        result = asdict(stats)
+        result['wall_time_ns'] = wall_time_ns
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+        conn.send(result)
+    except Exception as exc:
+        conn.send({'error': repr(exc)})
+    finally:
+        conn.close()
+
+
+def run_pair(input_path: str, algorithm: str, h_code: Optional[int], n_sol: int, timeout: int,
+             options: dict) -> dict:
+    """
+        Runs one algorithm/heuristic pair in a fresh process, so the peak RSS belongs to this run only
+    """
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_measure,
+                                      args=(child_conn, input_path, algorithm, h_code, n_sol, timeout, options))
+    process.start()
+    child_conn.close()
+    # the algorithm enforces the timeout itself, the grace period only catches a stuck run
+    result = {'error': 'killed'}
+    if parent_conn.poll(timeout + 5 if timeout else None):
+        try:
+            result = parent_conn.recv()
+        except EOFError:
+            result = {'error': 'crashed'}
+    process.terminate()
+    process.join()
+
+    record = {field: None for field in RESULT_FIELDS}
+    record.update({'instance': os.path.basename(input_path), 'algorithm': algorithm, 'heuristic': h_code,
+                   'workers': options.get('workers')})
+    costs = result.pop('solution_costs', [])
+    record.update({key: value for key, value in result.items() if key in record})
+    record['solutions'] = len(costs)
+    record['best_cost'] = min(costs) if costs else None
+    return record
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float, min_wall_time_ns: int = 0) -> List[str]:
+    """
+        Lists the runs that got slower than `tolerance` allows, expanded more nodes or lost solution quality.
+        Runs faster than `min_wall_time_ns` are too noisy to be compared by time.
+    """
+    def key(record):
+        return record['instance'], record['algorithm'], record['heuristic'], record.get('workers')
+
+    baseline_by_key: Dict[Tuple, dict] = {key(record): record for record in baseline}
+    regressions = []
+    for record in results:
+        base = baseline_by_key.get(key(record))
+        if base is None or base.get('error') or record.get('error'):
+            if record.get('error') and base is not None and not base.get('error'):
+                regressions.append(f"{key(record)}: failed with {record['error']}")
+            continue
+
+        if record['wall_time_ns'] >= min_wall_time_ns \
+                and record['wall_time_ns'] > base['wall_time_ns'] * (1 + tolerance):
+            regressions.append(f"{key(record)}: wall time {record['wall_time_ns']} ns, "
+                               f"baseline {base['wall_time_ns']} ns")
+        if record['nodes_expanded'] > base['nodes_expanded'] and not record['stopped']:
+            regressions.append(f"{key(record)}: expanded {record['nodes_expanded']} nodes, "
+                               f"baseline {base['nodes_expanded']}")
+        if base['best_cost'] is not None and (record['best_cost'] is None or record['best_cost'] > base['best_cost']):
+            regressions.append(f"{key(record)}: best cost {record['best_cost']}, baseline {base['best_cost']}")
+    return regressions
+
+
+def speedups(results: List[dict]) -> List[str]:
+    """
+        The wall time of every finished HDA* run compared with the one worker run on the same instance
+        and heuristic, with the share of the generated successors sent to other workers
+    """
+    single = {(record['instance'], record['heuristic']): record for record in results
+              if record['algorithm'] == 'hda_star' and record['workers'] == 1}
+    lines = []
+    for record in results:
+        base = single.get((record['instance'], record['heuristic']))
+        if record['algorithm'] != 'hda_star' or base is None or record['error'] or base['error'] \
+                or record['stopped'] or base['stopped']:
+            continue
+        sent = record['nodes_sent'] / record['nodes_generated'] if record['nodes_generated'] else 0
+        lines.append(f"{record['instance']} h{record['heuristic']} workers={record['workers']}: "
+                     f"speedup {base['wall_time_ns'] / record['wall_time_ns']:.2f}, "
+                     f"{100 * sent:.1f}% of the successors sent in {record['batches_sent']} batches")
+    return lines
+
+
+def int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',')]
+
+
+parser = ArgumentParser(description='Benchmark of the water containers solvers')
+parser.add_argument('--instances-dir', default='./bench_input', help='Folder for the generated instances')
+parser.add_argument('--input', default=None, help='Folder with existing instances to benchmark as well')
+parser.add_argument('--containers', type=int_list, default=[6], help='Comma separated numbers of containers')
+parser.add_argument('--max-capacity', type=int_list, default=[7], help='Comma separated maximal capacities')
+parser.add_argument('--base-colors', type=int_list, default=[3], help='Comma separated numbers of base colors')
+parser.add_argument('--rules', type=int_list, default=[3], help='Comma separated numbers of combination rules')
+parser.add_argument('--depth', type=int_list, default=[4], help='Comma separated random walk lengths')
+parser.add_argument('--seeds', type=int, default=1, help='Number of instances for every parameter combination')
+parser.add_argument('-a', '--algorithms', default=main.DEFAULT_ALGORITHMS,
+                    help='Comma separated algorithms run with every heuristic (UCS always runs)')
+parser.add_argument('--heuristics', type=int_list, default=list(HEURISTIC_DESCRIPTIONS),
+                    help='Comma separated heuristic codes')
+parser.add_argument('--hda-workers', type=int_list, default=[1, 2, 4],
+                    help='Comma separated numbers of HDA* workers')
+parser.add_argument('-n', '--nsol', type=int, default=1, help='Number of generated solutions')
+parser.add_argument('-t', '--timeout', type=int, default=10, help='Number of seconds till timeout of every run')
+parser.add_argument('--json', default='bench_results.json', help='JSON report')
+parser.add_argument('--csv', default=None, help='CSV report')
+parser.add_argument('--baseline', default=None, help='JSON report to compare against')
+parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative wall time increase')
+parser.add_argument('--min-time-ns', type=int, default=10_000_000,
+                    help='Runs faster than this are not compared by wall time')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    os.makedirs(args.instances_dir, exist_ok=True)
+    input_paths = []
+    for containers, max_capacity, base_colors, rules, depth, seed in itertools.product(
+            args.containers, args.max_capacity, args.base_colors, args.rules, args.depth, range(args.seeds)):
+        params = InstanceParams(containers, max_capacity, base_colors, rules, depth, seed=seed)
+        input_path = os.path.join(args.instances_dir, params.name)
+        with open(input_path, 'w') as f_out:
+            f_out.write(generate_instance(params))
+        input_paths.append(input_path)
+    if args.input:
+        input_paths.extend(os.path.join(args.input, name) for name in sorted(os.listdir(args.input)))
+
+    pairs = [('ucs', None)] + [(algorithm, h_code) for h_code in args.heuristics
+                               for algorithm in args.algorithms.split(',')]
+    runs = []
+    for algorithm, h_code in pairs:
+        if algorithm == 'hda_star':
+            runs.extend((algorithm, h_code, {'workers': workers}) for workers in args.hda_workers)
+        else:
+            runs.append((algorithm, h_code, {'max_nodes': main.SMA_MAX_NODES} if algorithm == 'sma_star' else {}))
+    results = []
+    for input_path in input_paths:
+        for algorithm, h_code, options in runs:
+            record = run_pair(input_path, algorithm, h_code, args.nsol, args.timeout, options)
+            print(json.dumps(record))
+            results.append(record)
+
+    with open(args.json, 'w') as f_json:
+        json.dump(results, f_json, indent=2)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f_csv:
+            writer = csv.DictWriter(f_csv, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+    for line in speedups(results):
+        print("SPEEDUP", line)
+
+    if args.baseline:
+        with open(args.baseline) as f_baseline:
+            regressions = compare(results, json.load(f_baseline), args.tolerance, args.min_time_ns)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,91 @@
+"""
+    Limits of one search run: a wall-clock deadline, a number of expansions and a memory bound
+    (nodes kept by the search or peak RSS). The clock and the RSS are only polled every
+    `check_interval` calls, so checking the budget on every expansion stays cheap.
+"""
+
+from time import perf_counter
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+STOP_TIMEOUT = 'timeout'
+STOP_EXPANSIONS = 'expansions'
+STOP_MEMORY = 'memory'
+STOP_CANCELLED = 'cancelled'
+CHECK_INTERVAL = 32
+
+
+class SearchBudget:
+    """
+        `timeout` in (float) seconds, `max_expansions` expanded nodes, `max_in_memory` nodes counted by
+        the search (open + closed) and `max_rss_kb` peak resident memory; 0 disables a limit.
+        The search is also stopped once `cancel_event` (a threading or multiprocessing Event) is set.
+    """
+
+    def __init__(self, timeout: float = 0, max_expansions: int = 0, max_in_memory: int = 0, max_rss_kb: int = 0,
+                 check_interval: int = CHECK_INTERVAL, cancel_event=None):
+        self.timeout = timeout
+        self.max_expansions = max_expansions
+        self.max_in_memory = max_in_memory
+        self.max_rss_kb = max_rss_kb if resource is not None else 0
+        self.check_interval = check_interval
+        self.cancel_event = cancel_event
+        self.deadline: Optional[float] = None
+        self.expansions = 0
+        self.countdown = 0
+        self.reason: Optional[str] = None
+
+    def start(self) -> 'SearchBudget':
+        self.deadline = perf_counter() + self.timeout if self.timeout > 0 else None
+        self.expansions = 0
+        self.countdown = 0
+        self.reason = None
+        return self
+
+    def exhausted(self, in_memory: int = 0) -> bool:
+        """
+            Counts one expansion and checks the limits, `in_memory` is the number of nodes the search keeps
+        :return: True once a limit is reached, the limit is kept in `reason`
+        """
+        self.expansions += 1
+        if self.max_expansions and self.expansions > self.max_expansions:
+            self.reason = STOP_EXPANSIONS
+        elif self.max_in_memory and in_memory > self.max_in_memory:
+            self.reason = STOP_MEMORY
+        else:
+            self.countdown -= 1
+            if self.countdown > 0:
+                return False
+            self.countdown = self.check_interval
+            if self.deadline is not None and perf_counter() >= self.deadline:
+                self.reason = STOP_TIMEOUT
+            elif self.cancel_event is not None and self.cancel_event.is_set():
+                self.reason = STOP_CANCELLED
+            elif self.max_rss_kb and resource.getrusage(resource.RUSAGE_SELF).ru_maxrss > self.max_rss_kb:
+                self.reason = STOP_MEMORY
+            else:
+                return False
+        return True
+
+    def update(self, expansions: int, in_memory: int = 0) -> bool:
+        """
+            Sets the number of expansions made so far (counted elsewhere, by worker processes)
+            and checks every limit right away
+        :return: True once a limit is reached
+        """
+        self.expansions = expansions - 1
+        self.countdown = 0
+        return self.exhausted(in_memory)
+
+    def stop_message(self) -> str:
+        if self.reason == STOP_EXPANSIONS:
+            return f"Solution stopped after {self.max_expansions} expansions\n"
+        if self.reason == STOP_MEMORY:
+            return "Solution stopped due to the memory budget\n"
+        if self.reason == STOP_CANCELLED:
+            return "Solution stopped because the request was cancelled\n"
+        return "Solution stopped due to timeout\n"
@@ -1,31 +1,135 @@
+from dataclasses import dataclass
 from itertools import combinations, chain
 
 from bidict import Bidict
-from typing import Set, List, Union
+from typing import Union, Tuple
 
 
-class Singleton(type):
+def iter_bits(mask: int):
     """
-        metaclass with Singleton behavior
+        Yields the positions of the set bits of `mask`
     """
-    _instances = {}
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
 
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
 
+def popcount(mask: int) -> int:
+    return bin(mask).count('1')
 
-class ColorSrv(metaclass=Singleton):
+
+@dataclass(frozen=True)
+class ColorTables:
+    """
+        Immutable lookup tables compiled from the combination rules.
+        Every table is indexed by color code, the undefined color (-1) is the last entry
+        so Python's negative indexing resolves it directly. A color with code `c` is
+        represented in color masks by the bit `bits[c]`.
+    """
+    # mix[code_from][code_to] is the color obtained by pouring `code_from` over `code_to`
+    mix: Tuple[Tuple[int, ...], ...]
+    bits: Tuple[int, ...]
+    # union of the ingredients of every rule producing the color, 0 if no rule produces it
+    ingredients: Tuple[int, ...]
+    # mask of the colors produced by at least one rule
+    decomposable: int
+    # the (ingredient, ingredient) positions of every rule producing the color
+    recipes: Tuple[Tuple[Tuple[int, int], ...], ...]
+    # some color is produced by more than one rule
+    multi_recipe: bool
+    # the names printed for every color
+    names: Tuple[str, ...]
+
+    def color_mask(self, codes) -> int:
+        mask = 0
+        bits = self.bits
+        for code in codes:
+            mask |= bits[code]
+        return mask
+
+    def expand_missing(self, missing: int, present: int) -> int:
+        """
+            Recursively decomposes the `missing` colors into ingredients not found in `present`
+        :return: the mask of every color that has to be mixed, or -1 if one of them can't be obtained
+        """
+        if self.multi_recipe:
+            return self.expand_recipes(missing, present)
+
+        ingredients, decomposable = self.ingredients, self.decomposable
+        expanded = 0
+        while missing:
+            if missing & ~decomposable:
+                return -1
+            expanded |= missing
+            needed = 0
+            for position in iter_bits(missing):
+                needed |= ingredients[position]
+            missing = needed & ~present & ~expanded
+        return expanded
+
+    def expand_recipes(self, missing: int, present: int) -> int:
+        """
+            `expand_missing` when a color has several rules, only one of them has to be followed: a color
+            has to be mixed if it's mixed by every way of obtaining a missing color. The colors mixed by every
+            way of obtaining each color are found from the `present` colors up, until nothing changes.
+        """
+        bits, recipes = self.bits, self.recipes
+        required = {}
+        changed = True
+        while changed:
+            changed = False
+            for position in iter_bits(self.decomposable & ~present):
+                common = None
+                for recipe in recipes[position]:
+                    needed = 0
+                    for ingredient in recipe:
+                        if not present & bits[ingredient]:
+                            if ingredient not in required:
+                                break
+                            needed |= required[ingredient]
+                    else:
+                        common = needed if common is None else common & needed
+                if common is not None:
+                    common |= bits[position]
+                    if required.get(position) != common:
+                        required[position] = common
+                        changed = True
+
+        expanded = 0
+        for position in iter_bits(missing):
+            if position not in required:
+                return -1
+            expanded |= required[position]
+        return expanded
+
+
+class ColorSrv:
+    """
+        Colors and combination rules of one problem instance
+    """
     def __init__(self):
         self.colors = Bidict()
         self.combinations = Bidict()
         self.nextCode = 1
+        self.tables = None
 
     def reset(self):
         self.colors = Bidict()
         self.combinations = Bidict()
         self.nextCode = 1
+        self.tables = None
+
+    def copy(self) -> 'ColorSrv':
+        """
+            An independent color service with the same colors and rules, sharing the compiled (immutable) tables
+        """
+        color_srv = ColorSrv()
+        color_srv.colors = Bidict(self.colors)
+        color_srv.combinations = Bidict(self.combinations)
+        color_srv.nextCode = self.nextCode
+        color_srv.tables = self.tables
+        return color_srv
 
     def add_color(self, color: str) -> int:
         """
@@ -37,6 +141,7 @@ class ColorSrv(metaclass=Singleton):
         if color not in self.colors.keys():
             self.colors[color] = self.nextCode
             self.nextCode += 1
+            self.tables = None
 
         return self.colors[color]
 
@@ -69,6 +174,7 @@ class ColorSrv(metaclass=Singleton):
 
         self.combinations[(code_l, code_r)] = code_f
         self.combinations[(code_r, code_l)] = code_f
+        self.tables = None
 
     def get_combination_result(self, code_l: int, code_r: int) -> int:
         """
@@ -93,3 +199,32 @@ class ColorSrv(metaclass=Singleton):
         chained = chain(*dec)
         lst = list(chained)
         return lst
+
+    def compile(self) -> ColorTables:
+        """
+            Compiles the combination rules into lookup tables, the result is cached until a color or a rule is added
+        """
+        if self.tables is not None:
+            return self.tables
+
+        codes = list(range(self.nextCode)) + [-1]
+        bits = tuple(1 << position for position in range(len(codes)))
+        mix = tuple(tuple(self.get_combination_result(code_l, code_r) for code_r in codes) for code_l in codes)
+
+        ingredients = [0] * len(codes)
+        decomposable = 0
+        for code in codes:
+            if code in self.combinations.inverse.keys():
+                decomposable |= bits[code]
+                for ingredient in self.deconstruct_color(code):
+                    ingredients[code] |= bits[ingredient]
+
+        recipes = [set() for _ in codes]
+        for (code_l, code_r), code_f in self.combinations.items():
+            recipes[code_f].add((min(code_l, code_r), max(code_l, code_r)))
+        multi_recipe = any(len(color_recipes) > 1 for color_recipes in recipes)
+
+        names = tuple(self.get_color(code) for code in codes)
+        self.tables = ColorTables(mix, bits, tuple(ingredients), decomposable,
+                                  tuple(tuple(sorted(color_recipes)) for color_recipes in recipes), multi_recipe, names)
+        return self.tables
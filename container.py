@@ -1,4 +1,10 @@
 from dataclasses import dataclass, field
+from typing import List, Tuple
+
+PackedContainer = Tuple[int, int]
+PackedState = Tuple[PackedContainer, ...]
+# the state hashes are sums of 64 bit keys, kept modulo 2^64
+HASH_MASK = (1 << 64) - 1
 
 
 @dataclass
@@ -10,4 +16,15 @@ class Container:
     def __hash__(self):
         return hash((self.occupied, self.color))
 
+    def pack(self) -> PackedContainer:
+        return self.occupied, self.color
+
 
+def pack_state(containers: List[Container]) -> Tuple[Tuple[int, ...], PackedState]:
+    """
+        Splits a list of containers in the capacities (stored once per graph)
+        and the immutable (occupied, color) pairs that make up a search state
+    """
+    capacities = tuple(cont.max_cap for cont in containers)
+    state = tuple(cont.pack() for cont in containers)
+    return capacities, state
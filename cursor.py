@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+
+import graph
+from container import PackedContainer, HASH_MASK
+
+
+class StateCursor:
+    """
+        Mutable state that applies moves in place and undoes them, so depth-first searches
+        don't allocate a Node for every visited state. It exposes the attributes of a Node
+        read by the heuristics and by `Graph.unreachable_reason`.
+    """
+    __slots__ = ('graph', 'state', 'state_hash', 'goal_counts', 'matched', 'color_counts', 'color_mask',
+                 'usable_qty', 'cost_from_root')
+
+    def __init__(self, graph: graph.Graph):
+        root = graph.root
+        self.graph = graph
+        self.state: List[PackedContainer] = list(root.state)
+        self.state_hash = root.state_hash
+        self.goal_counts = list(root.goal_counts)
+        self.matched = root.matched
+        self.color_counts = [0] * len(graph.color_tables.bits)
+        for _, code in self.state:
+            self.color_counts[code] += 1
+        self.color_mask = root.color_mask
+        self.usable_qty = root.usable_qty
+        self.cost_from_root = 0
+
+    def apply(self, container_from_idx: int, container_to_idx: int) -> Tuple[PackedContainer, PackedContainer]:
+        """
+            Pours container `container_from_idx` into container `container_to_idx`
+        :return: the previous contents of the two containers, needed by `undo`
+        """
+        previous_from, previous_to = self.state[container_from_idx], self.state[container_to_idx]
+        new_from, new_to = self.graph.pour(previous_from, previous_to, container_to_idx)
+        self._replace(container_from_idx, new_from)
+        self._replace(container_to_idx, new_to)
+        self.cost_from_root += 1
+        return previous_from, previous_to
+
+    def undo(self, container_from_idx: int, container_to_idx: int,
+             previous: Tuple[PackedContainer, PackedContainer]) -> None:
+        self._replace(container_to_idx, previous[1])
+        self._replace(container_from_idx, previous[0])
+        self.cost_from_root -= 1
+
+    def _replace(self, container_idx: int, container: PackedContainer) -> None:
+        gr = self.graph
+        old_container = self.state[container_idx]
+        self.state[container_idx] = container
+        self.state_hash = (self.state_hash - gr.zobrist_key(container_idx, old_container)
+                           + gr.zobrist_key(container_idx, container)) & HASH_MASK
+
+        goal_idx = gr.goal_index.get(old_container)
+        if goal_idx is not None:
+            if self.goal_counts[goal_idx] <= gr.goal_required[goal_idx]:
+                self.matched -= 1
+            self.goal_counts[goal_idx] -= 1
+        goal_idx = gr.goal_index.get(container)
+        if goal_idx is not None:
+            self.goal_counts[goal_idx] += 1
+            if self.goal_counts[goal_idx] <= gr.goal_required[goal_idx]:
+                self.matched += 1
+
+        old_occupied, old_code = old_container
+        occupied, code = container
+        self.color_counts[old_code] -= 1
+        if self.color_counts[old_code] == 0:
+            self.color_mask &= ~gr.color_tables.bits[old_code]
+        if self.color_counts[code] == 0:
+            self.color_mask |= gr.color_tables.bits[code]
+        self.color_counts[code] += 1
+
+        if old_code != -1:
+            self.usable_qty -= old_occupied
+        if code != -1:
+            self.usable_qty += occupied
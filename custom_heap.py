@@ -4,30 +4,203 @@
 """
 
 import heapq
+from collections import deque
+
+_REMOVED = object()
+# keys above it are kept in a heap by `BucketQueue`
+MAX_BUCKET_KEY = 4096
 
 
 class CustomHeap(object):
     """
-        A wrapper for heap that allows custom comparator
+        A wrapper for heap that allows custom comparator and lazy deletion
     """
     def __init__(self, initial=None, key=lambda x: x):
         self.key = key
         self.index = 0
+        self.stale_skipped = 0
         if initial:
-            self.data = [(key(item), i, item) for i, item in enumerate(initial)]
+            self.data = [[key(item), i, item] for i, item in enumerate(initial)]
             self.index = len(self.data)
             heapq.heapify(self.data)
         else:
             self.data = []
+        self.live = len(self.data)
+
+    def __len__(self):
+        return self.live
 
     def push(self, item):
-        heapq.heappush(self.data, (self.key(item), self.index, item))
+        """
+            Pushes `item` in the heap
+        :return: the heap entry, can be passed to `remove` later
+        """
+        entry = [self.key(item), self.index, item]
+        heapq.heappush(self.data, entry)
         self.index += 1
+        self.live += 1
+        return entry
+
+    def remove(self, entry):
+        """
+            Marks an entry returned by `push` as removed, it is discarded when it reaches the top of the heap
+        """
+        entry[2] = _REMOVED
+        self.live -= 1
 
     def pop(self):
-        return heapq.heappop(self.data)[2]
+        while self.data:
+            item = heapq.heappop(self.data)[2]
+            if item is _REMOVED:
+                self.stale_skipped += 1
+                continue
+            self.live -= 1
+            return item
+        raise IndexError('pop from an empty heap')
+
+    def peek_key(self):
+        """
+            The key of the item `pop` would return
+        """
+        while self.data and self.data[0][2] is _REMOVED:
+            heapq.heappop(self.data)
+            self.stale_skipped += 1
+        if not self.data:
+            raise IndexError('peek in an empty heap')
+        return self.data[0][0]
+
+    @property
+    def stored(self):
+        """
+            Number of entries kept, the removed ones not discarded yet included
+        """
+        return len(self.data)
 
     def heapify(self):
         heapq.heapify(self.data)
 
 
+class BucketQueue(object):
+    """
+        Priority queue for small non-negative integer keys with the interface of `CustomHeap`: a bucket of
+        entries for every key, split by `tie_key` (lowest first), first in first out inside a bucket.
+        Pushing is O(1), popping is amortised O(1) as the lowest non-empty bucket is only searched
+        upwards from the lowest key pushed since. Keys above `max_key` are kept in a heap.
+    """
+    def __init__(self, initial=None, key=lambda x: x, tie_key=None, max_key=MAX_BUCKET_KEY):
+        self.key = key
+        self.tie_key = tie_key
+        self.max_key = max_key
+        # by key: the deques of entries by tie key (None once emptied), their number of entries,
+        # and the lowest tie key pushed since the bucket was created
+        self.buckets = []
+        self.counts = []
+        self.low_ties = []
+        self.low = 0
+        self.overflow = []
+        self.index = 0
+        self.live = 0
+        self.stored = 0
+        self.stale_skipped = 0
+        for item in initial or ():
+            self.push(item)
+
+    def __len__(self):
+        return self.live
+
+    def push(self, item):
+        """
+            Pushes `item` in the queue
+        :return: the queue entry, can be passed to `remove` later
+        """
+        key = self.key(item)
+        tie = self.tie_key(item) if self.tie_key is not None else 0
+        entry = [key, tie, item]
+        if key > self.max_key:
+            heapq.heappush(self.overflow, (key, tie, self.index, entry))
+            self.index += 1
+        else:
+            buckets = self.buckets
+            if key >= len(buckets):
+                missing = key + 1 - len(buckets)
+                buckets.extend([None] * missing)
+                self.counts.extend([0] * missing)
+                self.low_ties.extend([0] * missing)
+            ties = buckets[key]
+            if ties is None:
+                ties = buckets[key] = []
+                self.low_ties[key] = tie
+            elif tie < self.low_ties[key]:
+                self.low_ties[key] = tie
+            if tie >= len(ties):
+                ties.extend(deque() for _ in range(tie + 1 - len(ties)))
+            ties[tie].append(entry)
+            self.counts[key] += 1
+            if key < self.low:
+                self.low = key
+        self.live += 1
+        self.stored += 1
+        return entry
+
+    def remove(self, entry):
+        """
+            Marks an entry returned by `push` as removed, it is discarded when it reaches the front of the queue
+        """
+        entry[2] = _REMOVED
+        self.live -= 1
+
+    def _front(self):
+        """
+            Discards the removed entries found before the next entry
+        :return: the deque holding the next entry, the overflow heap, or None if the queue is empty
+        """
+        buckets, counts = self.buckets, self.counts
+        while self.low < len(buckets):
+            key = self.low
+            if counts[key]:
+                ties = buckets[key]
+                tie = self.low_ties[key]
+                while True:
+                    entries = ties[tie]
+                    while entries and entries[0][2] is _REMOVED:
+                        entries.popleft()
+                        counts[key] -= 1
+                        self.stored -= 1
+                        self.stale_skipped += 1
+                    if entries:
+                        self.low_ties[key] = tie
+                        return entries
+                    if not counts[key]:
+                        break
+                    tie += 1
+            buckets[key] = None
+            self.low += 1
+
+        overflow = self.overflow
+        while overflow and overflow[0][3][2] is _REMOVED:
+            heapq.heappop(overflow)
+            self.stored -= 1
+            self.stale_skipped += 1
+        return overflow if overflow else None
+
+    def pop(self):
+        entries = self._front()
+        if entries is None:
+            raise IndexError('pop from an empty queue')
+        if entries is self.overflow:
+            entry = heapq.heappop(entries)[3]
+        else:
+            entry = entries.popleft()
+            self.counts[entry[0]] -= 1
+        self.live -= 1
+        self.stored -= 1
+        return entry[2]
+
+    def peek_key(self):
+        """
+            The key of the item `pop` would return
+        """
+        entries = self._front()
+        if entries is None:
+            raise IndexError('peek in an empty queue')
+        return entries[0][0]
@@ -0,0 +1,226 @@
+"""
+    External-memory frontier for UCS and A*. Open entries are bucketed by (cost from root, heuristic)
+    and stored as packed records (node id + state); a bucket's records are kept in memory until the
+    buffers outgrow the memory limit, then the buckets expanded last are appended to their files (the one
+    being filled included) until half of the limit is free. A bucket is read back
+    (memory-mapped) only when it's expanded, its duplicates are removed in one batch: inside the bucket and
+    against the expanded states with the same heuristic value. The states expanded from a bucket are written
+    sorted to a file of their own, looked up by binary search. The parent id and the move of every record are
+    buffered like the buckets and appended to a file, the states are replayed from the root only for the
+    printed solutions.
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from container import PackedState
+
+FRONTIER_MEMORY_MB = 64
+# the buffers can always hold this many bytes, so the records are spilled in batches even with no memory limit
+MIN_BUFFER_BYTES = 64 << 10
+NO_PARENT = 0xFFFFFFFF
+_ID = struct.Struct('<I')
+# parent id, index of the source container, index of the target container
+_PARENT = struct.Struct('<III')
+
+
+class _Bucket:
+    __slots__ = ('path', 'buffer', 'size')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.buffer = bytearray()
+        # number of records, in memory and on disk
+        self.size = 0
+
+    def spill(self) -> None:
+        with open(self.path, 'ab') as f_out:
+            f_out.write(self.buffer)
+        self.buffer = bytearray()
+
+
+def _iter_file(path: str, record_size: int) -> Iterator[bytes]:
+    """
+        Reads a file of fixed size records through a memory map
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f_in, mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as records:
+        for offset in range(0, len(records), record_size):
+            yield records[offset:offset + record_size]
+
+
+def _contains(records: mmap.mmap, key: bytes) -> bool:
+    """
+        Binary search of a file of sorted records of the size of `key`
+    """
+    size = len(key)
+    low, high = 0, len(records) // size
+    while low < high:
+        middle = (low + high) // 2
+        record = records[middle * size:(middle + 1) * size]
+        if record == key:
+            return True
+        if record < key:
+            low = middle + 1
+        else:
+            high = middle
+    return False
+
+
+def pack(state: PackedState) -> bytes:
+    return array('i', [value for container in state for value in container]).tobytes()
+
+
+def unpack(record: bytes) -> PackedState:
+    values = array('i')
+    values.frombytes(record)
+    return tuple(zip(values[0::2], values[1::2]))
+
+
+class ExternalFrontier:
+    """
+        The open list of one search, in a temporary folder created inside `directory`. `key_of` maps
+        a state to the packed form compared by the duplicate detection (of the same size as a packed
+        state), None compares the packed states.
+    """
+
+    def __init__(self, directory: str, nr_containers: int, memory_limit: int = FRONTIER_MEMORY_MB << 20,
+                 key_of: Optional[Callable[[PackedState], bytes]] = None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix='frontier_', dir=directory)
+        self.state_size = 2 * array('i').itemsize * nr_containers
+        self.record_size = _ID.size + self.state_size
+        self.memory_limit = max(memory_limit, MIN_BUFFER_BYTES)
+        self.key_of = key_of
+        # (estimated cost, cost from root, heuristic) -> bucket
+        self.buckets: Dict[Tuple[int, int, int], _Bucket] = {}
+        # bytes of the open records kept in memory
+        self.in_memory = 0
+        self.parents_path = os.path.join(self.directory, 'parents.bin')
+        open(self.parents_path, 'wb').close()
+        self.parents_buffer = bytearray()
+        self.nr_nodes = 0
+        # heuristic value -> files of the sorted keys of the expanded buckets
+        self.closed_runs: Dict[int, List[str]] = {}
+        self.duplicates = 0
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return sum(bucket.size for bucket in self.buckets.values())
+
+    def push(self, cost_from_root: int, heuristic: int, parent_id: int, move: Tuple[int, int],
+             state: PackedState) -> None:
+        """
+            Adds a node reached from node `parent_id` (NO_PARENT for the root, which gets id 0) by `move`
+        """
+        node_id = self.nr_nodes
+        if node_id == NO_PARENT:
+            raise OverflowError(f"the external frontier holds at most {NO_PARENT} nodes")
+        self.nr_nodes += 1
+        self.parents_buffer += _PARENT.pack(parent_id, *move)
+
+        key = (cost_from_root + heuristic, cost_from_root, heuristic)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = _Bucket(os.path.join(self.directory, 'open_%d_%d_%d.bin' % key))
+        bucket.buffer += _ID.pack(node_id)
+        bucket.buffer += pack(state)
+        bucket.size += 1
+        self.in_memory += self.record_size
+        if self.in_memory + len(self.parents_buffer) > self.memory_limit:
+            self.spill()
+
+    def spill(self) -> None:
+        """
+            Writes the parent records to their file, then the buffers of the buckets to theirs, the buckets
+            expanded last first, until the open records use at most half of the memory limit. The next spill
+            waits for the buffers to fill the other half.
+        """
+        with open(self.parents_path, 'ab') as f_out:
+            f_out.write(self.parents_buffer)
+        self.parents_buffer = bytearray()
+        for key in sorted(self.buckets, reverse=True):
+            if self.in_memory <= self.memory_limit // 2:
+                break
+            bucket = self.buckets[key]
+            if bucket.buffer:
+                self.in_memory -= len(bucket.buffer)
+                self.spilled += len(bucket.buffer) // self.record_size
+                bucket.spill()
+
+    def pop_bucket(self) -> Optional[Tuple[int, int, List[Tuple[int, PackedState]]]]:
+        """
+            Removes the bucket with the lowest estimated cost (then lowest cost from root)
+        :return: its cost from root, heuristic value and the (node id, state) pairs not expanded before,
+            None if the frontier is empty
+        """
+        while self.buckets:
+            key = min(self.buckets)
+            bucket = self.buckets.pop(key)
+            _, cost_from_root, heuristic = key
+            self.in_memory -= len(bucket.buffer)
+
+            batch: Dict[bytes, Tuple[int, bytes]] = {}
+            for record in self._records(bucket):
+                state_bytes = record[_ID.size:]
+                batch_key = state_bytes if self.key_of is None else self.key_of(unpack(state_bytes))
+                if batch_key not in batch:
+                    batch[batch_key] = (_ID.unpack_from(record)[0], state_bytes)
+            if os.path.exists(bucket.path):
+                os.remove(bucket.path)
+
+            closed_runs = self.closed_runs.setdefault(heuristic, [])
+            for closed_path in closed_runs:
+                if not batch:
+                    break
+                with open(closed_path, 'rb') as f_in, \
+                        mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as closed_keys:
+                    for batch_key in [batch_key for batch_key in batch if _contains(closed_keys, batch_key)]:
+                        del batch[batch_key]
+            self.duplicates += bucket.size - len(batch)
+            if not batch:
+                continue
+
+            # a bucket emptied before can be filled again by a heuristic that isn't consistent
+            closed_path = os.path.join(self.directory, f'closed_{heuristic}_{len(closed_runs)}.bin')
+            with open(closed_path, 'wb') as f_closed:
+                f_closed.write(b''.join(sorted(batch)))
+            closed_runs.append(closed_path)
+            return cost_from_root, heuristic, [(node_id, unpack(state_bytes))
+                                               for node_id, state_bytes in batch.values()]
+        return None
+
+    def _records(self, bucket: _Bucket) -> Iterator[bytes]:
+        yield from _iter_file(bucket.path, self.record_size)
+        buffer = bucket.buffer
+        for offset in range(0, len(buffer), self.record_size):
+            yield bytes(buffer[offset:offset + self.record_size])
+
+    def path(self, node_id: int) -> List[Tuple[int, int]]:
+        """
+            The moves leading from the root to a node
+        """
+        moves = []
+        on_disk = os.path.getsize(self.parents_path) // _PARENT.size
+        with open(self.parents_path, 'rb') as f_parents:
+            while True:
+                if node_id < on_disk:
+                    f_parents.seek(node_id * _PARENT.size)
+                    parent_id, i, j = _PARENT.unpack(f_parents.read(_PARENT.size))
+                else:
+                    parent_id, i, j = _PARENT.unpack_from(self.parents_buffer, (node_id - on_disk) * _PARENT.size)
+                if parent_id == NO_PARENT:
+                    break
+                moves.append((i, j))
+                node_id = parent_id
+        moves.reverse()
+        return moves
+
+    def close(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
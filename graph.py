@@ -1,17 +1,32 @@
 from __future__ import annotations
 
+from collections import Counter
 from dataclasses import dataclass, InitVar, field
 from functools import cached_property
 from itertools import combinations
-from queue import Queue
-from typing import List, Callable
-from collections import Counter
+from random import Random
+from typing import List, Callable, Tuple, Optional, Dict
 
 import color
-from container import Container
+from container import Container, PackedContainer, PackedState, HASH_MASK, pack_state
+import instrumentation
+import moves_log
 import node
+import solution_cache
+from nogood import NogoodCache
+from pattern_db import PatternDatabase, PDB_MAX_BITS, PDB_MAX_SECONDS, UNREACHABLE
+from transposition import TranspositionTable
 
 INFINITY = 0x40000
+ZOBRIST_SEED = 0x5EED
+
+HEURISTIC_DESCRIPTIONS = {
+    0: "Using trivial heuristic\n\n",
+    1: "Using inadmissible heuristic\n\n",
+    2: "Using admissible heuristic no. 1\n\n",
+    3: "Using admissible heuristic no. 2\n\n",
+    4: "Using pattern database heuristic\n\n",
+}
 
 
 @dataclass
@@ -19,54 +34,309 @@ class Graph:
     final_state: List[Container]
     init_state: InitVar[List[Container]]
     nr_sol: int
+    color_srv: color.ColorSrv = field(default_factory=color.ColorSrv, repr=False)
+    transposition_table: Optional[TranspositionTable] = None
+    use_transposition_table: bool = field(init=False, default=False)
+    # dead ends learned by every search run on the graph
+    nogoods: Optional[NogoodCache] = None
+    observer: Optional[instrumentation.SearchObserver] = None
+    moves_log: Optional[moves_log.MovesLog] = None
+    # keeps the output of the current run for the solution cache
+    solution_recorder: Optional[solution_cache.SolutionRecorder] = None
+    # folder where pattern databases are saved for the next runs, None to build them in every run
+    pdb_dir: Optional[str] = None
+    pdb_max_bits: int = PDB_MAX_BITS
+    pdb_max_seconds: float = PDB_MAX_SECONDS
+    # containers with the same capacity and contents are interchangeable, the duplicate detection
+    # compares the multisets of (capacity, occupied, color) instead of the positional states
+    symmetry_reduction: bool = False
+    # no solution has fewer moves, proven by the pre-analysis (`analysis.analyze`) before the searches
+    lower_bound: int = 0
     root: node.Node = field(init=False)
+    capacities: Tuple[int, ...] = field(init=False)
     heuristic: Callable[[node.Node], int] = field(init=False, default=None)
+    color_tables: color.ColorTables = field(init=False, repr=False)
+    zobrist_keys: dict = field(init=False, repr=False, default_factory=dict)
+    # what a container index contributes to the keys: itself, or its capacity with symmetry reduction
+    hash_positions: Tuple[int, ...] = field(init=False, repr=False)
+    zobrist_rng: Random = field(init=False, repr=False, default_factory=lambda: Random(ZOBRIST_SEED))
 
     def __post_init__(self, init_state):
-        self.root = node.Node(self, None, 0, 0)
-        self.root.state = init_state
+        self.color_tables = self.color_srv.compile()
+        self.capacities, packed_init_state = pack_state(init_state)
+        self.hash_positions = self.capacities if self.symmetry_reduction else tuple(range(len(self.capacities)))
+        self.root = node.Node(self, None, 0, 0, packed_init_state)
+
+    def start_search(self, new_iteration: bool = False, regenerates_nodes: bool = False) -> None:
+        """
+            Forgets the states recorded by a previous search (or by the previous IDA* iteration,
+            in which case the statistics are kept). Searches that forget nodes and generate them
+            again (RBFS, SMA*) can't use the transposition table, they only check for cycles.
+        """
+        if self.observer is not None:
+            self.observer.on_search_start(self)
+        self.use_transposition_table = self.transposition_table is not None and not regenerates_nodes
+        if self.use_transposition_table:
+            self.transposition_table.clear(reset_stats=not new_iteration)
+            self.transposition_table.prune(self.root)
+        if self.nogoods is not None and not new_iteration:
+            self.nogoods.reset_stats()
+
+    def learn_dead_end(self, target_node, has_successors: bool, blocked: bool) -> None:
+        """
+            Records an expanded node (or a `cursor.StateCursor`) as a dead end when no move from it was kept and
+            none of them was `blocked` by the cycle or duplicate detection, which prune states that may
+            still reach the final state
+        """
+        if self.nogoods is not None and not has_successors and not blocked and not self.test_final(target_node):
+            self.nogoods.add(target_node.state_hash, target_node.state, self.state_key)
+
+    @cached_property
+    def goal_index(self) -> Dict[PackedContainer, int]:
+        """
+            Position of every distinct (occupied, color) pair of final_state in `goal_required`
+        """
+        goal_index = {}
+        for cont in self.final_state:
+            goal_index.setdefault(cont.pack(), len(goal_index))
+        return goal_index
+
+    @cached_property
+    def goal_required(self) -> Tuple[int, ...]:
+        """
+            How many containers of every goal pair final_state asks for
+        """
+        required = [0] * len(self.goal_index)
+        for cont in self.final_state:
+            required[self.goal_index[cont.pack()]] += 1
+        return tuple(required)
+
+    def count_matches(self, state: PackedState) -> Tuple[Tuple[int, ...], int]:
+        """
+            Counts from scratch the containers of `state` holding every goal pair
+        :return: the counts and the number of final_state containers they match
+        """
+        counts = [0] * len(self.goal_index)
+        for container in state:
+            goal_idx = self.goal_index.get(container)
+            if goal_idx is not None:
+                counts[goal_idx] += 1
+        matched = sum(min(count, required) for count, required in zip(counts, self.goal_required))
+        return tuple(counts), matched
+
+    def update_matches(self, parent: node.Node, state: PackedState,
+                       container_from_idx: int, container_to_idx: int) -> Tuple[Tuple[int, ...], int]:
+        """
+            Derives the goal pair counts of a successor from its parent's, looking only at the two changed containers
+        :return: the counts and the number of final_state containers they match
+        """
+        goal_index, required = self.goal_index, self.goal_required
+        counts, matched = parent.goal_counts, parent.matched
+        new_counts = None
+        for container_idx in (container_from_idx, container_to_idx):
+            goal_idx = goal_index.get(parent.state[container_idx])
+            if goal_idx is not None:
+                if new_counts is None:
+                    new_counts = list(counts)
+                if new_counts[goal_idx] <= required[goal_idx]:
+                    matched -= 1
+                new_counts[goal_idx] -= 1
+
+            goal_idx = goal_index.get(state[container_idx])
+            if goal_idx is not None:
+                if new_counts is None:
+                    new_counts = list(counts)
+                new_counts[goal_idx] += 1
+                if new_counts[goal_idx] <= required[goal_idx]:
+                    matched += 1
+
+        return (counts if new_counts is None else tuple(new_counts)), matched
+
+    def zobrist_key(self, container_idx: int, container: PackedContainer) -> int:
+        """
+            Gets the random 64 bit key of a container holding `container`, keys are generated on first use.
+            With symmetry reduction containers of the same capacity share their keys.
+        """
+        key = (self.hash_positions[container_idx], container)
+        zobrist_key = self.zobrist_keys.get(key)
+        if zobrist_key is None:
+            zobrist_key = self.zobrist_keys[key] = self.zobrist_rng.getrandbits(64)
+        return zobrist_key
+
+    def hash_state(self, state: PackedState) -> int:
+        """
+            Full hash of a state, successors derive theirs incrementally from their parent's.
+            The keys are added (modulo 2^64) rather than xor-ed, so two interchangeable containers
+            holding the same contents don't cancel out.
+        """
+        state_hash = 0
+        for container_idx, container in enumerate(state):
+            state_hash += self.zobrist_key(container_idx, container)
+        return state_hash & HASH_MASK
+
+    def state_key(self, state: PackedState) -> tuple:
+        """
+            The form of `state` (or of a cursor's list) compared by the duplicate detection: the state itself,
+            or the sorted (capacity, (occupied, color)) multiset with symmetry reduction. Nodes keep
+            their concrete states, so the printed moves use the real container indices.
+        """
+        if self.symmetry_reduction:
+            return tuple(sorted(zip(self.capacities, state)))
+        return tuple(state)
+
+    def pour(self, container_from: PackedContainer, container_to: PackedContainer,
+             container_to_idx: int) -> Tuple[PackedContainer, PackedContainer]:
+        """
+            Pours `container_from` into `container_to` (found at index `container_to_idx`)
+        :return: the new contents of the two containers
+        """
+        occupied_from, color_from = container_from
+        occupied_to, color_to = container_to
+
+        capacity_to_transfer = min(self.capacities[container_to_idx] - occupied_to, occupied_from)
+        occupied_from -= capacity_to_transfer
+        return (occupied_from, color_from if occupied_from != 0 else 0), \
+               (occupied_to + capacity_to_transfer, self.color_tables.mix[color_from][color_to])
+
+    def apply_move(self, state: PackedState, container_from_idx: int, container_to_idx: int) -> PackedState:
+        """
+            Pours container `container_from_idx` into container `container_to_idx`
+        :return: the packed state resulted after the transfer
+        """
+        new_state = list(state)
+        new_state[container_from_idx], new_state[container_to_idx] = \
+            self.pour(state[container_from_idx], state[container_to_idx], container_to_idx)
+        return tuple(new_state)
+
+    def legal_moves(self, state: PackedState) -> List[Tuple[int, int]]:
+        """
+            Every (from, to) pair of containers such that `from` is not empty and `to` is not full
+        """
+        capacities = self.capacities
+        sources = [i for i, (occupied, _) in enumerate(state) if occupied != 0]
+        targets = [j for j, (occupied, _) in enumerate(state) if capacities[j] != occupied]
+        return [(i, j) for i in sources for j in targets if i != j]
 
     def set_heuristic(self, heuristic_code):
         if heuristic_code == 0:
             self.heuristic = self.trivial_heuristic
-            return "Using trivial heuristic\n\n"
         elif heuristic_code == 1:
             self.heuristic = self.inadmissible_heuristic
-            return "Using inadmissible heuristic\n\n"
         elif heuristic_code == 2:
             self.heuristic = self.admissible_heuristic_1
-            return "Using admissible heuristic no. 1\n\n"
         elif heuristic_code == 3:
             self.heuristic = self.admissible_heuristic_2
-            return "Using admissible heuristic no. 2\n\n"
+        elif heuristic_code == 4:
+            self.heuristic = self.pattern_database_heuristic
+            if not self.test_final(self.root):
+                # built here, so the time of the build doesn't count against the timeouts of the searches
+                _ = self.pattern_db
+        # the root is shared by every search, drop the estimation made with the previous heuristic
+        self.root._estimated_cost = None
+        return HEURISTIC_DESCRIPTIONS.get(heuristic_code)
 
     def generate_successors(self, target_node: node.Node) -> List[node.Node]:
+        """
+            Computes the pours of every legal move from tables built once per expansion (free space,
+            zobrist keys and color counts of the parent) and runs the checks of `prune_reason` on them,
+            so a Node is only allocated for the moves that are kept. The hash, color mask and usable
+            quantity of a successor are derived from the parent's, looking only at the two changed containers.
+            The observer is notified of every move as an `instrumentation.GeneratedMove`.
+        """
+        observer = self.observer
+        if observer is not None:
+            observer.on_expand(target_node)
+        state = target_node.state
+        mix, bits = self.color_tables.mix, self.color_tables.bits
+        expand_missing = self.color_tables.expand_missing
+        zobrist_key = self.zobrist_key
+        final_colors_mask, final_state_total_qty = self.final_colors_mask, self.final_state_total_qty
+        use_transposition_table = self.use_transposition_table
+        nogoods, state_key = self.nogoods, self.state_key
+        parent_hash, parent_mask, parent_usable_qty = target_node.state_hash, target_node.color_mask, \
+            target_node.usable_qty
+        depth = target_node.cost_from_root + 1
+
+        free_space = [capacity - occupied for capacity, (occupied, _) in zip(self.capacities, state)]
+        parent_keys = [zobrist_key(container_idx, container) for container_idx, container in enumerate(state)]
+        color_counts = Counter(code for _, code in state)
+        sources = [i for i, (occupied, _) in enumerate(state) if occupied != 0]
+        targets = [j for j, free in enumerate(free_space) if free != 0]
+
         successors = []
-        for i, container_i in enumerate(target_node.state):
-            for j, container_j in enumerate(target_node.state):
+        blocked = False
+        for i in sources:
+            occupied_from, color_from = state[i]
+            for j in targets:
                 if i == j:
                     continue
+                if observer is not None:
+                    move = instrumentation.GeneratedMove(target_node, i, j)
+                    observer.on_generate(move)
+                occupied_to, color_to = state[j]
+                transferred = min(free_space[j], occupied_from)
+                left = occupied_from - transferred
+                new_from = (left, color_from if left != 0 else 0)
+                new_to = (occupied_to + transferred, mix[color_from][color_to])
+
+                usable_qty = parent_usable_qty
+                if color_from != -1:
+                    usable_qty -= transferred
+                if color_to != -1:
+                    usable_qty -= occupied_to
+                if new_to[1] != -1:
+                    usable_qty += new_to[0]
+                if usable_qty < final_state_total_qty:
+                    if observer is not None:
+                        observer.on_prune(move, instrumentation.PRUNE_QUANTITY)
+                    continue
 
-                if container_i.occupied == 0 or container_j.max_cap == container_j.occupied:
+                color_mask = parent_mask
+                if color_counts[color_from] == 1 + (color_to == color_from):
+                    color_mask &= ~bits[color_from]
+                if color_counts[color_to] == 1 + (color_to == color_from):
+                    color_mask &= ~bits[color_to]
+                color_mask |= bits[new_from[1]] | bits[new_to[1]]
+                if expand_missing(final_colors_mask & ~color_mask, color_mask) == -1:
+                    if observer is not None:
+                        observer.on_prune(move, instrumentation.PRUNE_UNREACHABLE)
                     continue
 
-                gen_node = node.Node(self, target_node, i, j)
-                if not self.is_part_of_solution(gen_node):
+                state_hash = (parent_hash - parent_keys[i] + zobrist_key(i, new_from)
+                              - parent_keys[j] + zobrist_key(j, new_to)) & HASH_MASK
+                new_state = list(state)
+                new_state[i], new_state[j] = new_from, new_to
+                new_state = tuple(new_state)
+                if nogoods is not None and nogoods.contains(state_hash, new_state, state_key):
+                    if observer is not None:
+                        observer.on_prune(move, instrumentation.PRUNE_DEAD_END)
+                    continue
+                duplicate = self.transposition_table.probe(state_hash, state_key(new_state), depth) \
+                    if use_transposition_table else None
+                if duplicate or (duplicate is None and target_node.on_road(state_hash, new_state)):
+                    if observer is not None:
+                        observer.on_prune(move, instrumentation.PRUNE_DUPLICATE if duplicate
+                                          else instrumentation.PRUNE_CYCLE)
+                    blocked = True
                     continue
 
-                successors.append(gen_node)
+                successors.append(node.Node.successor(target_node, i, j, new_state, state_hash, color_mask))
 
+        self.learn_dead_end(target_node, bool(successors), blocked)
         return successors
 
-    def match_final(self, target_node: node.Node) -> Counter[Container]:
-        counter_target, counter_final = Counter(target_node.state), Counter(self.final_state)
-        match = (counter_target & counter_final)
-        return match
-
     def test_final(self, target_node: node.Node) -> bool:
-        counter_final = Counter(self.final_state)
-        match = self.match_final(target_node)
-        return match == counter_final
+        return target_node.matched == len(self.final_state)
+
+    @cached_property
+    def final_colors_mask(self) -> int:
+        return self.color_tables.color_mask(cont.color for cont in self.final_state)
+
+    @cached_property
+    def pattern_db(self) -> Optional[PatternDatabase]:
+        return PatternDatabase.create(self.capacities, tuple(occupied for occupied, _ in self.root.state),
+                                      tuple(cont.occupied for cont in self.final_state), self.pdb_dir, self.pdb_max_bits,
+                                      self.pdb_max_seconds)
 
     @cached_property
     def final_state_total_qty(self) -> int:
@@ -83,33 +353,48 @@ class Graph:
         -------
             True if we can (theoretically) reach solution from given state
         """
+        return self.prune_reason(target_node) is None
 
-        if target_node.cycles_back() or target_node.usable_qty < self.final_state_total_qty:
-            return False
-
-        final_state_colors = set()
-        target_state_colors = set()
-        missing_colors_queue = Queue()
-        for cont in self.final_state:
-            final_state_colors.add(cont.color)
-
-        for cont in target_node.state:
-            target_state_colors.add(cont.color)
+    def prune_reason(self, target_node: node.Node) -> Optional[str]:
+        """
+        Returns
+        -------
+            Why the node can't be part of a solution (one of the `instrumentation.PRUNE_*` reasons),
+            None if it can
+        """
+        # the checks looking only at the state are cheaper, and keep the transposition table for useful states
+        reason = self.unreachable_reason(target_node)
+        if reason is not None:
+            return reason
+
+        # states the table can't record are checked against their ancestors
+        duplicate = self.transposition_table.prune(target_node) if self.use_transposition_table else None
+        if duplicate:
+            return instrumentation.PRUNE_DUPLICATE
+        if duplicate is None and target_node.cycles_back():
+            return instrumentation.PRUNE_CYCLE
+        return None
+
+    def unreachable_reason(self, target_node) -> Optional[str]:
+        """
+            The checks of `prune_reason` that only look at the state, `target_node` can be
+            a node or a `cursor.StateCursor`
 
-        for final_color in final_state_colors:
-            if final_color not in target_state_colors:
-                missing_colors_queue.put(final_color)
+        Returns
+        -------
+            Why the final state surely can't be reached anymore, None if it may be
+        """
+        if target_node.usable_qty < self.final_state_total_qty:
+            return instrumentation.PRUNE_QUANTITY
 
-        while not missing_colors_queue.empty():
-            ms_color = missing_colors_queue.get()
-            resulted_colors = color.ColorSrv().deconstruct_color(ms_color)
-            if resulted_colors == -1:
-                return False
-            for new_color in resulted_colors:
-                if new_color not in target_state_colors:
-                    missing_colors_queue.put(new_color)
+        missing_colors = self.final_colors_mask & ~target_node.color_mask
+        if self.color_tables.expand_missing(missing_colors, target_node.color_mask) == -1:
+            return instrumentation.PRUNE_UNREACHABLE
 
-        return True
+        if self.nogoods is not None and self.nogoods.contains(target_node.state_hash, target_node.state,
+                                                              self.state_key):
+            return instrumentation.PRUNE_DEAD_END
+        return None
 
     def trivial_heuristic(self, target_node: node.Node) -> int:
         """
@@ -127,9 +412,7 @@ class Graph:
         -------
             estimated cost to final state
         """
-        match = self.match_final(target_node)
-
-        return len(self.final_state) - sum(match.values())
+        return len(self.final_state) - target_node.matched
 
     def admissible_heuristic_1(self, target_node: node.Node) -> int:
         """
@@ -139,15 +422,7 @@ class Graph:
         -------
             estimated cost to final state
         """
-        final_state_colors = set()
-        target_state_colors = set()
-        for cont in self.final_state:
-            final_state_colors.add(cont.color)
-
-        for cont in target_node.state:
-            target_state_colors.add(cont.color)
-
-        return len(final_state_colors) - len(final_state_colors.intersection(target_state_colors))
+        return color.popcount(self.final_colors_mask & ~target_node.color_mask)
 
     def admissible_heuristic_2(self, target_node: node.Node) -> int:
         """
@@ -158,26 +433,30 @@ class Graph:
         -------
             estimated cost to final state
         """
-        final_state_colors = set()
-        target_state_colors = set()
-        missing_colors_queue = Queue()
-        estimation = 0
-        for cont in self.final_state:
-            final_state_colors.add(cont.color)
+        missing_colors = self.final_colors_mask & ~target_node.color_mask
+        to_mix = self.color_tables.expand_missing(missing_colors, target_node.color_mask)
+        if to_mix == -1:
+            return INFINITY
 
-        for cont in target_node.state:
-            target_state_colors.add(cont.color)
+        return color.popcount(to_mix)
 
-        for final_color in final_state_colors:
-            if final_color not in target_state_colors:
-                missing_colors_queue.put(final_color)
-
-        while not missing_colors_queue.empty():
-            ms_color = missing_colors_queue.get()
-            resulted_colors = color.ColorSrv().deconstruct_color(ms_color)
-            estimation += 1
-            for new_color in resulted_colors:
-                if new_color not in target_state_colors:
-                    missing_colors_queue.put(new_color)
+    def pattern_database_heuristic(self, target_node: node.Node) -> int:
+        """
+        Estimated cost is the min number of moves to get the quantities of final_state, looked up in the
+        pattern database, or admissible heuristic no. 2 if it's higher (or if the instance has too many
+        quantities for a database, or its build took too long). Every move that isn't the last one counts
+        at least 1, like in the trivial heuristic.
 
-        return estimation
+        Returns
+        -------
+            estimated cost to final state
+        """
+        if self.test_final(target_node):
+            return 0
+        estimation = self.admissible_heuristic_2(target_node)
+        if self.pattern_db is not None:
+            distance = self.pattern_db.lookup(target_node.state)
+            if distance == UNREACHABLE:
+                return INFINITY
+            estimation = max(estimation, distance)
+        return estimation or self.trivial_heuristic(target_node)
@@ -0,0 +1,268 @@
+"""
+    Hash-distributed A* (HDA*). Every worker process owns the states whose `Graph.state_key` hashes to
+    it: it keeps their open list and their best cost from root, expands them and sends every successor
+    to its owner, in batches. The cost of the best solution found is shared, nodes that can't beat it
+    aren't expanded or sent, so the search ends with an optimal solution (for an admissible heuristic)
+    once every worker is idle and no batch is on its way.
+
+    Termination is detected by the coordinating process with counters: a worker counts the batches it
+    sends before sending them and the batches it receives after receiving them, and marks itself idle
+    only when its outgoing batches are flushed. The search is over when two consecutive reads of the
+    counters are identical, balanced and taken while every worker was idle.
+"""
+
+import heapq
+import multiprocessing
+import queue
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import graph
+import node
+from budget import SearchBudget
+
+HDA_WORKERS = 4
+# successors sent to another worker at once
+BATCH_SIZE = 64
+# expansions after which the partial batches are sent anyway
+FLUSH_INTERVAL = 256
+IDLE_WAIT = 0.005
+POLL_INTERVAL = 0.002
+
+# (state, cost from root, heuristic, moves encoded as from * nr_containers + to)
+Record = Tuple[tuple, int, int, Tuple[int, ...]]
+
+
+@dataclass
+class WorkerStats:
+    worker_id: int
+    expanded: int = 0
+    generated: int = 0
+    # successors kept by the worker, and sent to the other workers
+    local: int = 0
+    remote: int = 0
+    batches: int = 0
+    max_open: int = 0
+
+
+@dataclass
+class HDAResult:
+    cost: Optional[int] = None
+    moves: List[Tuple[int, int]] = field(default_factory=list)
+    workers: List[WorkerStats] = field(default_factory=list)
+    stopped: bool = False
+
+
+class _Shared:
+    """
+        The inboxes of the workers, the queue of their results and the counters read by the coordinator.
+        A single worker runs in the calling process, with plain queues.
+    """
+
+    def __init__(self, nr_workers: int):
+        inline = nr_workers == 1
+        self.nr_workers = nr_workers
+        self.inboxes = [queue.Queue() if inline else multiprocessing.Queue() for _ in range(nr_workers)]
+        self.results = queue.Queue() if inline else multiprocessing.Queue()
+        self.incumbent = multiprocessing.Value('q', graph.INFINITY)
+        self.stop = multiprocessing.Event()
+        self.idle = multiprocessing.RawArray('b', nr_workers)
+        self.sent = multiprocessing.RawArray('q', nr_workers)
+        self.received = multiprocessing.RawArray('q', nr_workers)
+        self.expanded = multiprocessing.RawArray('q', nr_workers)
+
+    def snapshot(self) -> Optional[Tuple]:
+        """
+            The counters of every worker, None if one of them isn't idle
+        """
+        if not all(self.idle):
+            return None
+        sent, received = tuple(self.sent), tuple(self.received)
+        if sum(sent) != sum(received) or not all(self.idle):
+            return None
+        return sent, received
+
+
+def _worker(worker_id: int, gr: graph.Graph, shared: _Shared, budget: Optional[SearchBudget] = None) -> None:
+    """
+        The search loop of one worker. The worker running in the calling process checks `budget` itself
+        and returns once its open list is empty.
+    """
+    # the expanded nodes have no ancestors, the open lists detect the duplicates
+    gr.start_search(regenerates_nodes=True)
+    nr_workers, nr_containers = shared.nr_workers, len(gr.capacities)
+    inbox = shared.inboxes[worker_id]
+    for other_inbox in shared.inboxes:
+        if hasattr(other_inbox, 'cancel_join_thread'):
+            # batches left in the inboxes when the search stops are dropped
+            other_inbox.cancel_join_thread()
+
+    stats = WorkerStats(worker_id)
+    open_list = []
+    best_cost = {}
+    outboxes: List[List[Record]] = [[] for _ in range(nr_workers)]
+    counter = 0
+
+    def receive(records: List[Record]) -> None:
+        nonlocal counter
+        for state, cost_from_root, heuristic, moves in records:
+            state_key = gr.state_key(state)
+            known = best_cost.get(state_key)
+            if known is not None and known <= cost_from_root:
+                continue
+            best_cost[state_key] = cost_from_root
+            heapq.heappush(open_list, (cost_from_root + heuristic, -cost_from_root, counter, state, moves))
+            counter += 1
+        stats.max_open = max(stats.max_open, len(open_list))
+
+    def flush(owner: int) -> None:
+        shared.sent[worker_id] += 1
+        stats.batches += 1
+        shared.inboxes[owner].put(outboxes[owner])
+        outboxes[owner] = []
+
+    def take(block: bool) -> bool:
+        try:
+            records = inbox.get(timeout=IDLE_WAIT) if block else inbox.get_nowait()
+        except queue.Empty:
+            return False
+        shared.idle[worker_id] = 0
+        shared.received[worker_id] += 1
+        receive(records)
+        return True
+
+    if hash(gr.state_key(gr.root.state)) % nr_workers == worker_id:
+        receive([(gr.root.state, 0, gr.heuristic(gr.root), ())])
+
+    while not shared.stop.is_set():
+        while take(False):
+            pass
+
+        incumbent = shared.incumbent.value
+        while open_list and open_list[0][0] >= incumbent:
+            heapq.heappop(open_list)
+        if not open_list:
+            for owner in range(nr_workers):
+                if outboxes[owner]:
+                    flush(owner)
+            shared.idle[worker_id] = 1
+            if nr_workers == 1:
+                break
+            take(True)
+            continue
+
+        _, neg_cost, _, state, moves = heapq.heappop(open_list)
+        cost_from_root = -neg_cost
+        if best_cost[gr.state_key(state)] < cost_from_root:
+            continue
+        if budget is not None and budget.exhausted(len(best_cost)):
+            shared.stop.set()
+            break
+
+        stats.expanded += 1
+        shared.expanded[worker_id] = stats.expanded
+        current = node.Node(gr, None, 0, 0, state)
+        if gr.test_final(current):
+            with shared.incumbent.get_lock():
+                if cost_from_root < shared.incumbent.value:
+                    shared.incumbent.value = cost_from_root
+                    shared.results.put(('solution', cost_from_root, moves))
+            continue
+
+        successors = gr.generate_successors(current)
+        stats.generated += len(successors)
+        local = []
+        for s in successors:
+            heuristic = gr.heuristic(s)
+            if cost_from_root + 1 + heuristic >= incumbent:
+                continue
+            record = (s.state, cost_from_root + 1, heuristic,
+                      moves + (s.container_from_idx * nr_containers + s.container_to_idx,))
+            owner = hash(gr.state_key(s.state)) % nr_workers
+            if owner == worker_id:
+                local.append(record)
+                stats.local += 1
+            else:
+                outboxes[owner].append(record)
+                stats.remote += 1
+                if len(outboxes[owner]) >= BATCH_SIZE:
+                    flush(owner)
+        receive(local)
+
+        if stats.expanded % FLUSH_INTERVAL == 0:
+            for owner in range(nr_workers):
+                if outboxes[owner]:
+                    flush(owner)
+
+    shared.results.put(('stats', stats))
+
+
+def available_workers(nr_workers: int) -> int:
+    """
+        The number of workers a search can use: one in a daemon process, which can't start processes
+    """
+    return 1 if multiprocessing.current_process().daemon else max(1, nr_workers)
+
+
+def search(gr: graph.Graph, nr_workers: int, budget: SearchBudget) -> HDAResult:
+    """
+        Runs HDA* with `nr_workers` worker processes (started with a copy of the graph),
+        one worker runs in the calling process
+    """
+    shared = _Shared(nr_workers)
+    result = HDAResult()
+
+    def collect(message) -> None:
+        if message[0] == 'solution':
+            _, cost, moves = message
+            if result.cost is None or cost < result.cost:
+                result.cost = cost
+                result.moves = [divmod(move, len(gr.capacities)) for move in moves]
+        else:
+            result.workers.append(message[1])
+
+    if nr_workers == 1:
+        _worker(0, gr, shared, budget)
+        result.stopped = shared.stop.is_set()
+        while not shared.results.empty():
+            collect(shared.results.get())
+        return result
+
+    processes = [multiprocessing.Process(target=_worker, args=(worker_id, gr, shared), daemon=True)
+                 for worker_id in range(nr_workers)]
+    for process in processes:
+        process.start()
+
+    previous = None
+    while True:
+        try:
+            collect(shared.results.get(timeout=POLL_INTERVAL))
+            continue
+        except queue.Empty:
+            pass
+        if budget.update(sum(shared.expanded)):
+            result.stopped = True
+            break
+        current = shared.snapshot()
+        if current is not None and current == previous:
+            break
+        previous = current
+
+    shared.stop.set()
+    while len(result.workers) < nr_workers:
+        try:
+            collect(shared.results.get(timeout=1))
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                break
+    for process in processes:
+        process.join(1)
+        if process.is_alive():
+            process.terminate()
+    while True:
+        try:
+            collect(shared.results.get_nowait())
+        except queue.Empty:
+            break
+    result.workers.sort(key=lambda worker_stats: worker_stats.worker_id)
+    return result
@@ -0,0 +1,291 @@
+"""
+    Problem instances, independent of the search: a streaming parser of the text format and a compiled
+    binary format. A text file can hold several instances, one after the other: an instance ends where
+    the next one starts, at the first combination rule (or initial state line) following its final state.
+
+    The binary format keeps every instance as parsed (colors interned by code, rules as codes, arrays of
+    capacities, quantities and colors, as u32), so it's read from a memory map without any text parsing. Records are
+    followed by a table of their offsets, so they can be written one at a time and read in any order:
+
+        magic, version | record... | offset of every record (u64) | number of records (u32), table offset (u64)
+
+    Usage: python instances.py <output.wci> <text or binary instance file>...
+"""
+
+import mmap
+import os
+import struct
+from argparse import ArgumentParser
+from dataclasses import dataclass, replace
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+INIT_STATE_LINE_SEPARATOR = "stare_initiala"
+FINAL_STATE_LINE_SEPARATOR = "stare_finala"
+
+BINARY_MAGIC = b'WCI\0'
+BINARY_VERSION = 2
+_HEADER = struct.Struct('<4sH')
+_FOOTER = struct.Struct('<IQ')
+_COUNT = struct.Struct('<I')
+_VALUE = 'I'
+_MAX_VALUE = 0xFFFFFFFF
+
+_RULES, _INIT_STATE, _FINAL_STATE = range(3)
+
+
+@dataclass(frozen=True)
+class Instance:
+    name: str
+    # color names, the color with code c is at position c - 1
+    colors: Tuple[str, ...]
+    # combination rules as color codes (ingredient, ingredient, result)
+    rules: Tuple[Tuple[int, int, int], ...]
+    capacities: Tuple[int, ...]
+    occupied: Tuple[int, ...]
+    # color of every container, 0 for the empty ones
+    codes: Tuple[int, ...]
+    final_occupied: Tuple[int, ...]
+    final_codes: Tuple[int, ...]
+
+    def named_rules(self) -> List[Tuple[str, str, str]]:
+        colors = self.colors
+        return [(colors[code_l - 1], colors[code_r - 1], colors[code_f - 1]) for code_l, code_r, code_f in self.rules]
+
+    def color_name(self, code: int) -> str:
+        return self.colors[code - 1]
+
+
+class _InstanceBuilder:
+    """
+        Interns the colors in the order a color service built from the instance registers them:
+        the colors of the rules, then the colors of the containers
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.color_codes: Dict[str, int] = {}
+        self.rules = []
+        self.containers = []
+        self.final_state = []
+
+    def intern(self, color_name: str) -> int:
+        code = self.color_codes.get(color_name)
+        if code is None:
+            code = self.color_codes[color_name] = len(self.color_codes) + 1
+        return code
+
+    def add_line(self, section: int, tokens: List[str]) -> None:
+        if section == _RULES:
+            color_l, color_r, color_f = tokens
+            self.rules.append((self.intern(color_l), self.intern(color_r), self.intern(color_f)))
+        elif section == _INIT_STATE:
+            max_cap, occupied = int(tokens[0]), int(tokens[1])
+            self.containers.append((max_cap, occupied, self.intern(tokens[2]) if occupied != 0 else 0))
+        else:
+            code = self.color_codes.get(tokens[1])
+            if code is None:
+                raise ValueError(f"{self.name}: the final state color `{tokens[1]}` is not used by the instance")
+            self.final_state.append((int(tokens[0]), code))
+
+    def build(self) -> Instance:
+        capacities, occupied, codes = zip(*self.containers) if self.containers else ((), (), ())
+        final_occupied, final_codes = zip(*self.final_state) if self.final_state else ((), ())
+        return Instance(self.name, tuple(self.color_codes), tuple(self.rules), capacities, occupied, codes,
+                        final_occupied, final_codes)
+
+
+def read_instances(f_in, name: str = '') -> Iterator[Instance]:
+    """
+        Parses the instances of a text file object one at a time, blank lines are skipped
+    """
+    builder = _InstanceBuilder(name)
+    section = _RULES
+    for line in f_in:
+        tokens = line.split()
+        if not tokens:
+            continue
+        if section == _FINAL_STATE and (len(tokens) == 3 or tokens[0] == INIT_STATE_LINE_SEPARATOR):
+            yield builder.build()
+            builder = _InstanceBuilder(name)
+            section = _RULES
+
+        if tokens[0] == INIT_STATE_LINE_SEPARATOR:
+            section = _INIT_STATE
+        elif tokens[0] == FINAL_STATE_LINE_SEPARATOR:
+            section = _FINAL_STATE
+        else:
+            builder.add_line(section, tokens)
+
+    if section != _FINAL_STATE:
+        raise ValueError(f"{name or 'input'}: the instance has no `{FINAL_STATE_LINE_SEPARATOR}` line")
+    yield builder.build()
+
+
+def _pack_instance(instance: Instance) -> bytes:
+    def strings(values: Iterable[str]) -> List[bytes]:
+        parts = []
+        for value in values:
+            encoded = value.encode()
+            parts += [_COUNT.pack(len(encoded)), encoded]
+        return parts
+
+    def codes(values: Tuple[int, ...]) -> bytes:
+        return struct.pack(f'<{len(values)}{_VALUE}', *values)
+
+    for field_name, label in (('capacities', 'capacity'), ('occupied', 'quantity'),
+                              ('final_occupied', 'final quantity')):
+        for value in getattr(instance, field_name):
+            if not 0 <= value <= _MAX_VALUE:
+                raise ValueError(f"{instance.name}: the {label} {value} doesn't fit in the binary format "
+                                 f"(0 to {_MAX_VALUE})")
+    nr_containers, nr_final = len(instance.capacities), len(instance.final_occupied)
+    return b''.join(strings([instance.name]) + [_COUNT.pack(len(instance.colors))] + strings(instance.colors) + [
+        _COUNT.pack(len(instance.rules)), codes(tuple(chain.from_iterable(instance.rules))),
+        _COUNT.pack(nr_containers), codes(instance.capacities + instance.occupied + instance.codes),
+        _COUNT.pack(nr_final), codes(instance.final_occupied + instance.final_codes),
+    ])
+
+
+def write_binary(path: str, instances: Iterable[Instance]) -> int:
+    """
+        Writes the instances to a binary instance file
+    :return: the number of instances written
+    """
+    offsets = []
+    with open(path, 'wb') as f_out:
+        f_out.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION))
+        for instance in instances:
+            offsets.append(f_out.tell())
+            f_out.write(_pack_instance(instance))
+        table_offset = f_out.tell()
+        f_out.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        f_out.write(_FOOTER.pack(len(offsets), table_offset))
+    return len(offsets)
+
+
+class BinaryInstances:
+    """
+        The instances of a binary instance file, decoded from a memory map when they are accessed
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f_in:
+            self.buffer = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack_from(self.buffer)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a binary instance file of version {BINARY_VERSION}")
+        count, table_offset = _FOOTER.unpack_from(self.buffer, len(self.buffer) - _FOOTER.size)
+        self.offsets = struct.unpack_from(f'<{count}Q', self.buffer, table_offset)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> Instance:
+        buffer = self.buffer
+        offset = self.offsets[index]
+
+        def count() -> int:
+            nonlocal offset
+            value, = _COUNT.unpack_from(buffer, offset)
+            offset += _COUNT.size
+            return value
+
+        def string() -> str:
+            nonlocal offset
+            length = count()
+            offset += length
+            return bytes(buffer[offset - length:offset]).decode()
+
+        def codes(length: int) -> Tuple[int, ...]:
+            nonlocal offset
+            values = struct.unpack_from(f'<{length}{_VALUE}', buffer, offset)
+            offset += struct.calcsize(f'<{length}{_VALUE}')
+            return values
+
+        name = string()
+        colors = tuple(string() for _ in range(count()))
+        rule_codes = codes(3 * count())
+        nr_containers = count()
+        container_codes = codes(3 * nr_containers)
+        nr_final = count()
+        final_codes = codes(2 * nr_final)
+        return Instance(name, colors, tuple(zip(rule_codes[0::3], rule_codes[1::3], rule_codes[2::3])),
+                        container_codes[:nr_containers], container_codes[nr_containers:2 * nr_containers],
+                        container_codes[2 * nr_containers:], final_codes[:nr_final], final_codes[nr_final:])
+
+    def __iter__(self) -> Iterator[Instance]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self) -> None:
+        self.buffer.close()
+
+    def __enter__(self) -> 'BinaryInstances':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def is_binary(path: str) -> bool:
+    with open(path, 'rb') as f_in:
+        return f_in.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def numbered_name(file_name: str, index: int) -> str:
+    stem, extension = os.path.splitext(file_name)
+    return f"{stem}_{index}{extension or '.txt'}"
+
+
+def load_instances(path: str) -> Iterator[Instance]:
+    """
+        The instances of a text or binary instance file. The instances of a text file are named after it,
+        followed by their position when the file holds more than one; binary files keep the names the
+        instances were compiled with.
+    """
+    if is_binary(path):
+        with BinaryInstances(path) as binary_instances:
+            yield from binary_instances
+        return
+
+    file_name = os.path.basename(path)
+    with open(path) as f_in:
+        parsed = read_instances(f_in, file_name)
+        first = next(parsed)
+        second = next(parsed, None)
+        if second is None:
+            yield first
+            return
+        for index, instance in enumerate(chain([first, second], parsed)):
+            yield replace(instance, name=numbered_name(file_name, index))
+
+
+def load_instance(path: str) -> Instance:
+    """
+        The first instance of a text or binary instance file
+    """
+    instances = load_instances(path)
+    try:
+        return next(instances)
+    finally:
+        instances.close()
+
+
+parser = ArgumentParser(description='Compiles instance files of the water containers problem to the binary format')
+parser.add_argument('output', help='Binary instance file written')
+parser.add_argument('inputs', nargs='+', help='Text or binary instance files, or folders of instance files')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    input_paths = []
+    for input_path in args.inputs:
+        if os.path.isdir(input_path):
+            input_paths.extend(os.path.join(input_path, name) for name in sorted(os.listdir(input_path)))
+        else:
+            input_paths.append(input_path)
+    nr_written = write_binary(args.output, chain.from_iterable(load_instances(path) for path in input_paths))
+    print(f"Wrote {nr_written} instances to {args.output}")
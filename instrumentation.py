@@ -0,0 +1,277 @@
+"""
+    Optional instrumentation of the searches. A `SearchObserver` set as `Graph.observer` is notified
+    when nodes are expanded, generated, pruned and when solutions are found. When no observer is set
+    the searches only pay for an `is None` check per expansion and per generated move.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import wraps
+from time import perf_counter_ns
+from typing import Dict, List, Optional, Callable, Sequence
+
+import custom_heap
+import graph
+import node
+
+PRUNE_CYCLE = 'cycle'
+PRUNE_DUPLICATE = 'duplicate'
+PRUNE_QUANTITY = 'quantity'
+PRUNE_UNREACHABLE = 'unreachable colors'
+PRUNE_DEAD_END = 'dead end'
+
+PHASE_SUCCESSORS = 'successor generation'
+PHASE_HASHING = 'hashing'
+PHASE_HEURISTIC = 'heuristic'
+PHASE_HEAP = 'heap operations'
+# Graph attributes wrapped by `PhaseTimer`
+TIMED_ATTRIBUTES = (('generate_successors', PHASE_SUCCESSORS), ('zobrist_key', PHASE_HASHING),
+                    ('heuristic', PHASE_HEURISTIC))
+
+
+@dataclass
+class GeneratedMove:
+    """
+        A move generated by `Graph.generate_successors`, passed to `on_generate` and `on_prune`
+        since the moves are checked before their node is built
+    """
+    parent: node.Node
+    container_from_idx: int
+    container_to_idx: int
+
+    @property
+    def cost_from_root(self) -> int:
+        return self.parent.cost_from_root + 1
+
+
+class SearchObserver:
+    """
+        Base observer, every hook does nothing. `target_node` is a node or a `cursor.StateCursor`,
+        or a `GeneratedMove` for `on_generate` and `on_prune`, except for `on_solution` which always
+        gets a node.
+    """
+
+    def on_search_start(self, gr: graph.Graph) -> None:
+        pass
+
+    def on_search_end(self, gr: graph.Graph) -> None:
+        pass
+
+    def on_heap(self, heap: custom_heap.CustomHeap) -> None:
+        pass
+
+    def on_expand(self, target_node) -> None:
+        pass
+
+    def on_generate(self, target_node) -> None:
+        pass
+
+    def on_prune(self, target_node, reason: str) -> None:
+        pass
+
+    def on_solution(self, target_node: node.Node) -> None:
+        pass
+
+    def report(self) -> str:
+        return ''
+
+    def reset(self) -> None:
+        pass
+
+
+class ObserverGroup(SearchObserver):
+    """
+        Forwards every notification to several observers
+    """
+
+    def __init__(self, observers: List[SearchObserver]):
+        self.observers = observers
+
+    def on_search_start(self, gr):
+        for observer in self.observers:
+            observer.on_search_start(gr)
+
+    def on_search_end(self, gr):
+        for observer in self.observers:
+            observer.on_search_end(gr)
+
+    def on_heap(self, heap):
+        for observer in self.observers:
+            observer.on_heap(heap)
+
+    def on_expand(self, target_node):
+        for observer in self.observers:
+            observer.on_expand(target_node)
+
+    def on_generate(self, target_node):
+        for observer in self.observers:
+            observer.on_generate(target_node)
+
+    def on_prune(self, target_node, reason):
+        for observer in self.observers:
+            observer.on_prune(target_node, reason)
+
+    def on_solution(self, target_node):
+        for observer in self.observers:
+            observer.on_solution(target_node)
+
+    def report(self):
+        return ''.join(observer.report() for observer in self.observers)
+
+    def reset(self):
+        for observer in self.observers:
+            observer.reset()
+
+
+class PhaseTimer(SearchObserver):
+    """
+        Time spent generating successors, hashing, evaluating the heuristic and in heap operations.
+        The measured functions are wrapped when a search starts and put back when it ends; the times are
+        inclusive (pushing in a heap evaluates the heuristic of the node) and include the cost of the timer itself.
+    """
+
+    def __init__(self):
+        self.times: Dict[str, int] = defaultdict(int)
+        self.calls: Dict[str, int] = defaultdict(int)
+        # the instance attributes of the graph replaced by the wrappers, None for a method of the class
+        self.originals: Dict[str, Optional[Callable]] = {}
+
+    def _timed(self, phase: str, func: Callable) -> Callable:
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.times[phase] += perf_counter_ns() - start
+                self.calls[phase] += 1
+
+        return timed
+
+    def on_search_start(self, gr):
+        # a new IDA* iteration starts without ending the previous one
+        self.on_search_end(gr)
+        for name, phase in TIMED_ATTRIBUTES:
+            func = getattr(gr, name)
+            if func is not None:
+                self.originals[name] = vars(gr).get(name)
+                setattr(gr, name, self._timed(phase, func))
+
+    def on_search_end(self, gr):
+        for name, original in self.originals.items():
+            if original is None:
+                delattr(gr, name)
+            else:
+                setattr(gr, name, original)
+        self.originals.clear()
+
+    def on_heap(self, heap):
+        heap.push = self._timed(PHASE_HEAP, heap.push)
+        heap.pop = self._timed(PHASE_HEAP, heap.pop)
+        heap.remove = self._timed(PHASE_HEAP, heap.remove)
+
+    def report(self):
+        lines = ["Time per phase:\n"]
+        for phase in (PHASE_SUCCESSORS, PHASE_HASHING, PHASE_HEURISTIC, PHASE_HEAP):
+            lines.append(f"-{phase}: {self.times[phase] / 1e6:.3f} ms in {self.calls[phase]} calls\n")
+        return ''.join(lines) + '\n'
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+
+
+class BranchingFactor(SearchObserver):
+    """
+        Effective branching factor per depth: successors kept for every expanded node at that depth,
+        together with the reasons the other successors were pruned
+    """
+
+    def __init__(self):
+        self.expanded: Dict[int, int] = defaultdict(int)
+        self.generated: Dict[int, int] = defaultdict(int)
+        self.pruned: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def on_expand(self, target_node):
+        self.expanded[target_node.cost_from_root] += 1
+
+    def on_generate(self, target_node):
+        self.generated[target_node.cost_from_root - 1] += 1
+
+    def on_prune(self, target_node, reason):
+        self.pruned[target_node.cost_from_root - 1][reason] += 1
+
+    def report(self):
+        lines = ["Effective branching factor per depth:\n"]
+        for depth in sorted(self.expanded):
+            pruned = self.pruned[depth]
+            kept = self.generated[depth] - sum(pruned.values())
+            reasons = ', '.join(f"{reason}: {count}" for reason, count in sorted(pruned.items()))
+            lines.append(f"-depth {depth}: {kept / self.expanded[depth]:.2f} "
+                         f"({self.expanded[depth]} expanded, {kept} kept"
+                         f"{', pruned ' + reasons if reasons else ''})\n")
+        return ''.join(lines) + '\n'
+
+    def reset(self):
+        self.expanded.clear()
+        self.generated.clear()
+        self.pruned.clear()
+
+
+class HeuristicAccuracy(SearchObserver):
+    """
+        Compares the heuristic with the true remaining cost of the nodes on every solution path
+    """
+
+    def __init__(self):
+        self.heuristic: Optional[Callable] = None
+        self.samples = 0
+        self.exact = 0
+        self.overestimated = 0
+        self.error_sum = 0
+
+    def on_search_start(self, gr):
+        self.heuristic = gr.heuristic
+
+    def on_solution(self, target_node):
+        if self.heuristic is None:
+            return
+        ancestor = target_node
+        while ancestor is not None:
+            true_cost = target_node.cost_from_root - ancestor.cost_from_root
+            estimation = self.heuristic(ancestor)
+            self.samples += 1
+            self.exact += estimation == true_cost
+            self.overestimated += estimation > true_cost
+            self.error_sum += abs(estimation - true_cost)
+            ancestor = ancestor.parent
+
+    def report(self):
+        if self.samples == 0:
+            return ''
+        return f"Heuristic accuracy on {self.samples} solution path nodes: {self.exact} exact, " \
+               f"{self.overestimated} overestimated, mean absolute error {self.error_sum / self.samples:.2f}\n\n"
+
+    def reset(self):
+        self.heuristic = None
+        self.samples = self.exact = self.overestimated = self.error_sum = 0
+
+
+COLLECTORS = {
+    'timing': PhaseTimer,
+    'branching': BranchingFactor,
+    'accuracy': HeuristicAccuracy,
+}
+
+
+def create_observer(names: Sequence[str]) -> Optional[SearchObserver]:
+    """
+        Builds the observer of the collectors named in `names` (keys of `COLLECTORS`)
+    """
+    if not names:
+        return None
+    if len(names) == 1:
+        return COLLECTORS[names[0]]()
+    return ObserverGroup([COLLECTORS[name]() for name in names])
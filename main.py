@@ -3,31 +3,58 @@
 import os
 import sys
 from math import ceil
-from typing import Tuple
+from operator import attrgetter
+from typing import Callable, List, Tuple, Optional
 
 from container import Container
 from argparse import ArgumentParser
 from time import time
 
+import batch
 import custom_heap
+import hda
+import instrumentation
+from moves_log import MovesLog, write_records
 import node
+import regression
 import color
-from graph import Graph
+from budget import SearchBudget
+from cursor import StateCursor
+from external_frontier import ExternalFrontier, FRONTIER_MEMORY_MB, NO_PARENT, pack
+from graph import Graph, HEURISTIC_DESCRIPTIONS, INFINITY
+from analysis import Analysis, analyze
+from instances import Instance, INIT_STATE_LINE_SEPARATOR, FINAL_STATE_LINE_SEPARATOR, load_instance, \
+    load_instances, read_instances
+from pattern_db import PDB_MAX_BITS, PDB_MAX_SECONDS
+from solution_cache import SolutionCache, SolutionRecorder, CACHE_DIR, CACHE_MAX_MB, instance_key
+from stats import SearchStats
+from nogood import NogoodCache
+from transposition import TranspositionTable, POLICIES, DEPTH_PREFERRED
 
-INIT_STATE_LINE_SEPARATOR = "stare_initiala"
-FINAL_STATE_LINE_SEPARATOR = "stare_finala"
+ALGORITHM_SEPARATOR = "\n\n###############################################\n\n"
+SMA_MAX_NODES = 100000
+WEIGHT = 2.0
+WEIGHT_STEP = 0.5
+# low-link of an IDA* frame whose subtree may reach the final state
+LIVE = -1
+DEFAULT_ALGORITHMS = 'a_star,a_star_opt,ida_star'
+OPEN_LIST_HEAP = 'heap'
+OPEN_LIST_BUCKETS = 'buckets'
+OPEN_LISTS = (OPEN_LIST_HEAP, OPEN_LIST_BUCKETS)
+HEURISTIC_SEPARATOR = "\n\n#####################################################################################\n\n"
 
 parser = ArgumentParser(usage=__file__ + ' '
                                          '-i/--input '
                                          '-o/--output'
                                          '-n/--nsol'
-                                         '-t/--timeout',
+                                         '-t/--timeout '
+                                         '-j/--jobs',
                         description='Solution generator for the water containers problem')
 
 parser.add_argument('-i', '--input',
                     dest='input',
                     default='./input',
-                    help='Input folder')
+                    help='Input folder, its files hold one or more instances (text or compiled by instances.py)')
 
 parser.add_argument('-o', '--output',
                     dest='output',
@@ -43,11 +70,162 @@ parser.add_argument('-n', '--nsol',
 parser.add_argument('-t', '--timeout',
                     dest='timeout',
                     default=10,
-                    type=int,
+                    type=float,
                     help='Number of seconds till timeout')
 
-# Parse arguments
-args = vars(parser.parse_args())
+parser.add_argument('--max-expansions',
+                    dest='max_expansions',
+                    default=0,
+                    type=int,
+                    help='Number of expanded nodes after which a search stops, 0 for no limit')
+
+parser.add_argument('--max-in-memory',
+                    dest='max_in_memory',
+                    default=0,
+                    type=int,
+                    help='Number of nodes a search can keep (open and closed) before it stops, 0 for no limit')
+
+parser.add_argument('--max-rss-mb',
+                    dest='max_rss_mb',
+                    default=0,
+                    type=int,
+                    help='Peak resident memory in MB after which a search stops, 0 for no limit')
+
+parser.add_argument('--tt-size',
+                    dest='tt_size',
+                    default=0,
+                    type=int,
+                    help='Number of transposition table entries shared by a search, 0 disables it')
+
+parser.add_argument('--tt-policy',
+                    dest='tt_policy',
+                    default=DEPTH_PREFERRED,
+                    choices=POLICIES,
+                    help='Transposition table replacement policy')
+
+parser.add_argument('--nogood-size',
+                    dest='nogood_size',
+                    default=0,
+                    type=int,
+                    help='Number of dead end states remembered for every instance and shared by its runs, 0 to disable')
+
+parser.add_argument('--frontier-dir',
+                    dest='frontier_dir',
+                    default=None,
+                    help='Run UCS and A* with an external frontier spilled to files in this folder')
+
+parser.add_argument('--frontier-memory-mb',
+                    dest='frontier_memory_mb',
+                    default=FRONTIER_MEMORY_MB,
+                    type=int,
+                    help='Memory used by the external frontier buffers before they are written to disk')
+
+parser.add_argument('-a', '--algorithms',
+                    dest='algorithms',
+                    default=DEFAULT_ALGORITHMS,
+                    help='Comma separated algorithms run with every heuristic, '
+                         'from: a_star, a_star_opt, weighted_a_star, ara_star, ida_star, rbfs, sma_star, '
+                         'bidirectional, hda_star')
+
+parser.add_argument('--open-list',
+                    dest='open_list',
+                    default=OPEN_LIST_HEAP,
+                    choices=OPEN_LISTS,
+                    help='Open list of UCS, A* and A* optimal: a binary heap, or buckets by estimated cost '
+                         '(then by heuristic, so ties are broken toward deeper nodes)')
+
+parser.add_argument('--max-nodes',
+                    dest='max_nodes',
+                    default=SMA_MAX_NODES,
+                    type=int,
+                    help='Number of nodes SMA* can keep in memory')
+
+parser.add_argument('--weight',
+                    dest='weight',
+                    default=WEIGHT,
+                    type=float,
+                    help='Weight of the heuristic in weighted A*, initial weight of ARA*')
+
+parser.add_argument('--weight-step',
+                    dest='weight_step',
+                    default=WEIGHT_STEP,
+                    type=float,
+                    help='Amount ARA* lowers its weight by after every solution')
+
+parser.add_argument('--hda-workers',
+                    dest='workers',
+                    default=hda.HDA_WORKERS,
+                    type=int,
+                    help='Number of worker processes of HDA*')
+
+parser.add_argument('--symmetry',
+                    dest='symmetry',
+                    action='store_true',
+                    help='Treat containers with the same capacity and contents as interchangeable '
+                         'when detecting duplicate states')
+
+parser.add_argument('--pdb-dir',
+                    dest='pdb_dir',
+                    default=None,
+                    help='Folder where the pattern databases are saved and reused by the next runs')
+
+parser.add_argument('--pdb-max-bits',
+                    dest='pdb_max_bits',
+                    default=PDB_MAX_BITS,
+                    type=int,
+                    help='Maximal size of a pattern database, 2^bits quantity vectors: instances with more fall back '
+                         'to admissible heuristic no. 2')
+
+parser.add_argument('--pdb-max-seconds',
+                    dest='pdb_max_seconds',
+                    default=PDB_MAX_SECONDS,
+                    type=float,
+                    help='Time a pattern database can take to build, outside the timeouts of the searches: '
+                         'instances taking longer fall back to admissible heuristic no. 2')
+
+parser.add_argument('--instrument',
+                    dest='instrument',
+                    default='',
+                    help='Comma separated collectors reported after every algorithm, '
+                         'from: timing, branching, accuracy')
+
+parser.add_argument('--moves-jsonl',
+                    dest='moves_jsonl',
+                    action='store_true',
+                    help='Also write every solution as a JSON line of moves in moves_<input>.jsonl')
+
+parser.add_argument('--cache-dir',
+                    dest='cache_dir',
+                    default=CACHE_DIR,
+                    help='Folder of the cached results of previous runs')
+
+parser.add_argument('--cache-max-mb',
+                    dest='cache_max_mb',
+                    default=CACHE_MAX_MB,
+                    type=int,
+                    help='Size of the cache, the least recently used results are removed beyond it')
+
+parser.add_argument('--no-analysis',
+                    dest='no_analysis',
+                    action='store_true',
+                    help='Run the searches without the pre-analysis proving unsolvable instances and bounding the '
+                         'solution length')
+
+parser.add_argument('--no-cache',
+                    dest='no_cache',
+                    action='store_true',
+                    help='Solve every instance without reading or storing cached results')
+
+parser.add_argument('--refresh',
+                    dest='refresh',
+                    action='store_true',
+                    help='Solve every instance again and replace the cached results')
+
+parser.add_argument('-j', '--jobs',
+                    dest='jobs',
+                    default=1,
+                    type=int,
+                    help='Number of worker processes, each (file, algorithm, heuristic) pair is a separate task')
 
 def print_solution(output_f, max_in_mem, nr_sol, nr_successors, selected_node, sol_cnt, start_time):
     sol_cnt += 1
@@ -56,242 +234,1274 @@ def print_solution(output_f, max_in_mem, nr_sol, nr_successors, selected_node, s
           f"-generated {nr_successors} nodes, "
           f"with a maximum of {max_in_mem} nodes in memory.\n\n"
           f"Steps:\n")
-    output_f.write(selected_node.get_road())
+    if selected_node.graph.solution_recorder is None:
+        output_f.writelines(selected_node.iter_road())
+    else:
+        # `output_f` is the recorder, the path isn't kept in the cached text
+        selected_node.graph.solution_recorder.write_solution(selected_node)
+    if selected_node.graph.moves_log is not None:
+        selected_node.graph.moves_log.write(selected_node, sol_cnt)
     nr_sol -= 1
     return nr_sol, sol_cnt
 
 
-def ucs(output_f, gr: Graph, nr_sol: int = 1, timeout: int = 0):
+def print_transposition_stats(output_f, gr: Graph):
+    if gr.transposition_table is not None:
+        output_f.write(f"Transposition table pruned {gr.transposition_table.hits} nodes "
+                       f"({gr.transposition_table.collisions} slot collisions).\n")
+
+
+def print_nogood_stats(output_f, gr: Graph):
+    if gr.nogoods is not None:
+        output_f.write(f"Dead end cache pruned {gr.nogoods.hits} nodes, learned {gr.nogoods.learned} dead ends "
+                       f"({gr.nogoods.size} kept, {gr.nogoods.evictions} evicted).\n")
+
+
+def print_observer_report(output_f, gr: Graph):
+    if gr.observer is not None:
+        gr.observer.on_search_end(gr)
+        output_f.write(gr.observer.report())
+        gr.observer.reset()
+
+
+def print_budget_stop(output_f, budget: SearchBudget, best_node: Optional[node.Node] = None,
+                      estimated_cost: Optional[int] = None):
+    """
+        Reports why the search stopped and the best partial result: the frontier node with the lowest
+        estimated cost (its own, unless the search backed up a better one in `estimated_cost`)
+    """
+    output_f.write(budget.stop_message())
+    if best_node is None:
+        return
+    if estimated_cost is None:
+        estimated_cost = best_node.estimated_cost if best_node.graph.heuristic is not None \
+            else best_node.cost_from_root
+    output_f.write(f"Best partial result (estimated cost {estimated_cost}, "
+                   f"{best_node.cost_from_root} steps from the initial state):\n")
+    output_f.writelines(best_node.iter_road())
+
+
+def create_open_list(open_list: str, initial, key: Callable, tie_key: Optional[Callable] = None):
+    """
+        The open list of a search with integer keys, `tie_key` orders the nodes with the same key in buckets
+    """
+    if open_list == OPEN_LIST_BUCKETS:
+        return custom_heap.BucketQueue(initial, key, tie_key)
+    return custom_heap.CustomHeap(initial, key)
+
+
+def heuristic_value(target_node: node.Node) -> int:
+    return target_node.estimated_cost - target_node.cost_from_root
+
+
+def ucs(output_f, gr: Graph, nr_sol: int = 1, timeout: int = 0,
+        budget: Optional[SearchBudget] = None, frontier_dir: Optional[str] = None,
+        frontier_memory_mb: int = FRONTIER_MEMORY_MB, open_list: str = OPEN_LIST_HEAP) -> SearchStats:
+    if frontier_dir is not None:
+        return external_search(output_f, gr, "UCS", False, nr_sol, timeout, budget, frontier_dir, frontier_memory_mb)
+
     output_f.write("\n\n############################################################################\n\n")
     output_f.write("Started algorithm UCS\n")
 
     start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
-    expanded_nodes = custom_heap.CustomHeap([gr.root], key=lambda x: x.cost_from_root)
-    flag = False if timeout == 0 else True
+    stats = SearchStats()
+    gr.start_search()
+    expanded_nodes = create_open_list(open_list, [gr.root], attrgetter('cost_from_root'))
+    if gr.observer is not None:
+        gr.observer.on_heap(expanded_nodes)
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
 
-    while len(expanded_nodes.data) > 0:
+    while len(expanded_nodes) > 0:
         selected_node = expanded_nodes.pop()
 
-        if flag:
-            if round(time() - start_time) >= timeout:
-                output_f.write("Solution stopped due to timeout\n")
-                break
+        if budget.exhausted(len(expanded_nodes)):
+            print_budget_stop(output_f, budget, selected_node)
+            stats.stopped = True
+            break
 
         if gr.test_final(selected_node):
             nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, selected_node, sol_cnt, start_time)
+            if gr.observer is not None:
+                gr.observer.on_solution(selected_node)
+            stats.solution_costs.append(selected_node.cost_from_root)
             if nr_sol == 0 or selected_node == gr.root:
                 break
 
         successors = gr.generate_successors(selected_node)
         nr_successors += len(successors)
+        stats.nodes_expanded += 1
         for s in successors:
             expanded_nodes.push(s)
-        max_in_mem = max(max_in_mem, len(expanded_nodes.data) + len(successors))
+        max_in_mem = max(max_in_mem, expanded_nodes.stored + len(successors))
+        stats.max_open = max(stats.max_open, len(expanded_nodes))
 
     if nr_sol != 0:
         output_f.write("All paths exhausted! No solution left.\n")
+    print_transposition_stats(output_f, gr)
+    print_nogood_stats(output_f, gr)
+    print_observer_report(output_f, gr)
     output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
-    output_f.write("\n\n###############################################\n\n")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    return stats
 
 
-def a_star(output_f, gr: Graph, nr_sol: int = 1, timeout=0):
+def a_star(output_f, gr: Graph, nr_sol: int = 1, timeout=0,
+           budget: Optional[SearchBudget] = None, frontier_dir: Optional[str] = None,
+           frontier_memory_mb: int = FRONTIER_MEMORY_MB, open_list: str = OPEN_LIST_HEAP) -> SearchStats:
+    if frontier_dir is not None:
+        return external_search(output_f, gr, "A*", True, nr_sol, timeout, budget, frontier_dir, frontier_memory_mb)
+
     output_f.write("\n\n############################################################################\n\n")
     output_f.write("Started algorithm A*\n")
 
     start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
-    expanded_nodes = custom_heap.CustomHeap([gr.root], key=lambda x: x.estimated_cost)
-    flag = False if timeout == 0 else True
+    stats = SearchStats()
+    gr.start_search()
+    expanded_nodes = create_open_list(open_list, [gr.root], attrgetter('estimated_cost'), heuristic_value)
+    if gr.observer is not None:
+        gr.observer.on_heap(expanded_nodes)
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
 
-    while len(expanded_nodes.data) > 0:
+    while len(expanded_nodes) > 0:
         selected_node = expanded_nodes.pop()
 
-        if flag:
-            if round(time() - start_time) >= timeout:
-                output_f.write("Solution stopped due to timeout\n")
-                break
+        if budget.exhausted(len(expanded_nodes)):
+            print_budget_stop(output_f, budget, selected_node)
+            stats.stopped = True
+            break
 
         if gr.test_final(selected_node):
             nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, selected_node, sol_cnt, start_time)
+            if gr.observer is not None:
+                gr.observer.on_solution(selected_node)
+            stats.solution_costs.append(selected_node.cost_from_root)
             if nr_sol == 0 or selected_node == gr.root:
                 break
 
         successors = gr.generate_successors(selected_node)
         nr_successors += len(successors)
+        stats.nodes_expanded += 1
         for s in successors:
             expanded_nodes.push(s)
-        max_in_mem = max(max_in_mem, len(expanded_nodes.data) + len(successors))
+        max_in_mem = max(max_in_mem, expanded_nodes.stored + len(successors))
+        stats.max_open = max(stats.max_open, len(expanded_nodes))
 
     if nr_sol != 0:
         output_f.write("All paths exhausted! No solution left.\n")
+    print_transposition_stats(output_f, gr)
+    print_nogood_stats(output_f, gr)
+    print_observer_report(output_f, gr)
     output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
-    output_f.write("\n\n###############################################\n\n")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    return stats
 
 
-def a_star_opt(output_f, gr: Graph, nr_sol: int = 1, timeout=0):
+def external_search(output_f, gr: Graph, name: str, use_heuristic: bool, nr_sol: int, timeout,
+                    budget: Optional[SearchBudget], frontier_dir: str, frontier_memory_mb: int) -> SearchStats:
+    """
+        UCS (or A*, with `use_heuristic`) over an `ExternalFrontier`: only the bucket being expanded
+        and the buffers of the others up to `frontier_memory_mb` are kept in memory. A state is expanded
+        once, the first time its bucket is reached.
+    """
     output_f.write("\n\n############################################################################\n\n")
-    output_f.write("Started algorithm A* optimal\n")
+    output_f.write(f"Started algorithm {name} (external frontier)\n")
 
     start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
-    expanded_nodes = custom_heap.CustomHeap([gr.root], key=lambda x: x.estimated_cost)
-    closed_nodes = list()
-    flag = False if timeout == 0 else True
+    stats = SearchStats()
+    # the expanded nodes are rebuilt without their ancestors, only the frontier detects duplicates
+    gr.start_search(regenerates_nodes=True)
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
+    key_of = None
+    if gr.symmetry_reduction:
+        def key_of(state):
+            return pack(tuple(container for _, container in sorted(zip(gr.capacities, state))))
+    frontier = ExternalFrontier(frontier_dir, len(gr.capacities), frontier_memory_mb << 20, key_of)
 
-    while len(expanded_nodes.data) > 0:
-        selected_node = expanded_nodes.pop()
+    def heuristic(target_node: node.Node) -> int:
+        return gr.heuristic(target_node) if use_heuristic else 0
 
-        if flag:
-            if round(time() - start_time) >= timeout:
-                output_f.write("Solution stopped due to timeout\n")
+    def replay(node_id: int) -> node.Node:
+        current = gr.root
+        for i, j in frontier.path(node_id):
+            current = node.Node(gr, current, i, j)
+        return current
+
+    try:
+        frontier.push(0, heuristic(gr.root), NO_PARENT, (0, 0), gr.root.state)
+        while not stats.stopped:
+            bucket = frontier.pop_bucket()
+            if bucket is None:
                 break
+            cost_from_root, bucket_heuristic, batch = bucket
+            max_in_mem = max(max_in_mem, len(batch) + frontier.in_memory // frontier.record_size)
+
+            for node_id, state in batch:
+                if budget.exhausted(len(batch) + frontier.in_memory // frontier.record_size):
+                    print_budget_stop(output_f, budget, replay(node_id), cost_from_root + bucket_heuristic)
+                    stats.stopped = True
+                    break
+
+                selected_node = node.Node(gr, None, 0, 0, state)
+                if gr.test_final(selected_node):
+                    solution = replay(node_id)
+                    nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, solution, sol_cnt,
+                                                     start_time)
+                    if gr.observer is not None:
+                        gr.observer.on_solution(solution)
+                    stats.solution_costs.append(cost_from_root)
+                    if nr_sol == 0 or cost_from_root == 0:
+                        stats.stopped = True
+                        break
+
+                successors = gr.generate_successors(selected_node)
+                nr_successors += len(successors)
+                stats.nodes_expanded += 1
+                for s in successors:
+                    s_heuristic = heuristic(s)
+                    if s_heuristic < INFINITY:
+                        frontier.push(cost_from_root + 1, s_heuristic, node_id,
+                                      (s.container_from_idx, s.container_to_idx), s.state)
+            stats.max_open = max(stats.max_open, len(frontier))
+    finally:
+        frontier.close()
+    # `stopped` also ended the loop after the last solution
+    stats.stopped = budget.reason is not None
+
+    if nr_sol != 0:
+        output_f.write("All paths exhausted! No solution left.\n")
+    output_f.write(f"External frontier: {frontier.spilled} records spilled to disk, "
+                   f"{frontier.duplicates} duplicates removed.\n")
+    print_observer_report(output_f, gr)
+    output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    return stats
+
+
+def a_star_opt(output_f, gr: Graph, nr_sol: int = 1, timeout=0,
+               budget: Optional[SearchBudget] = None, weight: float = 1,
+               open_list: str = OPEN_LIST_HEAP) -> SearchStats:
+    """
+        A* with duplicate detection, re-opening the states reached again with a lower cost. With a `weight`
+        above 1 the nodes are ordered by g + weight * h (weighted A*), the solutions then cost at most
+        `weight` times the optimal cost when the heuristic is admissible. Weighted keys aren't integers,
+        they are always kept in a heap.
+    """
+    output_f.write("\n\n############################################################################\n\n")
+    if weight == 1:
+        output_f.write("Started algorithm A* optimal\n")
+    else:
+        output_f.write(f"Started algorithm weighted A* (w={weight:g}, solutions within {weight:g} times "
+                       f"the optimal cost)\n")
+
+    start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
+    stats = SearchStats()
+    gr.start_search()
+    if weight == 1:
+        expanded_nodes = create_open_list(open_list, None, attrgetter('estimated_cost'), heuristic_value)
+    else:
+        expanded_nodes = custom_heap.CustomHeap(key=lambda x: weighted_cost(x, weight))
+    if gr.observer is not None:
+        gr.observer.on_heap(expanded_nodes)
+    # best known (state, cost from root) for every state hash seen so far (open or closed)
+    best_cost = {gr.root.state_hash: (gr.state_key(gr.root.state), 0)}
+    # heap entries of the states currently in open, by state hash
+    open_entries = {gr.root.state_hash: expanded_nodes.push(gr.root)}
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
+
+    while len(expanded_nodes) > 0:
+        selected_node = expanded_nodes.pop()
+        open_entry = open_entries.get(selected_node.state_hash)
+        if open_entry is not None and open_entry[2] is selected_node:
+            del open_entries[selected_node.state_hash]
+
+        if budget.exhausted(len(best_cost)):
+            print_budget_stop(output_f, budget, selected_node)
+            stats.stopped = True
+            break
 
         if gr.test_final(selected_node):
             nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, selected_node, sol_cnt, start_time)
+            if gr.observer is not None:
+                gr.observer.on_solution(selected_node)
+            stats.solution_costs.append(selected_node.cost_from_root)
             if nr_sol == 0 or selected_node == gr.root:
                 break
 
         successors = gr.generate_successors(selected_node)
-        successors_cpy = successors.copy()
         nr_successors += len(successors)
-        found_in_open = True
-        append_to_open = True
-        for s in successors_cpy:
-            for target in expanded_nodes.data:
-                if s.state_hash == target[2].state_hash:
-                    if s.state == target[2].state:
-                        found_in_open = True
-                        if s.estimated_cost < target[2].estimated_cost:
-                            expanded_nodes.data.remove(target)
-                            expanded_nodes.heapify()
-                        else:
-                            append_to_open = False
-                        break
+        stats.nodes_expanded += 1
+        for s in successors:
+            known = best_cost.get(s.state_hash)
+            state_key = gr.state_key(s.state)
+            if known is not None and known[1] <= s.cost_from_root and known[0] == state_key:
+                if gr.observer is not None:
+                    gr.observer.on_prune(s, instrumentation.PRUNE_DUPLICATE)
+                continue
 
-            if not found_in_open:
-                for close_idx, target in enumerate(closed_nodes):
-                    if s.state_hash == target.state_hash:
-                        if s.state == target.state:
-                            if s.estimated_cost < target.estimated_cost:
-                                closed_nodes[close_idx] = closed_nodes[-1]
-                                closed_nodes.pop()
-                            else:
-                                append_to_open = False
-                            break
-            if append_to_open:
-                expanded_nodes.push(s)
-
-        max_in_mem = max(max_in_mem, len(expanded_nodes.data) + len(successors) + len(closed_nodes))
-        closed_nodes.append(selected_node)
+            best_cost[s.state_hash] = (state_key, s.cost_from_root)
+            stale_entry = open_entries.get(s.state_hash)
+            if stale_entry is not None and gr.state_key(stale_entry[2].state) == state_key:
+                expanded_nodes.remove(stale_entry)
+            open_entries[s.state_hash] = expanded_nodes.push(s)
+
+        closed_cnt = len(best_cost) - len(open_entries)
+        max_in_mem = max(max_in_mem, expanded_nodes.stored + closed_cnt)
+        stats.max_open = max(stats.max_open, len(expanded_nodes))
+        stats.max_closed = max(stats.max_closed, closed_cnt)
 
     if nr_sol != 0:
         output_f.write("All paths exhausted! No solution left.\n")
+    output_f.write(f"Skipped {expanded_nodes.stale_skipped} stale open entries.\n")
+    print_transposition_stats(output_f, gr)
+    print_nogood_stats(output_f, gr)
+    print_observer_report(output_f, gr)
     output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
-    output_f.write("\n\n###############################################\n\n")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    return stats
+
+
+def weighted_cost(target_node: node.Node, weight: float) -> float:
+    return target_node.cost_from_root + weight * (target_node.estimated_cost - target_node.cost_from_root)
+
+
+def weighted_a_star(output_f, gr: Graph, nr_sol: int = 1, timeout=0,
+                    budget: Optional[SearchBudget] = None, weight: float = WEIGHT) -> SearchStats:
+    return a_star_opt(output_f, gr, nr_sol, timeout, budget, weight)
+
+
+def ara_star(output_f, gr: Graph, nr_sol: int = 1, timeout=0, budget: Optional[SearchBudget] = None,
+             weight: float = WEIGHT, weight_step: float = WEIGHT_STEP) -> SearchStats:
+    """
+        Anytime repairing A*: a weighted A* search is run with `weight`, then again with the weight lowered
+        by `weight_step` down to 1. Every run continues from the states of the previous one: the open states
+        and the closed states whose cost from root was lowered in the meantime (the inconsistent ones) are
+        re-queued with the new weight, the other closed states aren't expanded again. A run stops once no
+        open state orders before the best solution. Every better solution is printed with its proven
+        suboptimality bound: its cost divided by the lowest g + h of the states left to expand (for an
+        admissible heuristic). `nr_sol` is ignored, the search stops once the bound reaches 1.
+    """
+    output_f.write("\n\n############################################################################\n\n")
+    output_f.write(f"Started algorithm ARA* (w={weight:g}, lowered by {weight_step:g})\n")
+
+    start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
+    stats = SearchStats()
+    gr.start_search()
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
+    current_weight = weight
+
+    def priority(target_node: node.Node) -> float:
+        return weighted_cost(target_node, current_weight)
+
+    expanded_nodes = custom_heap.CustomHeap(key=priority)
+    if gr.observer is not None:
+        gr.observer.on_heap(expanded_nodes)
+    root_key = gr.state_key(gr.root.state)
+    # node with the lowest cost from root of every state reached so far
+    best_node = {root_key: gr.root}
+    open_entries = {root_key: expanded_nodes.push(gr.root)}
+    closed = set()
+    inconsistent = {}
+    incumbent = gr.root if gr.test_final(gr.root) else None
+    reported = None
+    bound = None
+
+    while True:
+        while len(expanded_nodes) > 0:
+            if incumbent is not None and expanded_nodes.peek_key() >= incumbent.cost_from_root:
+                break
+            selected_node = expanded_nodes.pop()
+            state_key = gr.state_key(selected_node.state)
+            del open_entries[state_key]
+
+            if budget.exhausted(len(best_node)):
+                print_budget_stop(output_f, budget, selected_node)
+                stats.stopped = True
+                break
+
+            closed.add(state_key)
+            if gr.test_final(selected_node):
+                continue
+
+            successors = gr.generate_successors(selected_node)
+            nr_successors += len(successors)
+            stats.nodes_expanded += 1
+            for s in successors:
+                if s.estimated_cost >= INFINITY:
+                    continue
+                state_key = gr.state_key(s.state)
+                known = best_node.get(state_key)
+                if known is not None and known.cost_from_root <= s.cost_from_root:
+                    if gr.observer is not None:
+                        gr.observer.on_prune(s, instrumentation.PRUNE_DUPLICATE)
+                    continue
+
+                best_node[state_key] = s
+                if gr.test_final(s) and (incumbent is None or s.cost_from_root < incumbent.cost_from_root):
+                    incumbent = s
+                if state_key in closed:
+                    inconsistent[state_key] = s
+                else:
+                    stale_entry = open_entries.get(state_key)
+                    if stale_entry is not None:
+                        expanded_nodes.remove(stale_entry)
+                    open_entries[state_key] = expanded_nodes.push(s)
+
+            max_in_mem = max(max_in_mem, len(best_node))
+            stats.max_open = max(stats.max_open, len(expanded_nodes))
+            stats.max_closed = max(stats.max_closed, len(closed))
+
+        if stats.stopped:
+            if incumbent is not None and incumbent is not reported:
+                nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, incumbent, sol_cnt,
+                                                 start_time)
+                stats.solution_costs.append(incumbent.cost_from_root)
+                output_f.write("Suboptimality bound not proven, the search was stopped.\n\n")
+            break
+
+        if incumbent is not None:
+            frontier = [entry[2] for entry in open_entries.values()] + list(inconsistent.values())
+            lower_bound = min([s.estimated_cost for s in frontier] + [incumbent.cost_from_root])
+            bound = incumbent.cost_from_root / lower_bound if lower_bound > 0 else 1
+            bound = min(bound, current_weight)
+            if incumbent is not reported:
+                nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, incumbent, sol_cnt,
+                                                 start_time)
+                if gr.observer is not None:
+                    gr.observer.on_solution(incumbent)
+                stats.solution_costs.append(incumbent.cost_from_root)
+                reported = incumbent
+                output_f.write(f"Weight {current_weight:g}: suboptimality bound {bound:.2f}.\n\n")
+            else:
+                output_f.write(f"Weight {current_weight:g}: no better solution, suboptimality bound {bound:.2f}.\n\n")
+
+        if (bound is not None and bound <= 1) or current_weight <= 1 or weight_step <= 0 \
+                or not (open_entries or inconsistent):
+            break
+
+        current_weight = max(1.0, current_weight - weight_step)
+        requeued = [entry[2] for entry in open_entries.values()] + list(inconsistent.values())
+        expanded_nodes = custom_heap.CustomHeap(requeued, key=priority)
+        if gr.observer is not None:
+            gr.observer.on_heap(expanded_nodes)
+        open_entries = {gr.state_key(entry[2].state): entry for entry in expanded_nodes.data}
+        inconsistent = {}
+        closed = set()
+
+    if incumbent is None and not stats.stopped:
+        output_f.write("All paths exhausted! No solution left.\n")
+    elif bound is not None and bound <= 1:
+        output_f.write("The last solution is optimal.\n")
+    print_transposition_stats(output_f, gr)
+    print_nogood_stats(output_f, gr)
+    print_observer_report(output_f, gr)
+    output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    return stats
+
+
+def ida_star(output_f, gr: Graph, nr_sol: int = 1, timeout=0,
+             budget: Optional[SearchBudget] = None) -> SearchStats:
+    output_f.write("\n\n############################################################################\n\n")
+    output_f.write("Started algorithm IDA*\n")
+    start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
+    stats = SearchStats()
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
+    # the first iterations can't find a solution shorter than the lower bound of the pre-analysis
+    limit = max(gr.root.estimated_cost, gr.lower_bound)
+    gr.start_search()
+    observer = gr.observer
+    stopped = False
+
+    def road_node() -> node.Node:
+        # the node of the cursor's state, built by replaying the moves of the road
+        current = gr.root
+        for road_i, road_j, _, _ in road:
+            current = node.Node(gr, current, road_i, road_j)
+        return current
 
+    def successor_moves(state):
+        # popped from the end, so reversed to visit them in the usual order
+        moves = gr.legal_moves(state)
+        moves.reverse()
+        return moves
 
-def ida_star(output_f, gr: Graph, nr_sol: int = 1, timeout=0):
-    def construct_road(target_node: node.Node) -> int:
-        nonlocal start_time, nr_successors, max_in_mem, sol_cnt, nr_sol, flag, limit, output_f, gr
+    while not stopped:
+        # the cursor walks the tree, `road` holds the moves (and what they overwrote) from the root to it
+        cursor = StateCursor(gr)
+        road = []
+        on_road = {cursor.state_hash: gr.state_key(cursor.state)}
+        road_depth = {cursor.state_hash: 0}
+        frames = [successor_moves(cursor.state)]
+        # for every frame, like a low-link: LIVE once its subtree may reach the final state (a final node, a node
+        # cut by the limit or a duplicate), else the lowest depth its cycles go back to. A node whose cycles
+        # only go back to itself or below is a dead end once its frame is done.
+        low_links = [LIVE if gr.test_final(cursor) else INFINITY]
+        stats.nodes_expanded += 1
+        if observer is not None:
+            observer.on_expand(cursor)
+        next_limit = None
 
-        if flag:
-            if round(time() - start_time) >= timeout:
-                output_f.write("Solution stopped due to timeout\n")
-                return -1
+        if gr.test_final(cursor) and gr.root.estimated_cost == limit:
+            nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, gr.root, sol_cnt, start_time)
+            if gr.observer is not None:
+                gr.observer.on_solution(gr.root)
+            stats.solution_costs.append(0)
+            break
+
+        while frames:
+            if budget.exhausted(len(road) + 1):
+                print_budget_stop(output_f, budget, road_node(), cursor.cost_from_root + gr.heuristic(cursor))
+                stats.stopped = stopped = True
+                break
+
+            moves = frames[-1]
+            if not moves:
+                frames.pop()
+                low_link = low_links.pop()
+                if low_link >= len(road):
+                    gr.learn_dead_end(cursor, False, False)
+                elif low_links and low_link < low_links[-1]:
+                    low_links[-1] = low_link
+                if road:
+                    i, j, previous, snapshot = road.pop()
+                    if on_road.get(cursor.state_hash) is snapshot:
+                        del on_road[cursor.state_hash]
+                        del road_depth[cursor.state_hash]
+                    cursor.undo(i, j, previous)
+                continue
+
+            i, j = moves.pop()
+            previous = cursor.apply(i, j)
+            if observer is not None:
+                observer.on_generate(cursor)
+            duplicate = gr.transposition_table.prune(cursor) if gr.use_transposition_table else None
+            pruned = duplicate and instrumentation.PRUNE_DUPLICATE
+            if pruned:
+                low_links[-1] = LIVE
+            elif duplicate is None:
+                snapshot = on_road.get(cursor.state_hash)
+                pruned = snapshot is not None and snapshot == gr.state_key(cursor.state) and instrumentation.PRUNE_CYCLE
+                if pruned:
+                    low_links[-1] = min(low_links[-1], road_depth[cursor.state_hash])
+            pruned = pruned or gr.unreachable_reason(cursor)
+            if pruned:
+                if observer is not None:
+                    observer.on_prune(cursor, pruned)
+                cursor.undo(i, j, previous)
+                continue
+
+            nr_successors += 1
+            estimated_cost = cursor.cost_from_root + gr.heuristic(cursor)
+            if estimated_cost > limit:
+                if next_limit is None or estimated_cost < next_limit:
+                    next_limit = estimated_cost
+                if estimated_cost < INFINITY:
+                    low_links[-1] = LIVE
+                cursor.undo(i, j, previous)
+                continue
+
+            if gr.test_final(cursor) and estimated_cost == limit:
+                solution = node.Node(gr, road_node(), i, j)
+                nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, solution, sol_cnt, start_time)
+                if gr.observer is not None:
+                    gr.observer.on_solution(solution)
+                stats.solution_costs.append(solution.cost_from_root)
+                if nr_sol == 0:
+                    stopped = True
+                    break
+
+            snapshot = gr.state_key(cursor.state)
+            if on_road.setdefault(cursor.state_hash, snapshot) is snapshot:
+                road_depth[cursor.state_hash] = len(road) + 1
+            road.append((i, j, previous, snapshot))
+            frames.append(successor_moves(cursor.state))
+            low_links.append(LIVE if gr.test_final(cursor) else INFINITY)
+            stats.nodes_expanded += 1
+            if observer is not None:
+                observer.on_expand(cursor)
+            max_in_mem = max(max_in_mem, len(road) + 1)
+
+        if stopped or next_limit is None:
+            break
+        limit = next_limit
+        gr.start_search(new_iteration=True)
+
+    if nr_sol != 0:
+        output_f.write("All paths exhausted! No solution left.\n")
+    print_transposition_stats(output_f, gr)
+    print_nogood_stats(output_f, gr)
+    print_observer_report(output_f, gr)
+    output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    stats.max_open = max_in_mem
+    return stats
 
-        if target_node.estimated_cost > limit:
-            return target_node.estimated_cost
 
-        if gr.test_final(target_node) and target_node.estimated_cost == limit:
-            nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, target_node, sol_cnt, start_time)
-            if nr_sol == 0 or target_node == gr.root:
-                return 0
+def rbfs(output_f, gr: Graph, nr_sol: int = 1, timeout=0,
+         budget: Optional[SearchBudget] = None) -> SearchStats:
+    output_f.write("\n\n############################################################################\n\n")
+    output_f.write("Started algorithm RBFS\n")
+    start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
+    stats = SearchStats()
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
+    gr.start_search(regenerates_nodes=True)
 
-        max_in_mem += 1
-        minim = -1
+    def open_frame(target_node: node.Node, backed_up_cost: int, cost_limit: int) -> list:
+        nonlocal nr_successors
         successors = gr.generate_successors(target_node)
         nr_successors += len(successors)
-        for s in successors:
-            s_rez = construct_road(s)
-            if s_rez == 0:
-                return 0
-            if minim == -1 or s_rez < minim:
-                minim = s_rez
+        stats.nodes_expanded += 1
+        # [backed up estimated cost, generation order, node], sorted to find the best successor
+        children = [[max(s.estimated_cost, backed_up_cost), order, s] for order, s in enumerate(successors)]
+        return [children, cost_limit, None]
+
+    if gr.test_final(gr.root):
+        nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, gr.root, sol_cnt, start_time)
+        if gr.observer is not None:
+            gr.observer.on_solution(gr.root)
+        stats.solution_costs.append(0)
+        frames = []
+    else:
+        frames = [open_frame(gr.root, gr.root.estimated_cost, INFINITY)]
+    in_mem = 1 + sum(len(frame[0]) for frame in frames)
+
+    # every frame: [children, cost limit, child being explored]
+    while frames:
+        if budget.exhausted(in_mem):
+            children = frames[-1][0]
+            best_child = min(children) if children else [None, 0, None]
+            print_budget_stop(output_f, budget, best_child[2], best_child[0])
+            stats.stopped = True
+            break
+
+        children, cost_limit, _ = frames[-1]
+        children.sort()
+        if not children or children[0][0] > cost_limit or children[0][0] >= INFINITY:
+            frames.pop()
+            in_mem -= len(children)
+            if frames:
+                frames[-1][2][0] = children[0][0] if children else INFINITY
+            continue
+
+        best = children[0]
+        alternative = children[1][0] if len(children) > 1 else INFINITY
+        best_node = best[2]
+        if gr.test_final(best_node):
+            nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, best_node, sol_cnt, start_time)
+            if gr.observer is not None:
+                gr.observer.on_solution(best_node)
+            stats.solution_costs.append(best_node.cost_from_root)
+            if nr_sol == 0:
+                break
+            best[0] = INFINITY
+            continue
+
+        frames[-1][2] = best
+        frames.append(open_frame(best_node, best[0], min(cost_limit, alternative)))
+        in_mem += len(frames[-1][0])
+        max_in_mem = max(max_in_mem, in_mem)
+
+    if nr_sol != 0:
+        output_f.write("All paths exhausted! No solution left.\n")
+    print_observer_report(output_f, gr)
+    output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    stats.max_open = max_in_mem
+    return stats
 
-        return minim
 
+class _SMAEntry:
+    """
+        A node kept in memory by SMA*, `children` is None for leaves
+    """
+    __slots__ = ('node', 'estimated_cost', 'parent', 'children', 'heap_entry')
+
+    def __init__(self, target_node: node.Node, estimated_cost: int, parent: Optional["_SMAEntry"]):
+        self.node = target_node
+        self.estimated_cost = estimated_cost
+        self.parent = parent
+        self.children = None
+        self.heap_entry = None
+
+
+def sma_star(output_f, gr: Graph, nr_sol: int = 1, timeout=0, max_nodes: int = SMA_MAX_NODES,
+             budget: Optional[SearchBudget] = None) -> SearchStats:
+    """
+        Simplified memory-bounded A*: expands like A* until `max_nodes` nodes are in memory, then forgets
+        the worst fully expanded subtrees (a node whose children are all leaves), backing up the best
+        forgotten estimation in the node so it is regenerated only when it becomes promising again.
+    """
     output_f.write("\n\n############################################################################\n\n")
-    output_f.write("Started algorithm IDA*\n")
+    output_f.write(f"Started algorithm SMA* (at most {max_nodes} nodes in memory)\n")
     start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
-    flag = False if timeout == 0 else True
-    limit = gr.root.estimated_cost
+    stats = SearchStats()
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
+    gr.start_search(regenerates_nodes=True)
 
-    while True:
-        rez = construct_road(gr.root)
-        if rez == 0:
+    expanded_nodes = custom_heap.CustomHeap(key=lambda x: (x.estimated_cost, -x.node.cost_from_root))
+    if gr.observer is not None:
+        gr.observer.on_heap(expanded_nodes)
+    root = _SMAEntry(gr.root, gr.root.estimated_cost, None)
+    root.heap_entry = expanded_nodes.push(root)
+    # expanded entries whose children are all leaves, the only ones that can be forgotten
+    collapsible = set()
+    in_mem = 1
+
+    def back_up(entry: Optional["_SMAEntry"]) -> None:
+        while entry is not None and entry.children:
+            best_child = min(child.estimated_cost for child in entry.children)
+            if best_child <= entry.estimated_cost:
+                return
+            entry.estimated_cost = best_child
+            entry = entry.parent
+
+    def forget(entry: _SMAEntry) -> None:
+        nonlocal in_mem
+        for child in entry.children:
+            if child.heap_entry is not None:
+                expanded_nodes.remove(child.heap_entry)
+        in_mem -= len(entry.children)
+        entry.estimated_cost = max(entry.estimated_cost, min(child.estimated_cost for child in entry.children))
+        entry.children = None
+        entry.heap_entry = expanded_nodes.push(entry)
+        collapsible.discard(entry)
+        parent = entry.parent
+        if parent is not None and all(child.children is None for child in parent.children):
+            collapsible.add(parent)
+
+    while len(expanded_nodes) > 0:
+        best = expanded_nodes.pop()
+        best.heap_entry = None
+
+        if budget.exhausted(in_mem):
+            print_budget_stop(output_f, budget, best.node, best.estimated_cost)
+            stats.stopped = True
+            break
+
+        if best.estimated_cost >= INFINITY:
             break
-        if rez == -1:
-            return
 
-        limit = rez
+        if gr.test_final(best.node):
+            nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, best.node, sol_cnt, start_time)
+            if gr.observer is not None:
+                gr.observer.on_solution(best.node)
+            stats.solution_costs.append(best.node.cost_from_root)
+            if nr_sol == 0 or best is root:
+                break
+            best.estimated_cost = INFINITY
+            back_up(best.parent)
+            continue
+
+        successors = gr.generate_successors(best.node)
+        nr_successors += len(successors)
+        stats.nodes_expanded += 1
+        if not successors:
+            best.estimated_cost = INFINITY
+            back_up(best.parent)
+            continue
+
+        best.children = []
+        for s in successors:
+            estimated_cost = max(best.estimated_cost, s.estimated_cost)
+            if s.cost_from_root >= max_nodes - 1 and not gr.test_final(s):
+                estimated_cost = INFINITY
+            child = _SMAEntry(s, estimated_cost, best)
+            child.heap_entry = expanded_nodes.push(child)
+            best.children.append(child)
+        in_mem += len(successors)
+        max_in_mem = max(max_in_mem, in_mem)
+        stats.max_open = max(stats.max_open, len(expanded_nodes))
+        stats.max_closed = max(stats.max_closed, in_mem - len(expanded_nodes))
+        collapsible.add(best)
+        collapsible.discard(best.parent)
+        back_up(best)
+
+        while in_mem > max_nodes:
+            candidates = [entry for entry in collapsible if entry is not best]
+            if not candidates:
+                break
+            forget(max(candidates, key=lambda x: (x.estimated_cost, -x.node.cost_from_root)))
+
+        if in_mem > max_nodes:
+            output_f.write("Memory bound too small to hold the current path\n")
+            stats.stopped = True
+            break
 
     if nr_sol != 0:
         output_f.write("All paths exhausted! No solution left.\n")
+    print_observer_report(output_f, gr)
+    output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    return stats
+
+
+def bidirectional(output_f, gr: Graph, nr_sol: int = 1, timeout=0,
+                  budget: Optional[SearchBudget] = None) -> SearchStats:
+    """
+        Bidirectional breadth-first search: the forward frontier holds states reached from the initial state,
+        the backward one partial states regressed from final_state (see `regression`). The frontier with
+        fewer states is grown by a whole layer at a time. Every new state is looked up among the states of
+        the other direction having the same constrained containers; once they meet the layer is finished
+        and the meeting with the lowest cost gives one optimal solution, verified by replaying the backward moves.
+    """
+    output_f.write("\n\n############################################################################\n\n")
+    output_f.write("Started algorithm bidirectional search\n")
+    start_time, nr_successors, max_in_mem, sol_cnt = time(), 0, 1, 0
+    stats = SearchStats()
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
+    gr.start_search()
+    regressor = regression.Regression(gr)
+
+    forward_seen = {gr.state_key(gr.root.state): gr.root}
+    # backward_seen[partial] = (depth, next partial towards final_state, move from partial to it)
+    backward_seen = {}
+    # the states of both directions indexed by the constrained containers of the partial states
+    forward_index = {}
+    backward_index = {}
+    best = None
+
+    def meet(target_node: node.Node, partial) -> None:
+        nonlocal best
+        cost = target_node.cost_from_root + backward_seen[partial][0]
+        if best is None or cost < best[0]:
+            best = (cost, target_node, partial)
+
+    def add_forward(target_node: node.Node) -> None:
+        for group, partials in backward_index.items():
+            key = regression.project(target_node.state, group)
+            forward_index[group].setdefault(key, target_node)
+            partial = partials.get(key)
+            if partial is not None:
+                meet(target_node, partial)
+
+    def add_backward(partial, depth: int, successor) -> None:
+        backward_seen[partial] = (depth,) + successor
+        group = regression.group_of(partial)
+        if group not in backward_index:
+            backward_index[group] = {}
+            group_nodes = forward_index[group] = {}
+            for forward_node in forward_seen.values():
+                group_nodes.setdefault(regression.project(forward_node.state, group), forward_node)
+        key = regression.constraints_of(partial)
+        backward_index[group][key] = partial
+        forward_node = forward_index[group].get(key)
+        if forward_node is not None:
+            meet(forward_node, partial)
+
+    forward_layer = [gr.root]
+    backward_layer = []
+    if gr.test_final(gr.root):
+        best = (0, gr.root, None)
+    else:
+        for partial in regressor.goal_partials(gr.final_state):
+            add_backward(partial, 0, (None, None))
+            backward_layer.append(partial)
+
+    while best is None and forward_layer and backward_layer and not stats.stopped:
+        next_layer = []
+        if len(forward_layer) <= len(backward_layer):
+            for selected_node in forward_layer:
+                if budget.exhausted(len(forward_seen) + len(backward_seen)):
+                    stats.stopped = True
+                    break
+                stats.nodes_expanded += 1
+                for s in gr.generate_successors(selected_node):
+                    nr_successors += 1
+                    state_key = gr.state_key(s.state)
+                    if state_key not in forward_seen:
+                        forward_seen[state_key] = s
+                        next_layer.append(s)
+                        add_forward(s)
+            forward_layer = next_layer
+        else:
+            for partial in backward_layer:
+                if budget.exhausted(len(forward_seen) + len(backward_seen)):
+                    stats.stopped = True
+                    break
+                stats.nodes_expanded += 1
+                depth = backward_seen[partial][0] + 1
+                for predecessor, i, j in regressor.predecessors(partial):
+                    nr_successors += 1
+                    if predecessor not in backward_seen:
+                        add_backward(predecessor, depth, (partial, (i, j)))
+                        next_layer.append(predecessor)
+            backward_layer = next_layer
+        max_in_mem = max(max_in_mem, len(forward_seen) + len(backward_seen))
+        stats.max_open = max(stats.max_open, len(forward_layer) + len(backward_layer))
+
+    if stats.stopped:
+        print_budget_stop(output_f, budget)
+    elif best is not None:
+        _, solution, partial = best
+        forward_depth = solution.cost_from_root
+        while partial is not None:
+            _, partial, move = backward_seen[partial]
+            if move is not None:
+                solution = node.Node(gr, solution, *move)
+        if gr.test_final(solution):
+            nr_sol, sol_cnt = print_solution(output_f, max_in_mem, nr_sol, nr_successors, solution, sol_cnt,
+                                             start_time)
+            if gr.observer is not None:
+                gr.observer.on_solution(solution)
+            stats.solution_costs.append(solution.cost_from_root)
+            output_f.write(f"Met at forward depth {forward_depth}, "
+                           f"backward depth {solution.cost_from_root - forward_depth}.\n")
+        else:
+            output_f.write("The replayed backward moves don't reach the final state, no solution found\n")
+            stats.stopped = True
+    else:
+        output_f.write("All paths exhausted! No solution left.\n")
+    output_f.write(f"Forward frontier: {len(forward_layer)} states ({len(forward_seen)} reached), "
+                   f"backward frontier: {len(backward_layer)} partial states ({len(backward_seen)} reached).\n")
+    print_observer_report(output_f, gr)
     output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
-    output_f.write("\n\n###############################################\n\n")
+    output_f.write(ALGORITHM_SEPARATOR)
+
+    stats.nodes_generated = nr_successors
+    stats.max_closed = max_in_mem
+    return stats
+
+
+def hda_star(output_f, gr: Graph, nr_sol: int = 1, timeout=0, budget: Optional[SearchBudget] = None,
+             workers: int = hda.HDA_WORKERS) -> SearchStats:
+    """
+        Hash-distributed A* with `workers` worker processes, see `hda`. Only the optimal solution is printed
+        (`nr_sol` is ignored), followed by the work of every worker and the successors they exchanged.
+        A parallel batch (-j) runs the workers in its own processes, which can't start others: the search
+        then runs with one worker.
+    """
+    workers = hda.available_workers(workers)
+    output_f.write("\n\n############################################################################\n\n")
+    output_f.write(f"Started algorithm HDA* ({workers} worker{'s' if workers != 1 else ''})\n")
+    start_time, sol_cnt = time(), 0
+    stats = SearchStats()
+    budget = (SearchBudget(timeout) if budget is None else budget).start()
+
+    result = hda.search(gr, workers, budget)
+    stats.stopped = result.stopped
+    stats.nodes_expanded = sum(worker.expanded for worker in result.workers)
+    stats.nodes_generated = sum(worker.generated for worker in result.workers)
+    stats.max_open = sum(worker.max_open for worker in result.workers)
+
+    if result.stopped:
+        output_f.write(budget.stop_message())
+    if result.cost is not None:
+        solution = gr.root
+        for container_from_idx, container_to_idx in result.moves:
+            solution = node.Node(gr, solution, container_from_idx, container_to_idx)
+        nr_sol, sol_cnt = print_solution(output_f, stats.max_open, nr_sol, stats.nodes_generated, solution, sol_cnt,
+                                         start_time)
+        if gr.observer is not None:
+            gr.observer.on_solution(solution)
+        stats.solution_costs.append(solution.cost_from_root)
+        if result.stopped:
+            output_f.write("Optimality not proven, the search was stopped.\n\n")
+    elif not result.stopped:
+        output_f.write("All paths exhausted! No solution left.\n")
+
+    for worker in result.workers:
+        output_f.write(f"Worker {worker.worker_id}: expanded {worker.expanded} nodes, generated {worker.generated}, "
+                       f"with a maximum of {worker.max_open} open nodes.\n")
+    if stats.nodes_expanded:
+        mean = stats.nodes_expanded / len(result.workers)
+        output_f.write(f"Load balance: the busiest worker expanded "
+                       f"{max(worker.expanded for worker in result.workers) / mean:.2f} times the mean.\n")
+    stats.nodes_sent = sum(worker.remote for worker in result.workers)
+    stats.batches_sent = sum(worker.batches for worker in result.workers)
+    queued = stats.nodes_sent + sum(worker.local for worker in result.workers)
+    output_f.write(f"Communication: {stats.nodes_sent} of {queued} queued successors sent to other workers "
+                   f"({100 * stats.nodes_sent / queued if queued else 0:.1f}%), in {stats.batches_sent} batches.\n")
+    print_observer_report(output_f, gr)
+    output_f.write(f"Finished in {ceil(time() - start_time)} seconds.")
+    output_f.write(ALGORITHM_SEPARATOR)
+    return stats
+
+
+ALGORITHMS = {
+    'ucs': ucs,
+    'a_star': a_star,
+    'a_star_opt': a_star_opt,
+    'weighted_a_star': weighted_a_star,
+    'ara_star': ara_star,
+    'ida_star': ida_star,
+    'rbfs': rbfs,
+    'sma_star': sma_star,
+    'bidirectional': bidirectional,
+    'hda_star': hda_star,
+}
+
+# the command line options passed to an algorithm
+ALGORITHM_OPTIONS = {
+    'ucs': ('open_list',),
+    'a_star': ('open_list',),
+    'a_star_opt': ('open_list',),
+    'sma_star': ('max_nodes',),
+    'weighted_a_star': ('weight',),
+    'ara_star': ('weight', 'weight_step'),
+    'hda_star': ('workers',),
+}
+
+
+def create_color_srv(rules: List[Tuple[str, str, str]]) -> color.ColorSrv:
+    color_srv = color.ColorSrv()
+    for color_l, color_r, color_f in rules:
+        code_l = color_srv.add_color(color_l)
+        code_r = color_srv.add_color(color_r)
+        code_f = color_srv.add_color(color_f)
+        color_srv.add_combination(code_l, code_r, code_f)
+    return color_srv
+
+
+def read_input(input_path: str, n_sol: int, transposition_table: Optional[TranspositionTable] = None,
+               symmetry_reduction: bool = False) -> Graph:
+    """
+        Builds the graph of the first instance of a text or binary instance file
+    """
+    return build_graph(load_instance(input_path), n_sol, transposition_table, symmetry_reduction)
+
+
+def parse_input(f_in, n_sol: int, transposition_table: Optional[TranspositionTable] = None,
+                symmetry_reduction: bool = False,
+                color_srv_factory: Callable[[List[Tuple[str, str, str]]], color.ColorSrv] = create_color_srv) -> Graph:
+    """
+        Parses the first instance of a text file object
+    """
+    return build_graph(next(read_instances(f_in)), n_sol, transposition_table, symmetry_reduction, color_srv_factory)
+
+
+def build_graph(instance: Instance, n_sol: int, transposition_table: Optional[TranspositionTable] = None,
+                symmetry_reduction: bool = False,
+                color_srv_factory: Callable[[List[Tuple[str, str, str]]], color.ColorSrv] = create_color_srv) -> Graph:
+    """
+        The color service of the graph is built from the rules by `color_srv_factory`, the colors of the
+        containers are added to it, so every color keeps the code it has in the instance
+    """
+    color_srv = color_srv_factory(instance.named_rules())
+    init_state = [Container(max_cap, occupied, color_srv.add_color(instance.color_name(code)) if occupied != 0 else 0)
+                  for max_cap, occupied, code in zip(instance.capacities, instance.occupied, instance.codes)]
+    final_state = [Container(0, occupied, color_srv.get_code(instance.color_name(code)))
+                   for occupied, code in zip(instance.final_occupied, instance.final_codes)]
+    return Graph(final_state, init_state, n_sol, color_srv=color_srv, transposition_table=transposition_table,
+                 symmetry_reduction=symmetry_reduction)
+
+
+def create_nogood_cache(nogood_size: int) -> Optional[NogoodCache]:
+    if nogood_size <= 0:
+        return None
+    return NogoodCache(nogood_size)
+
+
+def create_transposition_table(tt_size: int, tt_policy: str) -> Optional[TranspositionTable]:
+    if tt_size <= 0:
+        return None
+    return TranspositionTable(tt_size, tt_policy)
+
+
+def algorithm_options(algorithm: str, args) -> dict:
+    """
+        Extra keyword arguments of an algorithm, taken from the command line
+    """
+    options = {name: args[name] for name in ALGORITHM_OPTIONS.get(algorithm, ())}
+    if algorithm in ('ucs', 'a_star') and args['frontier_dir']:
+        options.update(frontier_dir=args['frontier_dir'], frontier_memory_mb=args['frontier_memory_mb'])
+    return options
+
+
+def moves_log_path(output_dir: str, input_file: str) -> str:
+    return os.path.join(output_dir, "moves_" + os.path.splitext(input_file)[0] + ".jsonl")
+
+
+def prepare_graph(instance: Instance, args) -> Graph:
+    """
+        Builds the graph of an instance with the options from the command line
+    """
+    gr = build_graph(instance, args['nsol'], create_transposition_table(args['tt_size'], args['tt_policy']),
+                     args['symmetry'])
+    gr.nogoods = create_nogood_cache(args['nogood_size'])
+    gr.observer = instrumentation.create_observer(args['instrument'])
+    gr.pdb_dir, gr.pdb_max_bits, gr.pdb_max_seconds = args['pdb_dir'], args['pdb_max_bits'], args['pdb_max_seconds']
+    if args['moves_jsonl']:
+        gr.moves_log = MovesLog(moves_log_path(args['output'], instance.name))
+    return gr
+
+
+def analyze_graph(gr: Graph, args) -> Optional[Analysis]:
+    """
+        Runs the pre-analysis of an instance, its lower bound is used by the searches run on `gr`
+    :return: the analysis, None if disabled from the command line
+    """
+    if args['no_analysis']:
+        return None
+    result = analyze(gr)
+    gr.lower_bound = result.lower_bound
+    return result
+
+
+def cache_options(algorithm: str, args) -> dict:
+    """
+        The options changing the output of a finished run, part of its cache key
+    """
+    options = algorithm_options(algorithm, args)
+    if 'frontier_dir' in options:
+        options['frontier_dir'] = True
+    options.update(tt_size=args['tt_size'], tt_policy=args['tt_policy'], nogood_size=args['nogood_size'],
+                   symmetry=args['symmetry'], analysis=not args['no_analysis'],
+                   pdb_max_bits=args['pdb_max_bits'], pdb_max_seconds=args['pdb_max_seconds'])
+    return options
+
+
+def run(output_f, gr: Graph, algorithm: str, h_code: Optional[int], args, timeout: float) -> SearchStats:
+    """
+        Runs one algorithm, or writes its cached output. Runs stopped by a limit and instrumented runs
+        (whose reports hold timings) aren't cached.
+    """
+    if gr.moves_log is not None:
+        gr.moves_log.start_run(algorithm, h_code)
+
+    cache, key = None, None
+    if not args['no_cache'] and gr.observer is None:
+        cache = SolutionCache(args['cache_dir'], args['cache_max_mb'] << 20, args['refresh'])
+        key = instance_key(gr, algorithm, h_code, args['nsol'], cache_options(algorithm, args))
+        entry = cache.get(key)
+        if entry is not None:
+            return cache.render(output_f, gr, entry)
+        output_f = gr.solution_recorder = SolutionRecorder(output_f, gr)
+
+    budget = SearchBudget(timeout, args['max_expansions'], args['max_in_memory'], args['max_rss_mb'] * 1024)
+    try:
+        stats = ALGORITHMS[algorithm](output_f, gr, args['nsol'], timeout, budget=budget,
+                                      **algorithm_options(algorithm, args))
+    finally:
+        gr.solution_recorder = None
+    if cache is not None and not stats.stopped:
+        cache.put(key, output_f.entry(stats))
+    return stats
+
+
+def run_algorithm(output_f, instance: Instance, algorithm: str, h_code: Optional[int], args, timeout: float,
+                  lower_bound: int = 0):
+    """
+        Solves one instance with one algorithm (and heuristic), the unit of work of a parallel batch.
+        `lower_bound` is the one found by the pre-analysis of the instance.
+    """
+    gr = prepare_graph(instance, args)
+    gr.lower_bound = lower_bound
+    if gr.moves_log is not None:
+        # the parent writes the records of every task, in order
+        gr.moves_log = MovesLog(sink=output_f.send_record)
+    if h_code is not None:
+        gr.set_heuristic(h_code)
+    run(output_f, gr, algorithm, h_code, args, timeout)
+
+
+def clear_moves_logs(instance_names, args):
+    if args['moves_jsonl']:
+        for instance_name in instance_names:
+            open(moves_log_path(args['output'], instance_name), 'w').close()
+
+
+def iter_instances(input_files, args):
+    """
+        The instances of the input files, parsed while they are solved
+    """
+    for numeFisier in input_files:
+        yield from load_instances(os.path.join(args['input'], numeFisier))
+
+
+def solve_sequential(input_files, args):
+    for instance in iter_instances(input_files, args):
+        print("Input:", instance.name)
+        clear_moves_logs([instance.name], args)
+        graph = prepare_graph(instance, args)
+
+        with open(os.path.join(args['output'], "output_" + instance.name), "w") as f_out:
+            analysis = analyze_graph(graph, args)
+            if analysis is not None:
+                f_out.write(analysis.report())
+                if not analysis.feasible:
+                    continue
+
+            run(f_out, graph, 'ucs', None, args, args['timeout'])
+
+            for h_code in HEURISTIC_DESCRIPTIONS:
+                output = graph.set_heuristic(h_code)
+                f_out.write(output)
+                for algorithm in args['algorithms']:
+                    run(f_out, graph, algorithm, h_code, args, args['timeout'])
+                f_out.write(HEURISTIC_SEPARATOR)
+
+
+def solve_parallel(input_files, args):
+    """
+        Spreads every (instance, algorithm, heuristic) task over `--jobs` processes. The timeout is enforced
+        by the pool, the outputs and the moves logs are merged in the same order as the sequential run.
+    """
+    instances = list(iter_instances(input_files, args))
+    # the pre-analysis is cheap, it's done here to skip the tasks of the unsolvable instances
+    analyses = [analyze_graph(build_graph(instance, args['nsol']), args) for instance in instances]
+    tasks = []
+    for instance, analysis in zip(instances, analyses):
+        if analysis is not None and not analysis.feasible:
+            continue
+        lower_bound = 0 if analysis is None else analysis.lower_bound
+        tasks.append((run_algorithm, (instance, 'ucs', None, args, 0, lower_bound)))
+        for h_code in HEURISTIC_DESCRIPTIONS:
+            for algorithm in args['algorithms']:
+                tasks.append((run_algorithm, (instance, algorithm, h_code, args, 0, lower_bound)))
+
+    outputs = iter(batch.run_batch(tasks, args['jobs'], args['timeout'],
+                                   timeout_message=batch.TIMEOUT_MESSAGE + ALGORITHM_SEPARATOR))
+
+    for instance, analysis in zip(instances, analyses):
+        print("Input:", instance.name)
+        records = []
+        with open(os.path.join(args['output'], "output_" + instance.name), "w") as f_out:
+            if analysis is not None:
+                f_out.write(analysis.report())
+            if analysis is None or analysis.feasible:
+                task_output = next(outputs)
+                f_out.write(task_output.text)
+                records += task_output.records
+                for h_code in HEURISTIC_DESCRIPTIONS:
+                    f_out.write(HEURISTIC_DESCRIPTIONS[h_code])
+                    for _ in args['algorithms']:
+                        task_output = next(outputs)
+                        f_out.write(task_output.text)
+                        records += task_output.records
+                    f_out.write(HEURISTIC_SEPARATOR)
+        if args['moves_jsonl']:
+            write_records(moves_log_path(args['output'], instance.name), records)
 
 
 if __name__ == "__main__":
-    n_sol = args['nsol']
-    timeout_arg = args['timeout']
-
-    colorSrv = color.ColorSrv()
-    for numeFisier in os.listdir(args['input']):
-        print("Input:", numeFisier)
-        f_in = open(args['input'] + '/' + numeFisier)
-        f_out = open(args['output'] + '/' + "output_" + numeFisier, "w")
-        line = f_in.readline()
-        while line.strip() != INIT_STATE_LINE_SEPARATOR:
-            color_l, color_r, color_f = line.split()
-            code_l = colorSrv.add_color(color_l)
-            code_r = colorSrv.add_color(color_r)
-            code_f = colorSrv.add_color(color_f)
-            colorSrv.add_combination(code_l, code_r, code_f)
-            line = f_in.readline()
-
-        init_state = []
-        line = f_in.readline()
-        while line.strip() != FINAL_STATE_LINE_SEPARATOR:
-            container_values = line.split()
-            max_cap = int(container_values[0])
-            occupied = int(container_values[1])
-            code = 0
-            if occupied != 0:
-                color = container_values[2]
-                code = colorSrv.add_color(color)
-            init_state.append(Container(max_cap, occupied, code))
-            line = f_in.readline()
-
-        final_state = []
-        line = f_in.readline()
-        while line:
-            container_values = line.split()
-            cap = int(container_values[0])
-            color = container_values[1]
-            code = colorSrv.get_code(color)
-            final_state.append(Container(0, cap, code))
-            line = f_in.readline()
-
-        graph = Graph(final_state, init_state, n_sol)
-
-        ucs(f_out, graph, n_sol, timeout_arg)
-
-        for h_code in range(4):
-            output = graph.set_heuristic(h_code)
-            f_out.write(output)
-            a_star(f_out, graph, n_sol, timeout_arg)
-            a_star_opt(f_out, graph, n_sol, timeout_arg)
-            ida_star(f_out, graph, n_sol, timeout_arg)
-            f_out.write("\n\n#####################################################################################\n\n")
-
-        colorSrv.reset()
-        f_in.close()
-        f_out.close()
+    args = vars(parser.parse_args())
+    args['algorithms'] = args['algorithms'].split(',')
+    unknown_algorithms = [algorithm for algorithm in args['algorithms'] if algorithm not in ALGORITHMS]
+    if unknown_algorithms:
+        parser.error(f"unknown algorithms: {', '.join(unknown_algorithms)}")
+    args['instrument'] = tuple(name for name in args['instrument'].split(',') if name)
+    unknown_collectors = [name for name in args['instrument'] if name not in instrumentation.COLLECTORS]
+    if unknown_collectors:
+        parser.error(f"unknown collectors: {', '.join(unknown_collectors)}")
+    input_files = sorted(os.listdir(args['input']))
+
+    if args['jobs'] > 1:
+        solve_parallel(input_files, args)
+    else:
+        solve_sequential(input_files, args)
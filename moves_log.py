@@ -0,0 +1,56 @@
+"""
+    Machine-readable solutions: one JSON object per printed solution, with the moves as [from, to] pairs,
+    written next to the human-readable output or kept in memory
+"""
+
+import json
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+def format_record(record: Dict) -> str:
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def write_records(path: str, records: Iterable[Dict]) -> None:
+    """
+        Writes a JSON lines file holding `records`, in their order
+    """
+    with open(path, 'w') as f_out:
+        f_out.writelines(format_record(record) for record in records)
+
+
+class MovesLog:
+    """
+        Appends the solutions of a graph to a JSON lines file, the file is opened for every solution.
+        With a `sink` the records are passed to it instead: the tasks of a parallel run send them to
+        the parent process, which writes them in the order of the tasks. Without either the records
+        are kept in `records`.
+    """
+
+    def __init__(self, path: Optional[str] = None, sink: Optional[Callable[[Dict], None]] = None):
+        self.path = path
+        self.sink = sink
+        self.records: List[Dict] = []
+        self.algorithm: Optional[str] = None
+        self.heuristic: Optional[int] = None
+
+    def start_run(self, algorithm: str, heuristic: Optional[int]) -> None:
+        self.algorithm = algorithm
+        self.heuristic = heuristic
+
+    def write(self, target_node, solution_nr: int) -> None:
+        record = {
+            'algorithm': self.algorithm,
+            'heuristic': self.heuristic,
+            'solution': solution_nr,
+            'cost': target_node.cost_from_root,
+            'moves': [[road_node.container_from_idx, road_node.container_to_idx]
+                      for road_node in target_node.road()[1:]],
+        }
+        if self.sink is not None:
+            self.sink(record)
+        elif self.path is None:
+            self.records.append(record)
+        else:
+            with open(self.path, 'a') as f_out:
+                f_out.write(format_record(record))
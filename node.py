@@ -1,97 +1,141 @@
 from __future__ import annotations
 
-import copy
-import hashlib
-from dataclasses import dataclass, field
-from functools import cached_property
-from typing import List, Callable, Optional
-
-import color
-from container import Container
+from typing import Iterator, List, Optional
+
+from container import PackedState, HASH_MASK
 import graph
 
 
-@dataclass
 class Node:
-    graph: graph.Graph = field(repr=False)
-    parent: Optional[Node]
-    container_from_idx: int
-    container_to_idx: int
-    # h: Callable[[], int]
-    # state: List[Container] = field(init=False)
-    # state_hash: HASH = field(init=False)
-    cost_from_root: int = field(init=False)
-    # estimated_cost: int = field(init=False)
-
-    def __post_init__(self):
-        if self.parent is None:
+    """
+        A search node. The state is a packed tuple of (occupied, color) pairs,
+        the capacities are stored once on the graph.
+    """
+    __slots__ = ('graph', 'parent', 'container_from_idx', 'container_to_idx',
+                 'cost_from_root', 'state', 'state_hash', 'goal_counts', 'matched',
+                 '_estimated_cost', '_color_mask')
+
+    def __init__(self, graph: graph.Graph, parent: Optional[Node], container_from_idx: int, container_to_idx: int,
+                 state: Optional[PackedState] = None):
+        self.graph = graph
+        self.parent = parent
+        self.container_from_idx = container_from_idx
+        self.container_to_idx = container_to_idx
+        self._estimated_cost = None
+        self._color_mask = None
+
+        if parent is None:
             self.cost_from_root = 0
+            self.state = state
+            self.state_hash = graph.hash_state(state)
+            self.goal_counts, self.matched = graph.count_matches(state)
         else:
-            self.cost_from_root = self.parent.cost_from_root + 1
-
-    @cached_property
-    def state(self) -> List[Container]:
-        state_copy = copy.deepcopy(self.parent.state)
-        container_from = state_copy[self.container_from_idx]
-        container_to = state_copy[self.container_to_idx]
-
-        fill_to_capacity = container_to.max_cap - container_to.occupied
-        capacity_to_transfer = min(fill_to_capacity, container_from.occupied)
-        container_from.occupied -= capacity_to_transfer
-        container_to.occupied += capacity_to_transfer
-        container_to.color = color.ColorSrv().get_combination_result(container_from.color, container_to.color)
-        if container_from.occupied == 0:
-            container_from.color = 0
-
-        return state_copy
-
-    @cached_property
-    def state_hash(self) -> bytes:
-        s_hash = hashlib.sha256()
-        for index, container in enumerate(self.state):
-            s_hash.update(bytes(str(index), encoding='utf-8'))
-            s_hash.update(b'_')
-            s_hash.update(bytes(str(container.occupied), encoding='utf-8'))
-            s_hash.update(b'_')
-            s_hash.update(bytes(str(container.color), encoding='utf-8'))
-            s_hash.update(b'_')
-        return s_hash.digest()
-
-    @cached_property
+            self.cost_from_root = parent.cost_from_root + 1
+            self.state = graph.apply_move(parent.state, container_from_idx, container_to_idx)
+            self.state_hash = (parent.state_hash
+                               - graph.zobrist_key(container_from_idx, parent.state[container_from_idx])
+                               + graph.zobrist_key(container_from_idx, self.state[container_from_idx])
+                               - graph.zobrist_key(container_to_idx, parent.state[container_to_idx])
+                               + graph.zobrist_key(container_to_idx, self.state[container_to_idx])) & HASH_MASK
+            self.goal_counts, self.matched = graph.update_matches(parent, self.state,
+                                                                  container_from_idx, container_to_idx)
+
+    @classmethod
+    def successor(cls, parent: Node, container_from_idx: int, container_to_idx: int, state: PackedState,
+                  state_hash: int, color_mask: int) -> Node:
+        """
+            Builds the successor of `parent` whose state, hash and color mask were already computed
+            by `Graph.generate_successors`
+        """
+        self = cls.__new__(cls)
+        self.graph = graph = parent.graph
+        self.parent = parent
+        self.container_from_idx = container_from_idx
+        self.container_to_idx = container_to_idx
+        self._estimated_cost = None
+        self._color_mask = color_mask
+        self.cost_from_root = parent.cost_from_root + 1
+        self.state = state
+        self.state_hash = state_hash
+        self.goal_counts, self.matched = graph.update_matches(parent, state, container_from_idx, container_to_idx)
+        return self
+
+    def __repr__(self):
+        return f'Node(parent={self.parent!r}, container_from_idx={self.container_from_idx}, ' \
+               f'container_to_idx={self.container_to_idx}, cost_from_root={self.cost_from_root})'
+
+    @property
     def estimated_cost(self) -> int:
-        return self.cost_from_root + self.graph.heuristic(self)
+        if self._estimated_cost is None:
+            self._estimated_cost = self.cost_from_root + self.graph.heuristic(self)
+        return self._estimated_cost
+
+    @property
+    def color_mask(self) -> int:
+        """
+            Bit mask of the colors found in the containers (see `color.ColorTables`)
+        """
+        if self._color_mask is None:
+            self._color_mask = self.graph.color_tables.color_mask(code for _, code in self.state)
+        return self._color_mask
 
     def get_road(self) -> str:
-        ret_val = ''
-        if self.parent is not None:
-            ret_val += self.parent.get_road()
-
-            ret_val += f'Step {self.cost_from_root}: ' \
-                       f'Transferred from container {self.container_from_idx} ' \
-                       f'to container {self.container_to_idx}. ' \
-                       f'Got color `{color.ColorSrv().get_color(self.state[self.container_to_idx].color)}` ' \
-                       f'with quantity {self.state[self.container_to_idx].occupied}.\n\n'
-
-        for i, cont in enumerate(self.state):
-            ret_val += f'{i}: Capacity: {cont.max_cap}, Qty: {cont.occupied}, Color: {color.ColorSrv().get_color(cont.color)}\n'
-
-        ret_val += '\n'
-        return ret_val
+        return ''.join(self.iter_road())
+
+    def iter_road(self) -> Iterator[str]:
+        """
+            Yields the text of the path from the root to this node, one step at a time,
+            so it can be streamed to the output without building the whole string
+        """
+        names = self.graph.color_tables.names
+        capacities = self.graph.capacities
+        for road_node in self.road():
+            if road_node.parent is not None:
+                occupied_to, color_to = road_node.state[road_node.container_to_idx]
+                yield f'Step {road_node.cost_from_root}: ' \
+                      f'Transferred from container {road_node.container_from_idx} ' \
+                      f'to container {road_node.container_to_idx}. ' \
+                      f'Got color `{names[color_to]}` ' \
+                      f'with quantity {occupied_to}.\n\n'
+
+            yield ''.join(f'{i}: Capacity: {max_cap}, Qty: {occupied}, Color: {names[code]}\n'
+                          for i, (max_cap, (occupied, code)) in enumerate(zip(capacities, road_node.state))) + '\n'
+
+    def road(self) -> List[Node]:
+        """
+            The nodes from the root to this node
+        """
+        road = []
+        ancestor = self
+        while ancestor is not None:
+            road.append(ancestor)
+            ancestor = ancestor.parent
+        road.reverse()
+        return road
 
     def cycles_back(self) -> bool:
-        ancestor = self.parent
+        return self.parent is not None and self.parent.on_road(self.state_hash, self.state)
+
+    def on_road(self, state_hash: int, state: PackedState) -> bool:
+        """
+            Checks if this node or one of its ancestors holds `state` (with hash `state_hash`)
+        """
+        state_key = None
+        ancestor = self
         while ancestor is not None:
-            if self.state_hash == ancestor.state_hash:
-                if self.state == ancestor.state:
+            if state_hash == ancestor.state_hash:
+                if state_key is None:
+                    state_key = self.graph.state_key(state)
+                if state_key == self.graph.state_key(ancestor.state):
                     return True
             ancestor = ancestor.parent
         return False
 
-    @cached_property
+    @property
     def usable_qty(self) -> int:
         usable_qty = 0
-        for cont in self.state:
-            if cont.color != -1:
-                usable_qty += cont.occupied
+        for occupied, code in self.state:
+            if code != -1:
+                usable_qty += occupied
 
         return usable_qty
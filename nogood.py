@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from typing import Callable, List, Optional, Tuple
+
+from container import PackedState
+
+# (state hash, state key)
+Entry = Tuple[int, tuple]
+
+
+class NogoodCache:
+    """
+        Memory bounded set of dead ends: states proven unable to reach the final state. A dead end doesn't
+        depend on the search, so the cache is kept for the whole life of a graph and shared by the runs of
+        every algorithm and heuristic. A state is a dead end when every move from it leads to a state
+        pruned by the quantity or color checks, or to another dead end. States are compared by their
+        `Graph.state_key`, so with symmetry reduction a dead end covers every permutation of its containers.
+        Slots are indexed by state hash, a new dead end evicts the one in its slot.
+    """
+
+    def __init__(self, max_entries: int):
+        if max_entries <= 0:
+            raise ValueError('The dead end cache needs at least one entry')
+
+        self.max_entries = max_entries
+        self.slots: List[Optional[Entry]] = [None] * max_entries
+        self.size = 0
+        self.hits = 0
+        self.learned = 0
+        self.evictions = 0
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.learned = 0
+        self.evictions = 0
+
+    def contains(self, state_hash: int, state: PackedState, key_of: Callable[[PackedState], tuple]) -> bool:
+        """
+            Checks if a state is a known dead end in O(1), `key_of` is only called when the hash matches
+        """
+        entry = self.slots[state_hash % self.max_entries]
+        if entry is not None and entry[0] == state_hash and entry[1] == key_of(state):
+            self.hits += 1
+            return True
+        return False
+
+    def add(self, state_hash: int, state: PackedState, key_of: Callable[[PackedState], tuple]) -> None:
+        idx = state_hash % self.max_entries
+        entry = self.slots[idx]
+        if entry is None:
+            self.size += 1
+        elif entry[0] == state_hash:
+            return
+        else:
+            self.evictions += 1
+        self.slots[idx] = (state_hash, key_of(state))
+        self.learned += 1
@@ -0,0 +1,208 @@
+"""
+    Pattern database heuristic. A state is abstracted to the quantities of its containers, forgetting
+    their colors. A pour moves the same quantity whatever the colors are, so the abstract problem is the
+    water jug problem of the instance: reach quantities holding the quantities of the final state (each in
+    its own container) from the initial ones. Its distances, computed once by a backward breadth-first
+    search from every abstract goal, are admissible and consistent, and tell how far the quantities are from
+    the goal, which the color heuristics can't see. A database taking longer than `PDB_MAX_SECONDS` to build
+    is given up, like one that is too large.
+"""
+
+import hashlib
+import os
+import sys
+from array import array
+from collections import Counter, deque
+from functools import lru_cache
+from time import perf_counter
+from typing import Tuple, Optional
+
+from container import PackedState
+
+PDB_MAX_BITS = 22
+PDB_MAX_SECONDS = 2.0
+# quantity vectors visited between two checks of the build time
+TIME_CHECK_INTERVAL = 4096
+# databases kept in memory by a process
+PDB_CACHE_SIZE = 8
+# distance of the quantities from which the final ones can't be obtained
+UNREACHABLE = 0xFFFF
+FILE_MAGIC = b'PDB2'
+
+
+class PatternDatabase:
+    """
+        Distances of every quantity vector, stored in an array('H') indexed by the quantities
+        in mixed radix: container k contributes occupied * strides[k], with strides from the capacities
+    """
+
+    def __init__(self, strides: Tuple[int, ...], distances: array):
+        self.strides = strides
+        self.distances = distances
+
+    def lookup(self, state: PackedState) -> int:
+        """
+        Returns
+        -------
+            the number of moves needed to obtain the quantities of the final state from the quantities
+            of `state`, UNREACHABLE if they can't be obtained
+        """
+        index = 0
+        for stride, (occupied, _) in zip(self.strides, state):
+            index += occupied * stride
+        return self.distances[index]
+
+    @classmethod
+    def create(cls, capacities: Tuple[int, ...], initial: Tuple[int, ...], goal: Tuple[int, ...],
+               directory: Optional[str] = None, max_bits: int = PDB_MAX_BITS,
+               max_seconds: float = PDB_MAX_SECONDS) -> Optional['PatternDatabase']:
+        """
+            Builds the database of the capacities, initial and final quantities, or loads it from `directory`
+            if a previous run on the same quantities saved it there
+        :return: the database, None if it would have more than 2^max_bits entries or its build takes
+            more than `max_seconds`
+        """
+        strides = quantity_strides(capacities)
+        if strides[-1] * (capacities[-1] + 1) > 1 << max_bits:
+            return None
+        distances = cached_distances(capacities, initial, tuple(sorted(goal)), directory, max_seconds)
+        return None if distances is None else cls(strides, distances)
+
+
+def quantity_strides(capacities: Tuple[int, ...]) -> Tuple[int, ...]:
+    strides = []
+    stride = 1
+    for capacity in capacities:
+        strides.append(stride)
+        stride *= capacity + 1
+    return tuple(strides)
+
+
+@lru_cache(maxsize=PDB_CACHE_SIZE)
+def cached_distances(capacities: Tuple[int, ...], initial: Tuple[int, ...], goal: Tuple[int, ...],
+                     directory: Optional[str], max_seconds: float) -> Optional[array]:
+    """
+        The distances of the quantities, loaded from `directory` or built (and saved there). They are also kept
+        in memory, so the next graphs of the process sharing the quantities don't rebuild them (nor retry
+        a build that took too long).
+    """
+    size = quantity_strides(capacities)[-1] * (capacities[-1] + 1)
+    path = None
+    if directory:
+        path = os.path.join(directory, database_key(capacities, initial, goal) + '.pdb')
+        distances = load_distances(path, size)
+        if distances is not None:
+            return distances
+
+    distances = build_distances(capacities, initial, goal, perf_counter() + max_seconds)
+    if path is not None and distances is not None:
+        save_distances(path, distances)
+    return distances
+
+
+def holds_goal(quantities: Tuple[int, ...], goal: Counter) -> bool:
+    found = Counter(quantities)
+    return all(found[quantity] >= count for quantity, count in goal.items())
+
+
+def build_distances(capacities: Tuple[int, ...], initial: Tuple[int, ...], goal: Tuple[int, ...],
+                    deadline: float) -> Optional[array]:
+    """
+        Forward breadth-first search of the quantities reachable from the initial ones, then backward
+        breadth-first search from the reachable quantities holding the final ones. Only reachable
+        quantities are looked up: a pour changes them the same way in the abstract and the real problem.
+    :return: the distances, None if the searches are still running at `deadline` (a `perf_counter` time)
+    """
+    strides = quantity_strides(capacities)
+    nr_containers = len(capacities)
+    size = strides[-1] * (capacities[-1] + 1)
+    reached = bytearray(size)
+    start = sum(quantity * stride for quantity, stride in zip(initial, strides))
+    reached[start] = 1
+    reachable = [initial]
+    queue = deque([initial])
+    nr_visited = 0
+    while queue:
+        nr_visited += 1
+        if nr_visited % TIME_CHECK_INTERVAL == 0 and perf_counter() > deadline:
+            return None
+        quantities = queue.popleft()
+        for i in range(nr_containers):
+            if quantities[i] == 0:
+                continue
+            for j in range(nr_containers):
+                if i == j or quantities[j] == capacities[j]:
+                    continue
+                transferred = min(capacities[j] - quantities[j], quantities[i])
+                successor = list(quantities)
+                successor[i] -= transferred
+                successor[j] += transferred
+                index = sum(quantity * stride for quantity, stride in zip(successor, strides))
+                if not reached[index]:
+                    reached[index] = 1
+                    successor = tuple(successor)
+                    reachable.append(successor)
+                    queue.append(successor)
+
+    distances = array('H', [UNREACHABLE]) * size
+    goal_counts = Counter(goal)
+    for quantities in reachable:
+        if holds_goal(quantities, goal_counts):
+            distances[sum(quantity * stride for quantity, stride in zip(quantities, strides))] = 0
+            queue.append(quantities)
+
+    # a pour from i to j moving t ends with i empty or j full, its predecessor had t more in i and t less in j
+    while queue:
+        nr_visited += 1
+        if nr_visited % TIME_CHECK_INTERVAL == 0 and perf_counter() > deadline:
+            return None
+        quantities = queue.popleft()
+        index = sum(quantity * stride for quantity, stride in zip(quantities, strides))
+        distance = distances[index] + 1
+        for i in range(nr_containers):
+            for j in range(nr_containers):
+                if i == j or (quantities[i] != 0 and quantities[j] != capacities[j]):
+                    continue
+                for transferred in range(1, min(quantities[j], capacities[i] - quantities[i]) + 1):
+                    previous = index + transferred * (strides[i] - strides[j])
+                    if reached[previous] and distances[previous] == UNREACHABLE:
+                        distances[previous] = distance
+                        predecessor = list(quantities)
+                        predecessor[i] += transferred
+                        predecessor[j] -= transferred
+                        queue.append(tuple(predecessor))
+    return distances
+
+
+def database_key(capacities: Tuple[int, ...], initial: Tuple[int, ...], goal: Tuple[int, ...]) -> str:
+    return hashlib.sha1(repr((capacities, initial, goal)).encode()).hexdigest()
+
+
+def load_distances(path: str, size: int) -> Optional[array]:
+    """
+        Reads a database saved by `save_distances`, None if it's missing or doesn't have `size` entries
+    """
+    try:
+        with open(path, 'rb') as f_in:
+            header = f_in.read(len(FILE_MAGIC) + 1)
+            distances = array('H')
+            distances.fromfile(f_in, size)
+            if f_in.read(1):
+                return None
+    except (OSError, EOFError):
+        return None
+
+    if header[:len(FILE_MAGIC)] != FILE_MAGIC:
+        return None
+    if header[len(FILE_MAGIC):] != sys.byteorder[0].encode():
+        distances.byteswap()
+    return distances
+
+
+def save_distances(path: str, distances: array) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f_out:
+        f_out.write(FILE_MAGIC + sys.byteorder[0].encode())
+        distances.tofile(f_out)
+    os.replace(temp_path, path)
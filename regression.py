@@ -0,0 +1,140 @@
+"""
+    Goal regression for the bidirectional search. A partial state constrains some containers to an exact
+    (occupied, color) pair or to a quantity of any color (`ANY_COLOR`), the other containers are free.
+    Regressing a partial state through a pour gives the partial states whose every completion is
+    turned by that pour into a completion of the original one.
+"""
+
+from __future__ import annotations
+
+from itertools import permutations
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import graph
+from container import Container, PackedState
+
+ANY_COLOR = None
+
+# (occupied, color or ANY_COLOR)
+Constraint = Tuple[int, Optional[int]]
+# (container index, constraint) pairs sorted by index
+PartialState = Tuple[Tuple[int, Constraint], ...]
+# the constrained indices of a partial state and whether their color is free
+Group = Tuple[Tuple[int, bool], ...]
+
+
+def group_of(partial: PartialState) -> Group:
+    return tuple((idx, color is ANY_COLOR) for idx, (_, color) in partial)
+
+
+def constraints_of(partial: PartialState) -> Tuple[Constraint, ...]:
+    return tuple(constraint for _, constraint in partial)
+
+
+def project(state: PackedState, group: Group) -> Tuple[Constraint, ...]:
+    """
+        The constraints a partial state of `group` needs to have for `state` to be one of its completions
+    """
+    return tuple((state[idx][0], ANY_COLOR) if any_color else state[idx] for idx, any_color in group)
+
+
+class Regression:
+    """
+        Regression of the partial states of one graph. The partial states asking for a color that can't
+        be obtained from the initial colors, or for more liquid than the containers hold, are dropped.
+    """
+
+    def __init__(self, gr: graph.Graph):
+        mix = gr.color_tables.mix
+        codes = list(range(len(mix) - 1)) + [-1]
+        self.capacities = gr.capacities
+        self.total_qty = sum(occupied for occupied, _ in gr.root.state)
+
+        obtainable = {code for _, code in gr.root.state} | {0}
+        new_colors = set(obtainable)
+        while new_colors:
+            new_colors = {mix[code_from][code_to] for code_from in obtainable for code_to in obtainable} - obtainable
+            obtainable |= new_colors
+        self.obtainable = obtainable
+
+        # (color poured, color of the target) pairs giving every color
+        self.mixed_from: Dict[int, List[Tuple[int, int]]] = {code: [] for code in codes}
+        for code_from in codes:
+            if code_from == 0 or code_from not in obtainable:
+                continue
+            for code_to in codes:
+                if code_to in obtainable:
+                    self.mixed_from[mix[code_from][code_to]].append((code_from, code_to))
+
+    def goal_partials(self, final_state: List[Container]) -> List[PartialState]:
+        """
+            Every assignment of the final_state containers to distinct containers able to hold them
+        """
+        goal = [cont.pack() for cont in final_state]
+        partials = set()
+        for indices in permutations(range(len(self.capacities)), len(goal)):
+            if all(occupied <= self.capacities[idx] for idx, (occupied, _) in zip(indices, goal)):
+                partials.add(tuple(sorted(zip(indices, goal))))
+        return sorted(partials)
+
+    def predecessors(self, partial: PartialState) -> Iterator[Tuple[PartialState, int, int]]:
+        """
+            Regresses `partial` through every pour changing one of its constrained containers
+        :return: (predecessor, container_from_idx, container_to_idx) triples
+        """
+        constrained = [idx for idx, _ in partial]
+        for i in range(len(self.capacities)):
+            for j in range(len(self.capacities)):
+                if i != j and (i in constrained or j in constrained):
+                    for predecessor in self.regress(partial, i, j):
+                        yield predecessor, i, j
+
+    def regress(self, partial: PartialState, container_from_idx: int, container_to_idx: int) -> Iterator[PartialState]:
+        constraints = dict(partial)
+        after_from = constraints.pop(container_from_idx, None)
+        after_to = constraints.pop(container_to_idx, None)
+        other_qty = sum(occupied for occupied, _ in constraints.values())
+        cap_from, cap_to = self.capacities[container_from_idx], self.capacities[container_to_idx]
+
+        for occupied_to in range(cap_to):
+            free_space = cap_to - occupied_to
+            for transferred in range(1, free_space + 1):
+                if after_to is not None and after_to[0] != occupied_to + transferred:
+                    continue
+                # the source is emptied unless it fills the target
+                last_from = min(transferred if transferred < free_space else cap_from, cap_from)
+                for occupied_from in range(transferred, last_from + 1):
+                    left = occupied_from - transferred
+                    if after_from is not None and after_from[0] != left:
+                        continue
+                    if other_qty + occupied_from + occupied_to > self.total_qty:
+                        continue
+
+                    for color_from, color_to in self.poured_colors(after_from, after_to, left, occupied_to):
+                        predecessor = dict(constraints)
+                        predecessor[container_from_idx] = (occupied_from, color_from)
+                        predecessor[container_to_idx] = (occupied_to, color_to)
+                        yield tuple(sorted(predecessor.items()))
+
+    def poured_colors(self, after_from: Optional[Constraint], after_to: Optional[Constraint],
+                      left: int, occupied_to: int) -> Iterator[Tuple[Optional[int], Optional[int]]]:
+        """
+            The colors of the source and of the target before a pour leaving `left` in the source
+            and changing a target holding `occupied_to`
+        """
+        color_from = ANY_COLOR
+        if left != 0 and after_from is not None:
+            color_from = after_from[1]
+        if color_from is not ANY_COLOR and color_from not in self.obtainable:
+            return
+
+        if after_to is None or after_to[1] is ANY_COLOR:
+            yield color_from, 0 if occupied_to == 0 else ANY_COLOR
+            return
+
+        for poured, target in self.mixed_from[after_to[1]]:
+            if color_from is not ANY_COLOR and poured != color_from:
+                continue
+            if (target == 0) != (occupied_to == 0):
+                continue
+            yield poured, target
@@ -0,0 +1,377 @@
+"""
+    Long-running solver. Requests are JSON lines read from stdin (answered on stdout) or from the
+    connections of a Unix socket (answered on the same connection), every answer is one JSON line
+    carrying the id of its request, in completion order:
+
+        {"id": 1, "instance": "<text in the input file format>", "algorithm": "a_star", "heuristic": 3}
+        {"id": 2, "path": "input/blocking.txt", "nsol": 2, "timeout": 5, "output": true}
+        {"id": 3, "op": "cancel", "target": 1}
+
+    The id of a solve request, a string or a number, has to differ from the ids of the requests of the
+    same stream still queued or running; requests breaking this are answered with an error.
+
+    The instances are solved by a pool of worker processes. Every request gets its own color service
+    and graph; a worker keeps the compiled color tables of the rule sets and the pattern databases of the
+    quantities it has seen, so requests sharing a rule set or quantities start warm. A request's timeout is enforced by its
+    search budget, a worker not answering `DEADLINE_GRACE` seconds after the timeout is restarted.
+    Cancelling a running request stops its search at the next budget check.
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socketserver
+import sys
+import threading
+from argparse import ArgumentParser
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from multiprocessing.connection import Connection
+from typing import Callable, Dict, List, Optional, Tuple
+
+import color
+import main
+from budget import SearchBudget
+from moves_log import MovesLog
+
+DEFAULT_ALGORITHM = 'a_star'
+DEFAULT_HEURISTIC = 3
+DEADLINE_GRACE = 2.0
+# rule sets whose compiled color service is kept by a worker
+WARM_RULE_SETS = 32
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+STATUS_CANCELLED = 'cancelled'
+STATUS_TIMEOUT = 'timeout'
+
+
+@lru_cache(maxsize=WARM_RULE_SETS)
+def compiled_color_srv(rules: Tuple[Tuple[str, str, str], ...]) -> color.ColorSrv:
+    color_srv = main.create_color_srv(list(rules))
+    color_srv.compile()
+    return color_srv
+
+
+def warm_color_srv(rules: List[Tuple[str, str, str]]) -> color.ColorSrv:
+    """
+        A color service of its own for every request, copied from the compiled one of its rule set
+    """
+    return compiled_color_srv(tuple(rules)).copy()
+
+
+def solve(request: Dict, cancel_event=None) -> Dict:
+    """
+        Solves one request in the current process
+    :return: the answer, without the request id
+    """
+    algorithm = request.get('algorithm', DEFAULT_ALGORITHM)
+    if algorithm not in main.ALGORITHMS:
+        raise ValueError(f"unknown algorithm `{algorithm}`")
+    heuristic = request.get('heuristic', None if algorithm == 'ucs' else DEFAULT_HEURISTIC)
+    nr_sol = request.get('nsol', 1)
+    timeout = request.get('timeout', 0)
+
+    if 'instance' in request:
+        f_in = io.StringIO(request['instance'])
+    else:
+        f_in = open(request['path'])
+    with f_in:
+        gr = main.parse_input(f_in, nr_sol,
+                              main.create_transposition_table(request.get('tt_size', 0), main.DEPTH_PREFERRED),
+                              request.get('symmetry', False), color_srv_factory=warm_color_srv)
+    gr.nogoods = main.create_nogood_cache(request.get('nogood_size', 0))
+    gr.pdb_dir = request.get('pdb_dir')
+    gr.moves_log = MovesLog()
+    gr.moves_log.start_run(algorithm, heuristic)
+    if heuristic is not None:
+        gr.set_heuristic(heuristic)
+
+    output_f = io.StringIO()
+    budget = SearchBudget(timeout, request.get('max_expansions', 0), cancel_event=cancel_event)
+    options = {name: request[name] for name in main.ALGORITHM_OPTIONS.get(algorithm, ()) if name in request}
+    stats = main.ALGORITHMS[algorithm](output_f, gr, nr_sol, timeout, budget=budget, **options)
+
+    answer = {
+        'status': budget.reason or STATUS_OK,
+        'solutions': gr.moves_log.records,
+        'stats': asdict(stats),
+    }
+    if request.get('output'):
+        answer['output'] = output_f.getvalue()
+    return answer
+
+
+def _worker_main(conn: Connection, cancel_event) -> None:
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        try:
+            answer = solve(request, cancel_event)
+        except Exception as error:
+            answer = {'status': STATUS_ERROR, 'error': f"{type(error).__name__}: {error}"}
+        conn.send(answer)
+
+
+@dataclass
+class _Job:
+    request: Dict
+    reply: Callable[[Dict], None]
+    # the stream that sent the request, ids are unique within a stream only
+    owner: object = None
+    cancelled: bool = False
+
+    @property
+    def request_id(self):
+        return self.request['id']
+
+    @property
+    def key(self) -> Tuple[object, object]:
+        return self.owner, self.request_id
+
+
+class _Worker:
+    """
+        One worker process and the thread feeding it the jobs of the service queue
+    """
+
+    def __init__(self, service: 'SolverService'):
+        self.service = service
+        self.cancel_event = multiprocessing.Event()
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        self.start_process()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def start_process(self) -> None:
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main, args=(child_conn, self.cancel_event), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def restart_process(self) -> None:
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+        self.start_process()
+
+    def run(self) -> None:
+        service = self.service
+        while True:
+            job = service.jobs.get()
+            if job is None:
+                try:
+                    self.conn.send(None)
+                except OSError:  # the process was already stopped (signals sent to the process group)
+                    pass
+                self.process.join()
+                return
+
+            with service.lock:
+                service.pending.pop(job.key, None)
+                if job.cancelled:
+                    continue
+                self.cancel_event.clear()
+                service.running[job.key] = self
+
+            # every job taken off the queue is answered exactly once, whatever goes wrong
+            try:
+                answer = self.answer(job)
+            except Exception as error:
+                answer = {'status': STATUS_ERROR, 'error': f"{type(error).__name__}: {error}"}
+            with service.lock:
+                service.running.pop(job.key, None)
+            job.reply(dict(id=job.request_id, **answer))
+
+    def answer(self, job: _Job) -> Dict:
+        timeout = job.request.get('timeout', 0)
+        try:
+            self.conn.send(job.request)
+            if self.conn.poll(timeout + DEADLINE_GRACE if timeout > 0 else None):
+                return self.conn.recv()
+            self.restart_process()
+            return {'status': STATUS_TIMEOUT}
+        except (EOFError, OSError):
+            self.restart_process()
+            return {'status': STATUS_ERROR, 'error': 'the worker process stopped'}
+
+
+class SolverService:
+    """
+        Queue of the solve requests, shared by `workers` worker processes
+    """
+
+    def __init__(self, workers: int):
+        self.jobs: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+        # (owner, request id) -> job or worker
+        self.pending: Dict[Tuple[object, object], _Job] = {}
+        self.running: Dict[Tuple[object, object], _Worker] = {}
+        self.workers = [_Worker(self) for _ in range(workers)]
+
+    def submit(self, request: Dict, reply: Callable[[Dict], None], owner: object = None) -> bool:
+        """
+            Queues a request with an id, `owner` tells apart the requests of different streams
+        :return: False if a request of the owner with the same id is already queued or running
+        """
+        job = _Job(request, reply, owner)
+        with self.lock:
+            if job.key in self.pending or job.key in self.running:
+                return False
+            self.pending[job.key] = job
+        self.jobs.put(job)
+        return True
+
+    def cancel(self, request_id, owner: object = None) -> bool:
+        """
+            Drops a queued request (answered right away) or stops a running one (answered by its worker)
+        :return: False if no such request is queued or running
+        """
+        with self.lock:
+            job = self.pending.pop((owner, request_id), None)
+            if job is not None:
+                job.cancelled = True
+            else:
+                worker = self.running.get((owner, request_id))
+                if worker is None:
+                    return False
+                worker.cancel_event.set()
+                return True
+        job.reply({'id': request_id, 'status': STATUS_CANCELLED})
+        return True
+
+    def close(self) -> None:
+        """
+            Stops the workers once the queued requests are answered
+        """
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.thread.join()
+
+
+# numeric fields of a solve request: (types, smallest value)
+NUMERIC_FIELDS = {
+    'heuristic': ((int,), 0),
+    'nsol': ((int,), 1),
+    'timeout': ((int, float), 0),
+    'max_expansions': ((int,), 0),
+    'tt_size': ((int,), 0),
+    'nogood_size': ((int,), 0),
+    'max_nodes': ((int,), 1),
+    'workers': ((int,), 1),
+    'weight': ((int, float), 1),
+    'weight_step': ((int, float), 0),
+}
+
+
+def valid_id(request_id) -> bool:
+    return isinstance(request_id, (str, int)) and not isinstance(request_id, bool)
+
+
+def field_error(request: Dict) -> Optional[str]:
+    """
+        Checks the numeric fields of a solve request before it's queued
+    :return: what is wrong with the first invalid field, None if they are all valid
+    """
+    for name, (types, minimum) in NUMERIC_FIELDS.items():
+        if name not in request or (name == 'heuristic' and request[name] is None):
+            continue
+        value = request[name]
+        if isinstance(value, bool) or not isinstance(value, types) or value < minimum:
+            kind = 'an integer' if types == (int,) else 'a number'
+            return f"`{name}` has to be {kind} of at least {minimum}, got {json.dumps(value)}"
+    return None
+
+
+def serve_stream(service: SolverService, f_in, f_out) -> None:
+    """
+        Reads the requests of one stream until its end, then waits for their answers
+    """
+    owner = object()
+    write_lock = threading.Lock()
+    outstanding = threading.Semaphore(0)
+    nr_submitted = 0
+
+    def write(answer: Dict) -> None:
+        with write_lock:
+            f_out.write(json.dumps(answer, separators=(',', ':')) + '\n')
+            f_out.flush()
+
+    def reply(answer: Dict) -> None:
+        write(answer)
+        outstanding.release()
+
+    for line in f_in:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('a request is a JSON object')
+        except ValueError as error:
+            write({'id': None, 'status': STATUS_ERROR, 'error': f"invalid request: {error}"})
+            continue
+
+        op = request.get('op', 'solve')
+        if op == 'solve':
+            if not valid_id(request.get('id')):
+                write({'id': request.get('id'), 'status': STATUS_ERROR,
+                       'error': 'a request needs an `id`, a string or a number'})
+            elif field_error(request) is not None:
+                write({'id': request['id'], 'status': STATUS_ERROR, 'error': field_error(request)})
+            elif service.submit(request, reply, owner):
+                nr_submitted += 1
+            else:
+                write({'id': request['id'], 'status': STATUS_ERROR,
+                       'error': f"a request `{request['id']}` is already queued or running"})
+        elif op == 'cancel':
+            found = valid_id(request.get('target')) and service.cancel(request['target'], owner)
+            write({'id': request.get('id'), 'status': STATUS_OK if found else STATUS_ERROR,
+                   **({} if found else {'error': f"no request `{request.get('target')}` is queued or running"})})
+        else:
+            write({'id': request.get('id'), 'status': STATUS_ERROR, 'error': f"unknown op `{op}`"})
+
+    for _ in range(nr_submitted):
+        outstanding.acquire()
+
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        serve_stream(self.server.solver_service, io.TextIOWrapper(self.rfile), io.TextIOWrapper(self.wfile))
+
+
+parser = ArgumentParser(description='Solver service for the water containers problem')
+parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+parser.add_argument('--socket', default=None,
+                    help='Unix socket to listen on, requests are read from stdin without it')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    solver_service = SolverService(max(1, args.jobs))
+    if args.socket is None:
+        serve_stream(solver_service, sys.stdin, sys.stdout)
+        solver_service.close()
+    else:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        # stopping the service with SIGTERM removes the socket as well
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        with socketserver.ThreadingUnixStreamServer(args.socket, _ConnectionHandler) as server:
+            server.solver_service = solver_service
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(args.socket)
+        solver_service.close()
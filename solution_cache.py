@@ -0,0 +1,181 @@
+"""
+    On-disk cache of the output of finished runs. An entry is keyed by a canonical form of the instance
+    (the combination rules by color names, the containers sorted, the final state as a multiset), the
+    algorithm, the heuristic, the number of solutions and the options changing the output, so
+    instances differing only in the order of their containers share their entries. The solutions are
+    stored as moves between canonical container indices and replayed on the instance being solved,
+    the text around them is stored as written. The least recently used entries are evicted once the
+    cache outgrows its size bound.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import asdict
+from typing import Dict, List, Optional, Tuple
+
+import color
+import graph
+import node
+from stats import SearchStats
+
+CACHE_DIR = '.solution_cache'
+CACHE_MAX_MB = 64
+CACHE_VERSION = 1
+
+Moves = List[Tuple[int, int]]
+
+
+def named_rules(color_srv: color.ColorSrv) -> List[Tuple[str, str, str]]:
+    """
+        The combination rules as sorted (ingredient, ingredient, result) names, independent of the color codes
+    """
+    rules = set()
+    for (code_l, code_r), code_f in color_srv.combinations.items():
+        if code_l != code_r:
+            color_l, color_r = sorted((color_srv.get_color(code_l), color_srv.get_color(code_r)))
+            rules.add((color_l, color_r, color_srv.get_color(code_f)))
+    return sorted(rules)
+
+
+def canonical_order(gr: graph.Graph) -> List[int]:
+    """
+        The container indices of the instance sorted by (capacity, occupied, color name)
+    """
+    names = gr.color_tables.names
+    return sorted(range(len(gr.capacities)),
+                  key=lambda idx: (gr.capacities[idx], gr.root.state[idx][0], names[gr.root.state[idx][1]]))
+
+
+def instance_key(gr: graph.Graph, algorithm: str, heuristic: Optional[int], nr_sol: int, options: Dict) -> str:
+    names = gr.color_tables.names
+    containers = [(gr.capacities[idx], gr.root.state[idx][0], names[gr.root.state[idx][1]])
+                  for idx in canonical_order(gr)]
+    final_state = sorted((cont.occupied, names[cont.color]) for cont in gr.final_state)
+    canonical = (CACHE_VERSION, named_rules(gr.color_srv), containers, final_state, algorithm, heuristic, nr_sol,
+                 sorted(options.items()))
+    return hashlib.sha1(repr(canonical).encode()).hexdigest()
+
+
+def replay(gr: graph.Graph, moves: Moves) -> node.Node:
+    current = gr.root
+    for container_from_idx, container_to_idx in moves:
+        current = node.Node(gr, current, container_from_idx, container_to_idx)
+    return current
+
+
+class SolutionRecorder:
+    """
+        File-like object forwarding the output of a run and keeping it for the cache. The paths of the
+        solutions are written with `write_solution`, which streams them and keeps only their moves: the
+        kept text is split in segments around them.
+    """
+
+    def __init__(self, output_f, gr: graph.Graph):
+        self.output_f = output_f
+        self.chunks: List[str] = []
+        self.segments: List[str] = []
+        self.solutions: List[Moves] = []
+        self.to_canonical = {idx: position for position, idx in enumerate(canonical_order(gr))}
+
+    def write(self, text: str) -> int:
+        self.chunks.append(text)
+        return self.output_f.write(text)
+
+    def writelines(self, lines) -> None:
+        for line in lines:
+            self.write(line)
+
+    def write_solution(self, target_node: node.Node) -> None:
+        self.segments.append(''.join(self.chunks))
+        self.chunks = []
+        self.solutions.append([(self.to_canonical[road_node.container_from_idx],
+                                self.to_canonical[road_node.container_to_idx])
+                               for road_node in target_node.road()[1:]])
+        self.output_f.writelines(target_node.iter_road())
+
+    def entry(self, stats: SearchStats) -> Dict:
+        return {
+            'segments': self.segments + [''.join(self.chunks)],
+            'solutions': self.solutions,
+            'stats': asdict(stats),
+        }
+
+
+class SolutionCache:
+    """
+        Entries are JSON files named after their key in `directory`, their modification time
+        is the time of their last use
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_MB << 20, refresh: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # only store the results, existing entries are solved again
+        self.refresh = refresh
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key: str) -> Optional[Dict]:
+        if self.refresh:
+            return None
+        try:
+            with open(self.path(key)) as f_in:
+                entry = json.load(f_in)
+            os.utime(self.path(key))
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key: str, entry: Dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f_out:
+            json.dump(entry, f_out, separators=(',', ':'))
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """
+            Removes the least recently used entries until the cache fits in `max_bytes`
+        """
+        entries = []
+        with os.scandir(self.directory) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name.endswith('.json'):
+                    try:
+                        file_stat = dir_entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((file_stat.st_mtime, file_stat.st_size, dir_entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    @staticmethod
+    def render(output_f, gr: graph.Graph, entry: Dict) -> SearchStats:
+        """
+            Writes the output of a cached run, replaying its solutions on `gr`
+        :return: the statistics of the cached run
+        """
+        order = canonical_order(gr)
+        segments = entry['segments']
+        for solution_nr, moves in enumerate(entry['solutions']):
+            output_f.write(segments[solution_nr])
+            solution = replay(gr, [(order[position_from], order[position_to]) for position_from, position_to in moves])
+            output_f.writelines(solution.iter_road())
+            if gr.moves_log is not None:
+                gr.moves_log.write(solution, solution_nr + 1)
+        output_f.write(segments[-1])
+        return SearchStats(**entry['stats'])
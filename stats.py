@@ -0,0 +1,19 @@
+from dataclasses import dataclass, field
+from typing import List
+
+
+@dataclass
+class SearchStats:
+    """
+        Counters of one run of a search algorithm, returned next to the text written in the output file
+    """
+    nodes_generated: int = 0
+    nodes_expanded: int = 0
+    max_open: int = 0
+    max_closed: int = 0
+    solution_costs: List[int] = field(default_factory=list)
+    # the run was interrupted by the timeout or by a memory bound
+    stopped: bool = False
+    # successors sent to another worker process, and the batches they were sent in (HDA*)
+    nodes_sent: int = 0
+    batches_sent: int = 0
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from typing import List, Optional, Tuple
+
+import node
+from container import PackedState
+
+DEPTH_PREFERRED = 'depth'
+ALWAYS_REPLACE = 'always'
+POLICIES = (DEPTH_PREFERRED, ALWAYS_REPLACE)
+
+# (generation, state hash, state, depth)
+Entry = Tuple[int, int, PackedState, int]
+
+
+class TranspositionTable:
+    """
+        Search-wide, memory bounded map from a state to the lowest depth it was reached at.
+        It replaces walking the ancestors of a node to detect cycles and also prunes
+        re-visits of a state that are not cheaper than a previous visit.
+    """
+
+    def __init__(self, max_entries: int, policy: str = DEPTH_PREFERRED):
+        if max_entries <= 0:
+            raise ValueError('The transposition table needs at least one entry')
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown replacement policy `{policy}`, expected one of {POLICIES}')
+
+        self.max_entries = max_entries
+        self.policy = policy
+        self.slots: List[Optional[Entry]] = [None] * max_entries
+        self.generation = 0
+        self.hits = 0
+        self.collisions = 0
+
+    def clear(self, reset_stats: bool = True) -> None:
+        """
+            Forgets every entry in O(1), entries from older generations are treated as empty slots
+        """
+        self.generation += 1
+        if reset_stats:
+            self.hits = 0
+            self.collisions = 0
+
+    def prune(self, target_node: node.Node) -> Optional[bool]:
+        """
+            Records `target_node` (a node or a `cursor.StateCursor`) and checks if its state
+            was already reached with a lower or equal cost
+
+        Returns
+        -------
+            True if the node is a cycle or a dominated re-visit, False once it's recorded, None if its
+            slot holds another state (kept by the depth-preferred policy, replaced otherwise): the entry
+            of the node may be gone or never made, so the caller has to check its cycles
+        """
+        return self.probe(target_node.state_hash, target_node.graph.state_key(target_node.state),
+                          target_node.cost_from_root)
+
+    def probe(self, state_hash: int, state: tuple, depth: int) -> Optional[bool]:
+        """
+            `prune` for a state that has no node yet, `state` is its `Graph.state_key`
+        """
+        idx = state_hash % self.max_entries
+        entry = self.slots[idx]
+
+        if entry is not None and entry[0] == self.generation:
+            if entry[1] == state_hash and entry[2] == state:
+                if entry[3] <= depth:
+                    self.hits += 1
+                    return True
+            else:
+                # the state may have been evicted from this slot earlier, only its ancestors can tell
+                self.collisions += 1
+                if self.policy == ALWAYS_REPLACE or entry[3] >= depth:
+                    self.slots[idx] = (self.generation, state_hash, state, depth)
+                return None
+
+        self.slots[idx] = (self.generation, state_hash, state, depth)
+        return False